@@ -1,20 +1,95 @@
 import os
 import json
 import logging
+import time
+from snakeai.book import OpeningBook
 from snakeai.heuristic import Heuristic
 from snakeai.snake_ai import SnakeAI
+from snakeai.search import SearchEngine
+from snakeai.mcts import MCTS
+from snakeai.deadline import REQUEST_START_HEADER
+from snakeai.deadline import RequestDeadline
+from snakeai.game_cache import GameCache
+from snakeai.metrics import BOARD
+from snakeai.metrics import CONTENT_TYPE
+from snakeai.metrics import MetricsRegistry
+from snakeai.metrics import PARSE
+from snakeai.metrics import RequestMetrics
+from snakeai.ponder import ActiveRequests
+from snakeai.profiler import SlowRequestProfiles
+from snakeai.shards import GameShards
+from snakeai.warmup import parse_game_config
+from snakeai.warmup import warm_up
 from snakemodel.game import Game
-from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify
+from snakemodel.replay import ReplayLogger
+from snakemodel.snake import Move
+from flask import Flask, Response, request, jsonify
 
 
 app = Flask(__name__)
 
+MCTS_ENGINE = "mcts"
+
+# Worker processes serving the app, set by gunicorn_config.py. Consecutive
+# requests of a game may reach different workers, so with more than one,
+# no GameState is kept between turns and there is no pondering
+web_workers = int(os.environ.get('web_workers', 1))
+
+# Processes the games of a worker are searched in, each serving its share of
+# the games, set by 'search_processes'. With 1, games are searched in the
+# worker itself
+search_processes = int(os.environ.get('search_processes', 1))
+
+# The GameShards of the search processes, once start_worker has been called
+game_shards = None
+
+game_cache = GameCache(max_games=0 if web_workers > 1 else None)
+
+# /move requests being answered, which pondering yields to
+active_requests = ActiveRequests()
+
+metrics_registry = MetricsRegistry()
+
+# Sampled profiles of the slowest 'profile_slowest' /move requests, if set
+slow_profiles = (SlowRequestProfiles(int(os.environ['profile_slowest']))
+                 if os.environ.get('profile_slowest') else None)
+
+# Opening book file, memory mapped once and shared by forked workers, if set
+opening_book = (OpeningBook(os.environ['book'])
+                if os.environ.get('book') else None)
+
+# Replays of our games are written to the 'replay_dir' directory, if set,
+# once start_worker has been called
+replay_logger = None
+
+
+def start_worker():
+    """
+    Start logging and the background threads of a serving process.
+
+    Threads don't survive a fork, so when the app is preloaded by gunicorn,
+    this is called in every worker after it is forked. The search processes
+    are forked before any thread is started.
+    """
+    global game_shards, replay_logger
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    app.logger.addHandler(handler)
+    app.logger.setLevel(logging.INFO)
+    if search_processes > 1:
+        game_shards = GameShards(search_processes)
+    if os.environ.get('replay_dir'):
+        replay_logger = ReplayLogger(os.environ['replay_dir'])
+
 
 @app.route("/start", methods=["POST"])
 def start():
     # NOTE: 'request' contains the data which was sent to us about the Snake
     # game after every POST to our server
+    config = parse_game_config(request.get_json(force=True, silent=True)
+                               or {})
+    if config is not None:
+        prepare_game(config)
     snake = {
         "color": os.environ.get('color', '#ffffff'),
         "name": os.environ.get('name', 'default_snake_boi'),
@@ -23,29 +98,204 @@ def start():
     return jsonify(snake)
 
 
+def prepare_game(config):
+    """
+    Warm up the process of the game of config, and log how long it took.
+    """
+    start_time = time.perf_counter()
+    if game_shards is None:
+        timings = warm_up_game(config)
+    else:
+        timings = game_shards.call(config.game_id, warm_up_game, config)
+    elapsed = time.perf_counter() - start_time
+    metrics_registry.observe_start(elapsed)
+    app.logger.info(
+        "Prepared game %s (%dx%d, %d known snakes) in %.1f ms (%s)",
+        config.game_id, config.width, config.height, len(config.snake_ids),
+        elapsed * 1000, ", ".join(
+            "{} {:.1f} ms".format(step, seconds * 1000)
+            for step, seconds in timings.items()))
+
+
+def warm_up_game(config):
+    """
+    Warm up this process for the game of config. Returns the step timings.
+
+    The GameState of our snake is created right away, if we know its id,
+    and the process pool is started if MCTS searches with one.
+    """
+    if config.you is not None:
+        game_cache.get(config.game_id, config.you)
+    workers = None
+    if os.environ.get('engine') == MCTS_ENGINE:
+        workers = get_mcts_workers()
+    return warm_up(config, create_heuristic(), workers)
+
+
+def get_mcts_workers():
+    """Processes of the MCTS pool, this process's share of the cores."""
+    return max(1, (os.cpu_count() or 1) // (web_workers * search_processes))
+
+
+def get_game_id(data):
+    """Id of the game of the data of a request."""
+    return data.get('game_id', data.get('id', 0))
+
+
+def create_heuristic():
+    """The Heuristic, time aware if 'time_aware' is set."""
+    return Heuristic(time_aware=bool(os.environ.get('time_aware')))
+
+
+def create_engine():
+    """Search engine named by the 'engine' environment variable, if any."""
+    engine = os.environ.get('engine')
+    if engine in [SearchEngine.PARANOID, SearchEngine.MAX_N]:
+        return SearchEngine(engine)
+    return None
+
+
+def create_snake_ai(game, game_state, request_metrics, time_budget):
+    """
+    The AI selected by the 'engine' environment variable.
+
+    It continues from the search state kept for the game in game_state, if
+    any, searches within time_budget, and records its search in
+    request_metrics. With 'time_aware' set, SnakeAI's heuristic lets snake
+    cells be traversed once they are vacated. If time_budget is too small
+    for a full search, SnakeAI is used whatever the engine, to degrade the
+    search. SnakeAI plays the moves of the 'book' opening book, if set,
+    without searching. MCTS runs its playouts over this process's share of
+    the cores.
+    """
+    if (os.environ.get('engine') == MCTS_ENGINE
+            and time_budget >= SnakeAI.SHALLOW_BUDGET):
+        return MCTS(game, time_budget=time_budget,
+                    workers=get_mcts_workers(),
+                    parallelism=os.environ.get('parallelism', MCTS.ROOT),
+                    root=game_state and game_state.mcts_root,
+                    metrics=request_metrics)
+    return SnakeAI(game, create_heuristic(), time_budget=time_budget,
+                   transposition_table=(game_state
+                                        and game_state.transposition_table),
+                   engine=create_engine(),
+                   batch_evaluation=bool(os.environ.get('batch')),
+                   metrics=request_metrics, book=opening_book)
+
+
 @app.route("/move", methods=["POST"])
 def move():
-    data = json.loads(request.data.decode("utf-8"))
+    deadline = RequestDeadline(request.headers.get(REQUEST_START_HEADER))
+    request_metrics = RequestMetrics()
+    # With search processes, only the wait for the search is profiled
+    profiler = slow_profiles.start() if slow_profiles else None
+    data = None
+    start_pondering = None
     try:
-        game = Game(data)
-        heuristic = Heuristic()
-        snake_ai = SnakeAI(game, heuristic)
-        best_move = snake_ai.best_move()
+        with request_metrics.timer(PARSE):
+            data = json.loads(request.data.decode("utf-8"))
+        if game_shards is None:
+            best_move, start_pondering = answer_move(data, deadline,
+                                                     request_metrics)
+        else:
+            best_move, search_metrics = game_shards.call(
+                get_game_id(data), answer_move_in_shard, data, deadline)
+            request_metrics.merge(search_metrics)
     except Exception as exception:
         app.logger.info(data)
         raise exception
+    finally:
+        elapsed = request_metrics.finish()
+        request_metrics.deadline_missed = deadline.is_missed()
+        metrics_registry.observe(request_metrics)
+        if profiler is not None:
+            slow_profiles.record(profiler, elapsed, "game {} turn {}".format(
+                (data or {}).get('id'), (data or {}).get('turn')))
 
-    app.logger.info("{} \n {}".format(data, best_move))
-    response = {
+    if replay_logger is not None:
+        replay_logger.log(data, best_move)
+    response = jsonify({
         "move": best_move
-    }
-    return jsonify(response)
+    })
+    if start_pondering is not None:
+        # Ponder once the response is sent
+        response.call_on_close(start_pondering)
+    return response
+
+
+def answer_move(data, deadline, request_metrics):
+    """
+    Search the /move request of data in this process, within deadline.
+
+    Returns our move, and with 'ponder' set, a function that starts
+    pondering until the next /move of the game, unless that has already
+    arrived, or while other requests are active. It is None otherwise.
+    """
+    with active_requests:
+        with request_metrics.timer(BOARD):
+            game = Game.from_payload(data)
+        game_state = game_cache.advance(game.game_id, game.you, game.board)
+        snake_ai = create_snake_ai(
+            game, game_state, request_metrics,
+            min(deadline.get_time_budget(), SnakeAI.TIME_BUDGET))
+        best_move = snake_ai.best_move()
+        if game_state is not None:
+            game_state.record_search(
+                game.board,
+                snake_ai.root if isinstance(snake_ai, MCTS) else None)
+    if game_state is None or not os.environ.get('ponder'):
+        return best_move, None
+    return best_move, lambda: game_state.start_pondering(
+        snake_ai, Move[best_move.upper()], active_requests)
+
+
+def answer_move_in_shard(data, deadline):
+    """
+    answer_move in the search process of the game of data.
+
+    Pondering starts as soon as the move is returned. Returns our move and
+    the RequestMetrics of the search.
+    """
+    request_metrics = RequestMetrics()
+    best_move, start_pondering = answer_move(data, deadline, request_metrics)
+    if start_pondering is not None:
+        start_pondering()
+    return best_move, request_metrics
+
+
+def end_game(game_id):
+    """Forget the search state of game_id in this process."""
+    game_cache.end_game(game_id)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/metrics/profiles", methods=["GET"])
+def profiles():
+    if slow_profiles is None:
+        return Response("Set profile_slowest to profile /move requests.\n",
+                        status=404, content_type="text/plain")
+    return Response(slow_profiles.render(), content_type="text/plain")
+
+
+@app.route("/end", methods=["POST"])
+def end():
+    data = json.loads(request.data.decode("utf-8"))
+    game_id = get_game_id(data)
+    if game_shards is None:
+        end_game(game_id)
+    else:
+        game_shards.call(game_id, end_game, game_id)
+    if replay_logger is not None:
+        replay_logger.end_game(game_id)
+    return jsonify({})
 
 
 if __name__ == "__main__":
     print("Starting server...")
     port = int(os.environ.get("PORT", 8080))
-    handler = RotatingFileHandler("debug.log")
-    handler.setLevel(logging.INFO)
-    app.logger.addHandler(handler)
+    start_worker()
     app.run(host='0.0.0.0', port=port)
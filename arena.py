@@ -0,0 +1,260 @@
+"""
+Play games between snakes locally, to measure win rates and move latency.
+
+Board is the rules engine, with seeded food spawning, so a run is
+reproducible. A snake is either an in process AI or the URL of a snake
+server, such as app.py. Games run in parallel across processes.
+
+Run with, for example:
+    python arena.py snake_ai mcts http://localhost:8080 --games 20
+"""
+import argparse
+import json
+import random
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from snakeai.game_cache import GameCache
+from snakeai.heuristic import Heuristic
+from snakeai.mcts import MCTS
+from snakeai.search import SearchEngine
+from snakeai.snake_ai import SnakeAI
+from snakemodel.board import Board
+from snakemodel.game import Game
+from snakemodel.snake import Move
+
+IN_PROCESS_PLAYERS = ["snake_ai", "time_aware", SearchEngine.PARANOID,
+                      SearchEngine.MAX_N, "mcts"]
+SIZE = 11
+SNAKE_LENGTH = 3
+FOOD_COUNT = 5
+MAX_TURNS = 500
+HTTP_TIMEOUT = 1.0
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+class InProcessPlayer:
+    """A snake played by one of our AIs, in this process."""
+
+    def __init__(self, kind):
+        if kind not in IN_PROCESS_PLAYERS:
+            raise ValueError("Unknown player: {}".format(kind))
+        self.kind = kind
+        self.game_cache = GameCache()
+
+    def start(self, data):
+        """Start a game."""
+
+    def move(self, data):
+        """Name of the move for the /move request data."""
+        game = Game(data)
+        game_state = self.game_cache.advance(game.game_id, game.you,
+                                             game.board)
+        if self.kind == "mcts":
+            snake_ai = MCTS(game, workers=1, root=game_state.mcts_root)
+        else:
+            snake_ai = SnakeAI(
+                game, Heuristic(time_aware=self.kind == "time_aware"),
+                transposition_table=game_state.transposition_table,
+                engine=(None if self.kind in ["snake_ai", "time_aware"]
+                        else SearchEngine(self.kind)))
+        best_move = snake_ai.best_move()
+        game_state.record_search(
+            game.board, snake_ai.root if self.kind == "mcts" else None)
+        return best_move
+
+    def end(self, data):
+        """End a game."""
+        self.game_cache.end_game(data["id"])
+
+
+class HttpPlayer:
+    """A snake played by a snake server, such as app.py."""
+
+    def __init__(self, url, timeout=HTTP_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, route, data):
+        """POST data as JSON to route and parse the JSON response."""
+        request = urllib.request.Request(
+            self.url + route, data=json.dumps(data).encode("utf-8"),
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def start(self, data):
+        """Start a game."""
+        self._post("/start", data)
+
+    def move(self, data):
+        """Name of the move for the /move request data, or None on errors."""
+        try:
+            return self._post("/move", data)["move"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def end(self, data):
+        """End a game."""
+        try:
+            self._post("/end", data)
+        except (OSError, ValueError):
+            pass
+
+
+def create_player(spec):
+    """An HttpPlayer for a URL, or else an InProcessPlayer."""
+    if spec.startswith("http://") or spec.startswith("https://"):
+        return HttpPlayer(spec)
+    return InProcessPlayer(spec)
+
+
+def create_board_data(game_id, snake_count, size, generator):
+    """
+    Data of a new game, with stacked snakes at random cells, and no food.
+
+    Food is spawned by the Board, so it follows the board's rng.
+    """
+    cells = generator.sample(
+        [(x, y) for x in range(size) for y in range(size)], snake_count)
+    return {
+        "id": game_id,
+        "width": size,
+        "height": size,
+        "turn": 0,
+        "food": {"data": []},
+        "snakes": {"data": [{
+            "id": "snake-{}".format(index),
+            "name": "snake-{}".format(index),
+            "health": 100,
+            "body": {"data": [{"x": x, "y": y}] * SNAKE_LENGTH},
+        } for index, (x, y) in enumerate(cells)]},
+        "dead_snakes": {"data": []},
+    }
+
+
+def play_game(player_specs, seed, size=SIZE, max_turns=MAX_TURNS):
+    """
+    Play one game between the players of player_specs.
+
+    Returns, per player, whether it won, the turns it survived and the
+    latencies of its moves in seconds. A game with no survivor is won by
+    nobody.
+    """
+    generator = random.Random(seed)
+    players = [create_player(spec) for spec in player_specs]
+    board = Board(create_board_data(seed, len(players), size, generator))
+    board.rng = generator
+    for _ in range(FOOD_COUNT):
+        board._spawn_food()
+    snake_ids = list(board.snakes)
+    for player, snake_id in zip(players, snake_ids):
+        player.start(board.to_data(you=snake_id))
+
+    turns_survived = {snake_id: 0 for snake_id in snake_ids}
+    latencies = {snake_id: [] for snake_id in snake_ids}
+    turn = 0
+    while len(board.snakes) > 1 and turn < max_turns:
+        snake_id_move_mapping = {}
+        for player, snake_id in zip(players, snake_ids):
+            if snake_id not in board.snakes:
+                continue
+            data = board.to_data(turn, you=snake_id)
+            start = time.perf_counter()
+            move_name = player.move(data)
+            latencies[snake_id].append(time.perf_counter() - start)
+            snake_id_move_mapping[snake_id] = Move[(
+                move_name or Move.UP.get_move()).upper()]
+        board.update_board(snake_id_move_mapping)
+        turn += 1
+        for snake_id in board.snakes:
+            turns_survived[snake_id] = turn
+
+    for player, snake_id in zip(players, snake_ids):
+        player.end(board.to_data(turn, you=snake_id))
+    winners = list(board.snakes) if len(board.snakes) == 1 else []
+    return [{"won": snake_id in winners,
+             "turns": turns_survived[snake_id],
+             "latencies": latencies[snake_id]}
+            for snake_id in snake_ids]
+
+
+def run_arena(player_specs, games, processes=1, seed=0, size=SIZE,
+              max_turns=MAX_TURNS):
+    """
+    Play games between the players and summarize the results per player.
+
+    Game i is seeded with seed + i, so runs with the same arguments play the
+    same games, as far as the players are deterministic.
+    """
+    seeds = range(seed, seed + games)
+    arguments = ([player_specs] * games, seeds, [size] * games,
+                 [max_turns] * games)
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(play_game, *arguments))
+    else:
+        results = list(map(play_game, *arguments))
+    return summarize(player_specs, results)
+
+
+def summarize(player_specs, results):
+    """Win rate, turns survived and latency percentiles of each player."""
+    summaries = []
+    for index, spec in enumerate(player_specs):
+        player_results = [result[index] for result in results]
+        latencies = np.array([latency for player_result in player_results
+                              for latency in player_result["latencies"]])
+        summary = {
+            "player": spec,
+            "games": len(player_results),
+            "win_rate": (sum(player_result["won"]
+                             for player_result in player_results)
+                         / max(len(player_results), 1)),
+            "mean_turns": float(np.mean([player_result["turns"]
+                                         for player_result in player_results])),
+            "moves": len(latencies),
+        }
+        for percentile in LATENCY_PERCENTILES:
+            summary["p{}_ms".format(percentile)] = (
+                float(np.percentile(latencies, percentile)) * 1000
+                if len(latencies) else 0.0)
+        summaries.append(summary)
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("players", nargs="+",
+                        help="{} or the URL of a snake server".format(
+                            ", ".join(IN_PROCESS_PLAYERS)))
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=SIZE)
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+    parser.add_argument("--json", action="store_true",
+                        help="print the summaries as JSON")
+    args = parser.parse_args()
+
+    summaries = run_arena(args.players, args.games, args.processes,
+                          args.seed, args.size, args.max_turns)
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+        return
+    player_width = max(len(spec) for spec in args.players)
+    columns = ["games", "win_rate", "mean_turns", "moves"] + [
+        "p{}_ms".format(percentile) for percentile in LATENCY_PERCENTILES]
+    print("{:<{}} ".format("player", player_width)
+          + " ".join("{:>10}".format(column) for column in columns))
+    for summary in summaries:
+        print("{:<{}} ".format(summary["player"], player_width) + " ".join(
+            "{:>10.3f}".format(summary[column])
+            if isinstance(summary[column], float)
+            else "{:>10}".format(summary[column])
+            for column in columns))
+
+
+if __name__ == "__main__":
+    main()
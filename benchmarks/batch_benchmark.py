@@ -0,0 +1,69 @@
+"""
+Compare evaluating candidate boards one at a time against in one batch.
+
+Run from the repository root with: python -m benchmarks.batch_benchmark
+"""
+import timeit
+from snakemodel.board import Board
+from snakemodel.snake import Move
+from snakeai.batch import batch_heuristic
+from snakeai.batch import capture_features
+from snakeai.common import DistanceField
+from snakeai.heuristic import Heuristic
+from .boards import random_board_data
+
+BOARD_SIZES = [11, 19]
+BATCH_SIZES = [4, 16, 64]
+SNAKE_COUNT = 4
+SNAKE_LENGTH = 8
+REPEATS = 5
+
+
+def candidate_boards(board, snake_id, count):
+    """Copies of board after each move of snake_id, repeated up to count."""
+    boards = []
+    while len(boards) < count:
+        for move in Move:
+            boards.append(board.copy().update_board({snake_id: move}))
+    return boards[:count]
+
+
+def evaluate_one_at_a_time(heuristic, snake_id, boards):
+    """The per board heuristic, without the memoized distance fields."""
+    evaluations = []
+    for board in boards:
+        if snake_id in board.dead_snakes:
+            evaluations.append(heuristic.LARGE_PENALTY)
+            continue
+        DistanceField(board, board.snakes[snake_id].head)
+        evaluations.append(heuristic.heuristic(snake_id, board))
+    return evaluations
+
+
+def best_time(function, number):
+    """Best time per call of function(), in milliseconds."""
+    timer = timeit.Timer(function)
+    return min(timer.repeat(REPEATS, number)) / number * 1000
+
+
+def main():
+    heuristic = Heuristic()
+    print("{:>6} {:>6} {:>14} {:>14}".format(
+        "size", "boards", "one by one ms", "batch ms"))
+    for size in BOARD_SIZES:
+        board = Board(random_board_data(size, SNAKE_COUNT, SNAKE_LENGTH))
+        snake_id = next(iter(board.snakes))
+        for batch_size in BATCH_SIZES:
+            boards = candidate_boards(board, snake_id, batch_size)
+            number = max(1, 200 // batch_size)
+            print("{:>6} {:>6} {:>14.3f} {:>14.3f}".format(
+                "{0}x{0}".format(size), batch_size,
+                best_time(lambda: evaluate_one_at_a_time(
+                    heuristic, snake_id, boards), number),
+                best_time(lambda: batch_heuristic(
+                    heuristic, [capture_features(candidate_board, snake_id)
+                                for candidate_board in boards]), number)))
+
+
+if __name__ == "__main__":
+    main()
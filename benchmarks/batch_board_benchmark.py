@@ -0,0 +1,62 @@
+"""
+Compare game steps per second of Board.update_board and BatchBoard.step.
+
+Run from the repository root with: python -m benchmarks.batch_board_benchmark
+"""
+import time
+import numpy as np
+from snakemodel.batch_board import BatchBoard
+from snakemodel.batch_board import MOVES
+from snakemodel.board import Board
+from .boards import random_board_data
+
+GAME_COUNTS = [1, 100, 1000]
+SIZE = 11
+SNAKE_COUNT = 4
+SNAKE_LENGTH = 5
+TURNS = 50
+
+
+def board_steps_per_second(data, game_count, generator):
+    """Steps per second of update_board, one game at a time."""
+    boards = [Board(data) for _ in range(game_count)]
+    snake_ids = list(boards[0].snakes)
+    batch_board = BatchBoard.from_boards(boards, snake_ids)
+    moves = [batch_board.random_moves(generator) for _ in range(TURNS)]
+    steps = 0
+    start = time.perf_counter()
+    for turn_moves in moves:
+        for game, board in enumerate(boards):
+            board.update_board(
+                {snake_id: MOVES[turn_moves[game, snake_index]]
+                 for snake_index, snake_id in enumerate(snake_ids)
+                 if snake_id in board.snakes})
+            steps += 1
+    return steps / (time.perf_counter() - start)
+
+
+def batch_steps_per_second(data, game_count, generator):
+    """Steps per second of BatchBoard.step, all games at once."""
+    boards = [Board(data) for _ in range(game_count)]
+    batch_board = BatchBoard.from_boards(boards, list(boards[0].snakes))
+    start = time.perf_counter()
+    for _ in range(TURNS):
+        batch_board.step(batch_board.random_moves(generator))
+    return game_count * TURNS / (time.perf_counter() - start)
+
+
+def main():
+    data = random_board_data(SIZE, SNAKE_COUNT, SNAKE_LENGTH)
+    print("{:>6} {:>18} {:>18}".format(
+        "games", "Board steps/s", "BatchBoard steps/s"))
+    for game_count in GAME_COUNTS:
+        print("{:>6} {:>18.0f} {:>18.0f}".format(
+            game_count,
+            board_steps_per_second(
+                data, game_count, np.random.RandomState(0)),
+            batch_steps_per_second(
+                data, game_count, np.random.RandomState(0))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import random
+
+
+def random_board_data(size, snake_count, snake_length, food_count=10,
+                      seed=0):
+    """
+    Generate a /move request for a size x size board with random snakes.
+
+    Snakes are placed as random self avoiding walks that do not overlap. A
+    walk that gets stuck is retried from another cell.
+    """
+    generator = random.Random(seed)
+    occupied = set()
+    snakes = []
+    for index in range(snake_count):
+        body = _random_walk(generator, size, snake_length, occupied)
+        occupied.update(body)
+        snakes.append({
+            "id": "snake-{}".format(index),
+            "name": "snake-{}".format(index),
+            "health": generator.randint(50, 100),
+            "body": {"data": [{"x": x, "y": y} for x, y in body]},
+        })
+    free_cells = [(x, y) for x in range(size) for y in range(size)
+                  if (x, y) not in occupied]
+    food = generator.sample(free_cells, min(food_count, len(free_cells)))
+    return {
+        "game_id": seed,
+        "width": size,
+        "height": size,
+        "turn": 0,
+        "food": {"data": [{"x": x, "y": y} for x, y in food]},
+        "snakes": {"data": snakes},
+        "dead_snakes": {"data": []},
+        "you": snakes[0],
+    }
+
+
+def _random_walk(generator, size, length, occupied):
+    """A self avoiding walk of length cells that avoids occupied cells."""
+    while True:
+        start = (generator.randrange(size), generator.randrange(size))
+        if start in occupied:
+            continue
+        body = [start]
+        while len(body) < length:
+            x, y = body[-1]
+            neighbours = [(x + dx, y + dy)
+                          for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]
+                          if 0 <= x + dx < size and 0 <= y + dy < size
+                          and (x + dx, y + dy) not in occupied
+                          and (x + dx, y + dy) not in body]
+            if not neighbours:
+                break
+            body.append(generator.choice(neighbours))
+        if len(body) == length:
+            return body
@@ -0,0 +1,99 @@
+"""
+Record a corpus of /move payloads, for the benchmarks.
+
+By default the payloads are generated from seeded games: snakes play random
+moves that avoid walls and bodies when they can, with seeded food spawning,
+across board sizes and snake counts. With --replays, they are the requests
+of real games instead, from the replays the app writes to its 'replay_dir'.
+Positions are recorded at a few turns of every game.
+
+Regenerate from the repository root with: python -m benchmarks.corpus
+"""
+import argparse
+import glob
+import json
+import os
+import random
+from arena import create_board_data
+from snakemodel.board import Board
+from snakemodel.replay import REPLAY_EXTENSION
+from snakemodel.replay import ReplayReader
+from snakeai.mcts import _random_move
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), "corpus.json")
+BOARD_SIZES = [7, 11, 19]
+SNAKE_COUNTS = [2, 4, 8]
+RECORDED_TURNS = [5, 20, 60]
+FOOD_COUNT = 5
+
+
+def record_game(size, snake_count, seed):
+    """
+    Payloads recorded at RECORDED_TURNS of one seeded game.
+
+    Each payload is for the first snake still alive at that turn.
+    """
+    generator = random.Random(seed)
+    board = Board(create_board_data(seed, snake_count, size, generator))
+    board.rng = generator
+    for _ in range(FOOD_COUNT):
+        board._spawn_food()
+    payloads = []
+    for turn in range(max(RECORDED_TURNS) + 1):
+        if len(board.snakes) < 2:
+            break
+        if turn in RECORDED_TURNS:
+            payloads.append(board.to_data(turn, you=next(iter(board.snakes))))
+        board.update_board({snake_id: _random_move(board, snake_id, generator)
+                            for snake_id in board.snakes})
+    return payloads
+
+
+def record_corpus(seed=0):
+    """Payloads of one game per board size and snake count."""
+    return [payload
+            for size in BOARD_SIZES
+            for snake_count in SNAKE_COUNTS
+            for payload in record_game(size, snake_count,
+                                       seed + size * 100 + snake_count)]
+
+
+def record_replays(replay_dir):
+    """Payloads recorded at RECORDED_TURNS of every replay in replay_dir."""
+    payloads = []
+    for replay_path in sorted(glob.glob(os.path.join(
+            replay_dir, "*" + REPLAY_EXTENSION))):
+        reader = ReplayReader(replay_path)
+        payloads.extend(reader.get_data(turn) for turn in RECORDED_TURNS
+                        if turn in reader.turns)
+    return payloads
+
+
+def load_corpus(path=CORPUS_FILE):
+    """Load the recorded payloads."""
+    with open(path, "r") as corpus_file:
+        return json.load(corpus_file)
+
+
+def get_group(payload):
+    """Name of the group of a payload: its board size and snake count."""
+    return "{}x{}/{}".format(payload["width"], payload["height"],
+                             len(payload["snakes"]["data"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--replays",
+                        help="directory of replays to record instead")
+    parser.add_argument("--output", default=CORPUS_FILE)
+    args = parser.parse_args()
+
+    corpus = (record_replays(args.replays) if args.replays
+              else record_corpus())
+    with open(args.output, "w") as corpus_file:
+        json.dump(corpus, corpus_file, separators=(",", ":"))
+    print("Recorded {} payloads to {}".format(len(corpus), args.output))
+
+
+if __name__ == "__main__":
+    main()
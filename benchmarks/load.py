@@ -0,0 +1,124 @@
+"""
+Load a snake server with concurrent /move requests from the corpus.
+
+Every client sends the recorded payloads one after the other, as a game
+server would for one game, with all the clients running at once. Latencies
+are measured from sending a request to receiving its answer, and answers
+later than the deadline are counted as misses. Requests carry an
+X-Request-Start header, so the server can account for queueing.
+
+Start the server, for example with gunicorn, then run from the repository
+root with:
+    python -m benchmarks.load --url http://localhost:8080 --concurrency 8
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from snakeai.deadline import MOVE_DEADLINE
+from snakeai.deadline import REQUEST_START_HEADER
+from .corpus import CORPUS_FILE
+from .corpus import load_corpus
+
+URL = "http://localhost:8080"
+CONCURRENCY = 4
+REQUESTS = 100
+TIMEOUT = 5.0
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+def send_move(url, payload, timeout=TIMEOUT):
+    """
+    POST payload to the /move route of url.
+
+    Returns the latency in seconds, and whether a move was answered.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    start = time.time()
+    request = urllib.request.Request(
+        url.rstrip("/") + "/move", data=body, headers={
+            "Content-Type": "application/json",
+            REQUEST_START_HEADER: "t={}".format(int(start * 1000)),
+        })
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            answered = "move" in json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        answered = False
+    return time.time() - start, answered
+
+
+def run_client(url, payloads, client, request_count):
+    """
+    Send request_count /move requests one after the other, cycling payloads.
+
+    Each client plays its own games, so their ids are made unique per
+    client. Returns the (latency, answered) of every request.
+    """
+    results = []
+    for index in range(request_count):
+        payload = dict(payloads[index % len(payloads)])
+        payload["id"] = "load-{}-{}".format(client, payload.get("id", 0))
+        results.append(send_move(url, payload))
+    return results
+
+
+def run_load(url, payloads, concurrency, request_count):
+    """
+    Send request_count requests from concurrency clients at once.
+
+    Returns the (latency, answered) of every request and the elapsed
+    seconds.
+    """
+    counts = [request_count // concurrency
+              + (client < request_count % concurrency)
+              for client in range(concurrency)]
+    start = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = [executor.submit(run_client, url, payloads, client, count)
+                   for client, count in enumerate(counts)]
+        results = [result for future in futures for result in future.result()]
+    return results, time.time() - start
+
+
+def summarize(results, elapsed, deadline=MOVE_DEADLINE):
+    """Latency percentiles, deadline misses and errors of a load run."""
+    latencies = np.array([latency for latency, _ in results])
+    summary = {
+        "requests": len(results),
+        "errors": sum(1 for _, answered in results if not answered),
+        "deadline_misses": int((latencies > deadline).sum()),
+        "requests_per_second": len(results) / elapsed if elapsed else 0.0,
+    }
+    for percentile in LATENCY_PERCENTILES:
+        summary["p{}_ms".format(percentile)] = (
+            float(np.percentile(latencies, percentile)) * 1000
+            if len(latencies) else 0.0)
+    summary["max_ms"] = float(latencies.max()) * 1000 if len(latencies) else 0.0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--corpus", default=CORPUS_FILE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--deadline", type=float, default=MOVE_DEADLINE,
+                        help="seconds after which an answer is a miss")
+    args = parser.parse_args()
+
+    results, elapsed = run_load(args.url, load_corpus(args.corpus),
+                                args.concurrency, args.requests)
+    summary = summarize(results, elapsed, args.deadline)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    if summary["errors"] == summary["requests"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
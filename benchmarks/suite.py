@@ -0,0 +1,257 @@
+"""
+Time the model and AI hot paths on the corpus of /move payloads.
+
+Every benchmark is timed separately on every payload, and the per call times
+are summarized per board size and snake count. Results are written as JSON,
+and can be compared against the results of a baseline run, exiting with an
+error if any benchmark got slower by more than the threshold.
+
+Run from the repository root with:
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+from snakemodel.board import Board
+from snakemodel.game import Game
+from snakemodel.parse import parse_payload
+from snakeai import common
+from snakeai import threat
+from snakeai.common import DistanceField
+from snakeai.common import get_legal_moves
+from snakeai.common import get_travel_distance
+from snakeai.common import safe_square_count
+from snakeai.heuristic import Heuristic
+from snakeai.snake_ai import SnakeAI
+from snakemodel.snake import Move
+from .corpus import CORPUS_FILE
+from .corpus import get_group
+from .corpus import load_corpus
+
+REPEATS = 5
+TARGET_TIME = 0.02
+THRESHOLD = 0.1
+# Large enough for every search to complete the heuristic's DEPTH
+BEST_MOVE_BUDGET = 60.0
+
+
+def _get_moves(board):
+    """The first legal move of every snake, to step the board with."""
+    return {snake_id: (get_legal_moves(board, snake_id) or [Move.UP])[0]
+            for snake_id in board.snakes}
+
+
+def _clear_caches():
+    """Forget memoized distance fields and threat maps, within a call."""
+    common._distance_fields.clear()
+    threat._threat_maps.clear()
+
+
+def bench_board_parse(payload):
+    """Board.__init__ parsing the payload."""
+    return None, lambda _: Board(payload)
+
+
+def bench_fast_parse(payload):
+    """Board.from_arrays of parse_payload, the parsing of Game.from_payload."""
+    return None, lambda _: Board.from_arrays(parse_payload(payload))
+
+
+def bench_update_board(payload):
+    """Board.update_board on a fresh copy of the board."""
+    board = Board(payload)
+    moves = _get_moves(board)
+    return board.copy, lambda board_copy: board_copy.update_board(moves)
+
+
+def bench_simulate_moves(payload):
+    """Game.simulate_moves, which copies the board and updates the copy."""
+    game = Game(payload)
+    moves = _get_moves(game.board)
+    return None, lambda _: game.simulate_moves(game.board, moves)
+
+
+def bench_safe_square_count(payload):
+    """safe_square_count from our head."""
+    game = Game(payload)
+    head = game.board.snakes[game.you].head
+    return None, lambda _: safe_square_count(game.board, head)
+
+
+def bench_get_travel_distance(payload):
+    """get_travel_distance from our head to our tail."""
+    game = Game(payload)
+    snake = game.board.snakes[game.you]
+    return None, lambda _: get_travel_distance(
+        game.board, snake.head, snake.body[-1])
+
+
+def bench_timed_distance_field(payload):
+    """Timed DistanceField from our head, with reachability and distances."""
+    game = Game(payload)
+    head = game.board.snakes[game.you].head
+    return None, lambda _: DistanceField(game.board, head, timed=True)
+
+
+def bench_heuristic(payload):
+    """Heuristic.heuristic of the board, without memoized distance fields."""
+    game = Game(payload)
+    heuristic = Heuristic()
+
+    def evaluate(_):
+        _clear_caches()
+        return heuristic.heuristic(game.you, game.board)
+    return None, evaluate
+
+
+def bench_best_move(payload):
+    """
+    SnakeAI.best_move to the heuristic's full DEPTH, with fresh caches.
+
+    The time budget never runs out, so every call does the same search. With
+    the default budget, the anytime search would stop at its deadline and
+    time the budget rather than the search.
+    """
+    game = Game(payload)
+
+    def best_move(_):
+        _clear_caches()
+        return SnakeAI(game, Heuristic(),
+                       time_budget=BEST_MOVE_BUDGET).best_move()
+    return None, best_move
+
+
+BENCHMARKS = OrderedDict([
+    ("board_parse", bench_board_parse),
+    ("fast_parse", bench_fast_parse),
+    ("update_board", bench_update_board),
+    ("simulate_moves", bench_simulate_moves),
+    ("safe_square_count", bench_safe_square_count),
+    ("get_travel_distance", bench_get_travel_distance),
+    ("timed_distance_field", bench_timed_distance_field),
+    ("heuristic", bench_heuristic),
+    ("best_move", bench_best_move),
+])
+
+
+def time_calls(setup, function, repeats=REPEATS, target_time=TARGET_TIME):
+    """
+    Per call times of function, in seconds, one sample per repeat.
+
+    Each sample averages enough calls to take about target_time. If setup is
+    given, its result for each call is made before timing and passed to
+    function, otherwise function gets None.
+    """
+    start = time.perf_counter()
+    function(setup() if setup else None)
+    number = max(1, int(target_time / max(time.perf_counter() - start,
+                                          1e-9)))
+    samples = []
+    for _ in range(repeats):
+        arguments = [setup() if setup else None for _ in range(number)]
+        start = time.perf_counter()
+        for argument in arguments:
+            function(argument)
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+
+def summarize(samples):
+    """Statistical summary of per call times, in milliseconds."""
+    milliseconds = [sample * 1000 for sample in samples]
+    return {
+        "n": len(milliseconds),
+        "mean_ms": statistics.mean(milliseconds),
+        "median_ms": statistics.median(milliseconds),
+        "stdev_ms": (statistics.stdev(milliseconds)
+                     if len(milliseconds) > 1 else 0.0),
+        "min_ms": min(milliseconds),
+        "max_ms": max(milliseconds),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+    }
+
+
+def run_suite(corpus, benchmark_names=None, repeats=REPEATS):
+    """Summaries of the per call times of each benchmark, by group."""
+    results = OrderedDict()
+    for name in benchmark_names or BENCHMARKS:
+        samples_by_group = OrderedDict()
+        for payload in corpus:
+            setup, function = BENCHMARKS[name](payload)
+            samples_by_group.setdefault(get_group(payload), []).extend(
+                time_calls(setup, function, repeats))
+        results[name] = OrderedDict(
+            (group, summarize(samples))
+            for group, samples in samples_by_group.items())
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Regressions of results against baseline.
+
+    Runs are compared by their fastest samples, which are the least
+    disturbed by the rest of the machine. A benchmark regressed in a group if
+    it got slower than the baseline by more than threshold, as a fraction.
+    Returns (benchmark, group, baseline time, time) tuples, in milliseconds.
+    """
+    regressions = []
+    for name, groups in results.items():
+        for group, summary in groups.items():
+            baseline_summary = baseline.get(name, {}).get(group)
+            if baseline_summary is None:
+                continue
+            baseline_time = baseline_summary["min_ms"]
+            if summary["min_ms"] > (1 + threshold) * baseline_time:
+                regressions.append((name, group, baseline_time,
+                                    summary["min_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=CORPUS_FILE)
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--baseline",
+                        help="results to compare against, from --output")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    results = run_suite(load_corpus(args.corpus), args.benchmarks,
+                        args.repeats)
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, group, baseline_min, fastest in regressions:
+            print("REGRESSION {} {}: fastest {:.3f} ms -> {:.3f} ms".format(
+                name, group, baseline_min, fastest), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Compare the Voronoi evaluator against flood filling from every head.
+
+Run from the repository root with: python -m benchmarks.voronoi_benchmark
+"""
+import timeit
+from snakemodel.board import Board
+from snakeai.common import safe_square_count
+from snakeai.voronoi import voronoi_partition
+from .boards import random_board_data
+
+BOARD_SIZES = [11, 19, 25]
+SNAKE_COUNT = 8
+SNAKE_LENGTH = 8
+REPEATS = 5
+
+
+def flood_fill_all_heads(board):
+    """The existing flood fill, run from the head of every snake."""
+    return {snake.id: safe_square_count(board, snake.head)
+            for snake in board.get_snakes()}
+
+
+def best_time(function, board, number):
+    """Best time per call of function(board), in milliseconds."""
+    timer = timeit.Timer(lambda: function(board))
+    return min(timer.repeat(REPEATS, number)) / number * 1000
+
+
+def main():
+    print("{:>6} {:>14} {:>14}".format("size", "flood fill ms", "voronoi ms"))
+    for size in BOARD_SIZES:
+        board = Board(random_board_data(size, SNAKE_COUNT, SNAKE_LENGTH))
+        number = max(1, 2000 // (size * size))
+        print("{:>6} {:>14.3f} {:>14.3f}".format(
+            "{0}x{0}".format(size),
+            best_time(flood_fill_all_heads, board, number),
+            best_time(voronoi_partition, board, number)))
+
+
+if __name__ == "__main__":
+    main()
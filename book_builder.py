@@ -0,0 +1,150 @@
+"""
+Build an opening book by searching early game positions deeply.
+
+Positions come from seeded self-play games, whose snakes spawn at random
+cells like in the arena and play the searched moves, and optionally from the
+replays of real games, written by app.py with replay_dir. Every snake of
+every position up to the last turn is searched once per canonical position,
+and the moves are written to a book that app.py reads with the 'book'
+environment variable.
+
+Run with, for example:
+    python book_builder.py opening.book --sizes 11 19 --snakes 2 4 8
+"""
+import argparse
+import glob
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from arena import FOOD_COUNT
+from arena import create_board_data
+from snakeai.book import get_canonical_key
+from snakeai.book import transform_move
+from snakeai.book import untransform_move
+from snakeai.book import write_book
+from snakeai.heuristic import Heuristic
+from snakeai.snake_ai import SnakeAI
+from snakemodel.board import Board
+from snakemodel.game import Game
+from snakemodel.replay import REPLAY_EXTENSION
+from snakemodel.replay import ReplayReader
+from snakemodel.snake import Move
+
+SIZES = [11]
+SNAKE_COUNTS = [2, 4]
+GAMES = 20
+TURNS = 10
+DEPTH = 6
+TIME_BUDGET = 1.0
+
+
+def search_position(board, snake_id, turn, entries, depth, time_budget):
+    """
+    The searched Move of snake_id on board, adding it to entries.
+
+    Positions already in entries are not searched again.
+    """
+    key, transform = get_canonical_key(board, snake_id)
+    if key not in entries:
+        heuristic = Heuristic()
+        heuristic.DEPTH = depth
+        move_name = SnakeAI(Game(board.to_data(turn, you=snake_id)),
+                            heuristic, time_budget=time_budget).best_move()
+        entries[key] = transform_move(transform, Move[move_name.upper()])
+    return untransform_move(transform, entries[key])
+
+
+def search_self_play(size, snake_count, seed, turns, depth, time_budget):
+    """Book entries of the first turns of a seeded self-play game."""
+    generator = random.Random(seed)
+    board = Board(create_board_data(seed, snake_count, size, generator))
+    board.rng = generator
+    for _ in range(FOOD_COUNT):
+        board._spawn_food()
+    entries = {}
+    for turn in range(turns + 1):
+        if len(board.snakes) < 2:
+            break
+        snake_id_move_mapping = {
+            snake_id: search_position(board, snake_id, turn, entries, depth,
+                                      time_budget)
+            for snake_id in list(board.snakes)}
+        board.update_board(snake_id_move_mapping)
+    return entries
+
+
+def search_replay(path, turns, depth, time_budget):
+    """Book entries of the first turns of a replay, for every snake."""
+    reader = ReplayReader(path)
+    entries = {}
+    for turn in reader.turns:
+        if turn > turns:
+            break
+        board = Board(reader.get_data(turn))
+        for snake_id in list(board.snakes):
+            search_position(board, snake_id, turn, entries, depth,
+                            time_budget)
+    return entries
+
+
+def build_book(path, sizes=SIZES, snake_counts=SNAKE_COUNTS, games=GAMES,
+               turns=TURNS, depth=DEPTH, time_budget=TIME_BUDGET,
+               replay_dir=None, processes=1, seed=0):
+    """
+    Search the positions of self-play games and replays into a book at path.
+
+    Returns the number of positions in the book.
+    """
+    tasks = [(search_self_play, (size, snake_count, seed + game, turns,
+                                 depth, time_budget))
+             for size in sizes for snake_count in snake_counts
+             for game in range(games)]
+    if replay_dir is not None:
+        tasks.extend(
+            (search_replay, (replay_path, turns, depth, time_budget))
+            for replay_path in sorted(glob.glob(os.path.join(
+                replay_dir, "*" + REPLAY_EXTENSION))))
+    entries = {}
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(function, *arguments)
+                       for function, arguments in tasks]
+            results = [future.result() for future in futures]
+    else:
+        results = [function(*arguments) for function, arguments in tasks]
+    for task_entries in results:
+        for key, move in task_entries.items():
+            entries.setdefault(key, move)
+    write_book(path, entries, turns)
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("book", help="file to write the book to")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--snakes", type=int, nargs="+",
+                        default=SNAKE_COUNTS)
+    parser.add_argument("--games", type=int, default=GAMES,
+                        help="self-play games per size and snake count")
+    parser.add_argument("--turns", type=int, default=TURNS,
+                        help="last turn of the positions to search")
+    parser.add_argument("--depth", type=int, default=DEPTH)
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET,
+                        help="seconds to search each position for")
+    parser.add_argument("--replays", help="directory of replays to add")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = build_book(args.book, args.sizes, args.snakes, args.games,
+                       args.turns, args.depth, args.time_budget, args.replays,
+                       args.processes, args.seed)
+    print("Wrote {} positions to {} in {:.1f} s".format(
+        count, args.book, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
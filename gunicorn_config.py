@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for serving app.py in production.
+
+Run from the repository root with:
+    gunicorn --config gunicorn_config.py app:app
+
+One worker answers requests from a thread each, and searches them in
+SEARCH_PROCESSES processes, one per core by default. Every game is searched
+by the process its id hashes to, so its turns find the GameCache,
+transposition tables and ponderer of the turns before, while the games of
+different processes are searched on different cores. MCTS gives each
+process its share of the cores. The app is preloaded, so snakeai,
+snakemodel and numpy are imported once, before the processes are forked.
+
+With WEB_CONCURRENCY set to more than one worker, consecutive requests of a
+game may reach different workers, so the app keeps no search state between
+turns and doesn't ponder.
+"""
+import multiprocessing
+import os
+
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", 8080))
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 2 * multiprocessing.cpu_count()))
+preload_app = True
+# Searches answer within their deadline, so a slow request is a hung worker
+timeout = 10
+keepalive = 5
+accesslog = "-"
+
+# Read by the app when it is preloaded, and inherited by the workers
+os.environ["web_workers"] = str(workers)
+os.environ["search_processes"] = os.environ.get(
+    "SEARCH_PROCESSES", str(multiprocessing.cpu_count()))
+
+
+def post_fork(server, worker):
+    """Start the search processes and threads of the app in the new worker."""
+    import app
+    app.start_worker()
@@ -0,0 +1,138 @@
+from collections import namedtuple
+import numpy as np
+from .common import CANT_FIND
+from .voronoi import _dilate
+from .voronoi import mask_to_array
+
+BoardFeatures = namedtuple(
+    "BoardFeatures",
+    "width, height, body_mask, food_mask, head, tail, health, length, alive")
+
+# Channels of the tensors made by stack_features
+FREE, FOOD, HEAD, TAIL = range(4)
+CHANNEL_COUNT = 4
+
+
+def capture_features(board, snake_id):
+    """
+    The parts of board that the batched heuristic needs, for snake_id.
+
+    Features are plain values, so they stay valid after the board is undone.
+    """
+    if snake_id in board.dead_snakes:
+        return BoardFeatures(board.width, board.height, board.body_mask,
+                             board.food_mask, None, None, 0, 0, False)
+    snake = board.snakes[snake_id]
+    return BoardFeatures(
+        board.width, board.height, board.body_mask, board.food_mask,
+        (snake.head.x, snake.head.y), (snake.body[-1].x, snake.body[-1].y),
+        snake.health_points, len(snake.body), True)
+
+
+def stack_features(features):
+    """
+    Stack the features of boards of one size into an N x C x H x W tensor.
+
+    The channels are the FREE cells, the FOOD, and the HEAD and TAIL of the
+    evaluated snake.
+    """
+    width, height = features[0].width, features[0].height
+    tensor = np.zeros((len(features), CHANNEL_COUNT, height, width),
+                      dtype=bool)
+    for index, board_features in enumerate(features):
+        tensor[index, FREE] = ~mask_to_array(
+            board_features.body_mask, width, height)
+        tensor[index, FOOD] = mask_to_array(
+            board_features.food_mask, width, height)
+        if board_features.alive:
+            head_x, head_y = board_features.head
+            tail_x, tail_y = board_features.tail
+            tensor[index, HEAD, head_y, head_x] = True
+            tensor[index, TAIL, tail_y, tail_x] = True
+    return tensor
+
+
+def batch_distances(tensor):
+    """
+    Travel distances from the HEAD of every board, without crossing snakes.
+
+    All the boards are searched at once, one array dilation per step.
+    Unreachable cells are CANT_FIND, like DistanceField.distances.
+    """
+    free = tensor[:, FREE]
+    frontiers = tensor[:, HEAD].copy()
+    reached = frontiers.copy()
+    distances = np.full(frontiers.shape, CANT_FIND, dtype=np.int64)
+    distances[frontiers] = 0
+    step = 0
+    while frontiers.any():
+        step += 1
+        frontiers = _dilate(frontiers) & free & ~reached
+        distances[frontiers] = step
+        reached |= frontiers
+    return distances
+
+
+def batch_travel_distances(distances):
+    """
+    Travel distances to every cell, like DistanceField.distance_to.
+
+    Cells that can't be reached, such as snake cells, are reached through
+    their nearest reachable neighbour.
+    """
+    neighbours = np.full_like(distances, CANT_FIND)
+    np.minimum(neighbours[:, 1:, :], distances[:, :-1, :],
+               out=neighbours[:, 1:, :])
+    np.minimum(neighbours[:, :-1, :], distances[:, 1:, :],
+               out=neighbours[:, :-1, :])
+    np.minimum(neighbours[:, :, 1:], distances[:, :, :-1],
+               out=neighbours[:, :, 1:])
+    np.minimum(neighbours[:, :, :-1], distances[:, :, 1:],
+               out=neighbours[:, :, :-1])
+    return np.where(distances < CANT_FIND, distances,
+                    np.minimum(neighbours + 1, CANT_FIND))
+
+
+def can_batch(heuristic):
+    """Return True if batch_heuristic computes the tasks of heuristic."""
+    return (not heuristic.use_voronoi and not heuristic.time_aware
+            and heuristic.tasks == [heuristic.tail_distance_score,
+                                    heuristic.space_score,
+                                    heuristic.food_score])
+
+
+def batch_heuristic(heuristic, features):
+    """
+    Evaluate many boards at once with the default tasks of heuristic.
+
+    Returns an N x 3 array whose rows equal heuristic.heuristic of the boards
+    the features were captured from.
+    """
+    tensor = stack_features(features)
+    distances = batch_distances(tensor)
+    travel_distances = batch_travel_distances(distances)
+    reachable_count = (distances < CANT_FIND).sum(axis=(1, 2))
+    food_evaluation = np.where(tensor[:, FOOD], travel_distances,
+                               CANT_FIND).min(axis=(1, 2))
+    travel_distance = np.where(tensor[:, TAIL], travel_distances,
+                               CANT_FIND).min(axis=(1, 2))
+    health = np.array([board_features.health for board_features in features])
+    length = np.array([board_features.length for board_features in features])
+    alive = np.array([board_features.alive for board_features in features])
+
+    width, height = features[0].width, features[0].height
+    max_dist_to_tail = np.where(
+        health == heuristic.MAX_HEALTH, 1000,
+        np.where(food_evaluation == CANT_FIND, 2,
+                 2 + (heuristic.MAX_HEALTH - health) / (
+                     heuristic.MAX_HEALTH) * (width + height)))
+    dist_from_tail_penalty = np.where(
+        travel_distance == CANT_FIND, -travel_distance,
+        np.minimum(0, max_dist_to_tail - travel_distance))
+
+    evaluations = np.stack(
+        [dist_from_tail_penalty,
+         reachable_count + length,
+         -food_evaluation + length * heuristic.FOOD_SCORE], axis=1)
+    evaluations[~alive] = heuristic.LARGE_PENALTY
+    return evaluations
@@ -0,0 +1,153 @@
+"""
+An opening book of searched moves, keyed by symmetry canonical positions.
+
+A position is keyed from the point of view of one snake, independently of
+the ids of the snakes and of the orientation of the board: the key is a
+hash of the smallest encoding of the position over its dihedral symmetries,
+8 on square boards and 4 on others. Moves are stored in the orientation of
+that smallest encoding, and turned back on lookup.
+
+A book file is a header followed by records of (key, move) sorted by key.
+OpeningBook memory maps the records and binary searches them, so opening a
+book reads nothing but the header, and a lookup only touches the pages it
+searches.
+"""
+from collections import namedtuple
+import hashlib
+import struct
+import numpy as np
+from snakemodel.snake import Move
+
+MAGIC = b"SNAKBOOK"
+HEADER = struct.Struct("<8sQI4x")
+RECORD_DTYPE = np.dtype([("key", "<u8"), ("move", "u1")])
+MOVES = list(Move)
+HEALTH_BUCKET = 10
+
+Transform = namedtuple("Transform", "swap, flip_x, flip_y")
+
+
+def get_transforms(width, height):
+    """The dihedral symmetries of boards of width and height."""
+    swaps = [False, True] if width == height else [False]
+    return [Transform(swap, flip_x, flip_y) for swap in swaps
+            for flip_x in [False, True] for flip_y in [False, True]]
+
+
+def transform_cell(transform, width, height, x, y):
+    """Position (x, y) transformed, as a flat index of the transformed board."""
+    if transform.swap:
+        x, y = y, x
+        width, height = height, width
+    if transform.flip_x:
+        x = width - 1 - x
+    if transform.flip_y:
+        y = height - 1 - y
+    return y * width + x
+
+
+def transform_move(transform, move):
+    """The Move in the orientation of the transformed board."""
+    dx, dy = move.value
+    if transform.swap:
+        dx, dy = dy, dx
+    return Move((-dx if transform.flip_x else dx,
+                 -dy if transform.flip_y else dy))
+
+
+def untransform_move(transform, move):
+    """The Move on the board, of a Move on the transformed board."""
+    dx, dy = move.value
+    dx, dy = (-dx if transform.flip_x else dx,
+              -dy if transform.flip_y else dy)
+    return Move((dy, dx) if transform.swap else (dx, dy))
+
+
+def _encode(board, snake_id, transform):
+    """
+    Encoding of the position for snake_id on the transformed board.
+
+    Our snake comes first, and the other snakes are sorted, so the encoding
+    does not depend on their ids. Health is bucketed.
+    """
+    width, height = board.width, board.height
+
+    def encode_snake(snake):
+        return (snake.health_points // HEALTH_BUCKET,
+                tuple(transform_cell(transform, width, height,
+                                     cell.x, cell.y)
+                      for cell in snake.body))
+
+    return (width, height, encode_snake(board.snakes[snake_id]),
+            tuple(sorted(encode_snake(snake)
+                         for other_snake_id, snake in board.snakes.items()
+                         if other_snake_id != snake_id)),
+            tuple(sorted(transform_cell(transform, width, height,
+                                        cell.x, cell.y)
+                         for cell in board.food)))
+
+
+def get_canonical_key(board, snake_id):
+    """
+    The book key of the position for snake_id, and its Transform.
+
+    The key is a 64 bit hash of the smallest encoding over the symmetries
+    of the board, and the Transform is the symmetry that gives it.
+    """
+    encoding, transform = min(
+        ((_encode(board, snake_id, transform), transform)
+         for transform in get_transforms(board.width, board.height)),
+        key=lambda encoded: encoded[0])
+    digest = hashlib.blake2b(repr(encoding).encode("utf-8"),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "little"), transform
+
+
+def write_book(path, entries, max_turn):
+    """
+    Write a book of entries, a mapping of canonical key to canonical Move.
+
+    max_turn is the last turn the book was built for, beyond which it is
+    not looked up.
+    """
+    records = np.zeros(len(entries), dtype=RECORD_DTYPE)
+    for index, (key, move) in enumerate(sorted(entries.items())):
+        records[index] = (key, MOVES.index(move))
+    with open(path, "wb") as book_file:
+        book_file.write(HEADER.pack(MAGIC, len(records), max_turn))
+        book_file.write(records.tobytes())
+
+
+class OpeningBook:
+    """A book file, memory mapped and binary searched."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as book_file:
+            magic, count, self.max_turn = HEADER.unpack(
+                book_file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not an opening book: {}".format(path))
+        self.count = count
+        self._records = (np.memmap(path, dtype=RECORD_DTYPE, mode="r",
+                                   offset=HEADER.size, shape=(count,))
+                         if count else np.zeros(0, dtype=RECORD_DTYPE))
+        self._keys = self._records["key"]
+
+    def __len__(self):
+        return self.count
+
+    def get_canonical_move(self, key):
+        """The Move stored for a canonical key, or None."""
+        index = int(np.searchsorted(self._keys, np.uint64(key)))
+        if index < self.count and int(self._keys[index]) == key:
+            return MOVES[int(self._records["move"][index])]
+        return None
+
+    def get_move(self, board, snake_id, turn):
+        """The book Move of snake_id on board, or None if there is none."""
+        if turn > self.max_turn or snake_id not in board.snakes:
+            return None
+        key, transform = get_canonical_key(board, snake_id)
+        move = self.get_canonical_move(key)
+        return None if move is None else untransform_move(transform, move)
@@ -1,60 +1,227 @@
 import heapq
+from collections import OrderedDict
+from threading import Lock
 from snakemodel.board import EntityId
-from snakemodel.snake import Move
+from snakemodel.geometry import get_geometry
 
 CANT_FIND = 1000000
+MAX_DISTANCE_FIELDS = 2048
 
+_distance_fields = OrderedDict()
+_distance_fields_lock = Lock()
 
-def safe_square_count(board, cell):
+
+def safe_square_count(board, cell, timed=False):
     """
     Count of safe squares that can be reached from cell.
 
-    Uses iterative flood fill (dfs) algorithm with stack.
+    Uses iterative flood fill (bfs) over the neighbour table of the board's
+    Geometry. With timed, snake cells count once they are vacated by the
+    time they are reached, as in a timed DistanceField.
     """
-    visited = set()
-    to_visit = [cell]
-    count = 0
-    while to_visit:
-        curr_cell = to_visit.pop()
-        if (curr_cell not in visited
-                and board.cell_within_bounds(curr_cell)
-                and (board.get_entity_at_cell(curr_cell) in
-                     [EntityId.EMPTY, EntityId.FOOD]
-                     or curr_cell == cell)):
-            count += 1
-            for move in Move:
-                to_visit.append(move.apply_move_to_cell(curr_cell))
-        visited.add(curr_cell)
-    return count
+    if not board.cell_within_bounds(cell):
+        return 0
+    if timed:
+        return get_distance_field(board, cell, timed=True).reachable_count
+    geometry = get_geometry(board.width, board.height)
+    neighbours = geometry.neighbours
+    grid = board.grid
+    start_index = geometry.index(cell)
+    visited = bytearray(geometry.size)
+    visited[start_index] = 1
+    to_visit = [start_index]
+    for index in to_visit:
+        for neighbour_index in neighbours[index]:
+            if (not visited[neighbour_index]
+                    and (grid[neighbour_index] is EntityId.EMPTY
+                         or grid[neighbour_index] is EntityId.FOOD)):
+                visited[neighbour_index] = 1
+                to_visit.append(neighbour_index)
+    return len(to_visit)
 
 
-def get_travel_distance(board, start_cell, end_cell):
+def get_travel_distance(board, start_cell, end_cell, timed=False):
     """
     Get the distance between cells without traversing snake cells.
 
-    Uses a* algorithm.
+    Uses a* algorithm over the neighbour table of the board's Geometry, with
+    the Manhattan distance to end_cell as the heuristic. end_cell itself may
+    be a snake cell, but cells off the board can't be reached. With timed,
+    the distance is read from a timed DistanceField instead, so snake cells
+    can be traversed once they are vacated.
     """
-    visited = set()
-    to_visit = [(start_cell.distance(end_cell), start_cell)]
-    cost_map = {start_cell: 0}
+    if not (board.cell_within_bounds(start_cell)
+            and board.cell_within_bounds(end_cell)):
+        return CANT_FIND
+    if timed:
+        return get_distance_field(board, start_cell, timed=True).distance_to(
+            end_cell)
+    geometry = get_geometry(board.width, board.height)
+    neighbours = geometry.neighbours
+    grid = board.grid
+    start_index = geometry.index(start_cell)
+    end_index = geometry.index(end_cell)
+    end_distances = geometry.distances[end_index].tolist()
+    to_visit = [(end_distances[start_index], start_index)]
+    cost_map = {start_index: 0}
+    visited = bytearray(geometry.size)
 
     while to_visit:
-        distance, curr_cell = heapq.heappop(to_visit)
-        if curr_cell == end_cell:
+        distance, index = heapq.heappop(to_visit)
+        if index == end_index:
             return distance
-        for move in Move:
-            if (curr_cell not in visited
-                    and board.cell_within_bounds(curr_cell)
-                    and (board.get_entity_at_cell(curr_cell) in
-                         [EntityId.EMPTY, EntityId.FOOD]
-                         or curr_cell == start_cell)):
-                neighbour_cell = move.apply_move_to_cell(curr_cell)
-                distance_travelled = cost_map[curr_cell] + 1
+        if visited[index]:
+            continue
+        visited[index] = 1
+        if index != start_index and not (grid[index] is EntityId.EMPTY
+                                         or grid[index] is EntityId.FOOD):
+            continue
+        distance_travelled = cost_map[index] + 1
+        for neighbour_index in neighbours[index]:
+            if distance_travelled < cost_map.get(neighbour_index, CANT_FIND):
+                cost_map[neighbour_index] = distance_travelled
                 heapq.heappush(
                     to_visit,
-                    (distance_travelled + neighbour_cell.distance(end_cell),
-                     neighbour_cell))
-                if distance_travelled < cost_map.get(neighbour_cell, CANT_FIND):
-                    cost_map[neighbour_cell] = distance_travelled
-        visited.add(curr_cell)
+                    (distance_travelled + end_distances[neighbour_index],
+                     neighbour_index))
     return CANT_FIND
+
+
+def get_legal_moves(board, snake_id):
+    """Moves for snake_id that stay on the board and off its own body."""
+    snake = board.snakes[snake_id]
+    body_cells = snake.body[:-1]
+    if not board.cell_within_bounds(snake.head):
+        return []
+    geometry = get_geometry(board.width, board.height)
+    cells = geometry.cells
+    return [move for move, index in geometry.moves[geometry.index(snake.head)]
+            if cells[index] not in body_cells]
+
+
+def get_release_times(board):
+    """
+    Moves until each cell is vacated by the live snakes, 0 for free cells.
+
+    A segment is vacated once every segment behind it has moved off it, so
+    its release time is its index counted from its snake's tail, plus one.
+    Snakes are assumed not to eat in the meantime.
+    """
+    release_times = [0] * (board.width * board.height)
+    for snake in board.get_snakes():
+        length = len(snake.body)
+        for position, cell in enumerate(snake.body):
+            if board.cell_within_bounds(cell):
+                index = board.cell_index(cell)
+                release_times[index] = max(release_times[index],
+                                           length - position)
+    return release_times
+
+
+class DistanceField:
+    """
+    Distances of every cell from a source cell, without traversing snakes.
+
+    Built with a single breadth first search, it answers how many safe
+    squares can be reached from the source and the travel distance to any
+    cell, including snake cells such as tails, which are reached through
+    their nearest free neighbour.
+
+    With timed, snake cells are not permanent walls: a cell is passable once
+    the search arrives at it no sooner than its release time, so cells
+    vacated by tails on the way are counted and tails are reached directly.
+    """
+
+    def __init__(self, board, source, timed=False):
+        self.width = board.width
+        self.height = board.height
+        self.timed = timed
+        self.geometry = get_geometry(board.width, board.height)
+        self.distances = (self._timed_search(board, source) if timed
+                          else self._search(board, source))
+        self.reachable_count = sum(
+            1 for distance in self.distances if distance != CANT_FIND)
+
+    def _search(self, board, source):
+        """Breadth first search of the free cells from source."""
+        neighbours = self.geometry.neighbours
+        grid = board.grid
+        distances = [CANT_FIND] * self.geometry.size
+        if not board.cell_within_bounds(source):
+            return distances
+        source_index = board.cell_index(source)
+        distances[source_index] = 0
+        to_visit = [source_index]
+        for index in to_visit:
+            next_distance = distances[index] + 1
+            for neighbour_index in neighbours[index]:
+                if (distances[neighbour_index] == CANT_FIND
+                        and (grid[neighbour_index] is EntityId.EMPTY
+                             or grid[neighbour_index] is EntityId.FOOD)):
+                    distances[neighbour_index] = next_distance
+                    to_visit.append(neighbour_index)
+        return distances
+
+    def _timed_search(self, board, source):
+        """
+        Breadth first search from source, through cells once they are free.
+
+        A cell that is still occupied when first reached is left unvisited,
+        so it can be reached later, from a neighbour that is further away.
+        """
+        neighbours = self.geometry.neighbours
+        release_times = get_release_times(board)
+        distances = [CANT_FIND] * self.geometry.size
+        if not board.cell_within_bounds(source):
+            return distances
+        source_index = board.cell_index(source)
+        distances[source_index] = 0
+        to_visit = [source_index]
+        for index in to_visit:
+            next_distance = distances[index] + 1
+            for neighbour_index in neighbours[index]:
+                if (distances[neighbour_index] == CANT_FIND
+                        and release_times[neighbour_index] <= next_distance):
+                    distances[neighbour_index] = next_distance
+                    to_visit.append(neighbour_index)
+        return distances
+
+    def distance_to(self, cell):
+        """Travel distance to cell, CANT_FIND if it can't be reached."""
+        if not (0 <= cell.x < self.width and 0 <= cell.y < self.height):
+            return CANT_FIND
+        index = cell.y * self.width + cell.x
+        distance = self.distances[index]
+        if distance != CANT_FIND:
+            return distance
+        for neighbour_index in self.geometry.neighbours[index]:
+            distance = min(distance, self.distances[neighbour_index] + 1)
+        return distance if distance < CANT_FIND else CANT_FIND
+
+    def nearest_distance(self, cells):
+        """Travel distance to the nearest of cells, or CANT_FIND."""
+        return min((self.distance_to(cell) for cell in cells),
+                   default=CANT_FIND)
+
+
+def get_distance_field(board, source, timed=False):
+    """
+    Get the DistanceField from source on board, timed or not.
+
+    Fields are memoized on the board's zobrist_hash, so repeated queries for
+    the same board state and source are free. The memo is locked, since
+    background searches use it too, but fields are built outside the lock.
+    """
+    key = (board.zobrist_hash, board.width, board.height, source.x, source.y,
+           timed)
+    with _distance_fields_lock:
+        distance_field = _distance_fields.get(key)
+        if distance_field is not None:
+            _distance_fields.move_to_end(key)
+            return distance_field
+    distance_field = DistanceField(board, source, timed)
+    with _distance_fields_lock:
+        _distance_fields[key] = distance_field
+        if len(_distance_fields) > MAX_DISTANCE_FIELDS:
+            _distance_fields.popitem(last=False)
+    return distance_field
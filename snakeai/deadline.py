@@ -0,0 +1,62 @@
+import time
+
+# Seconds the game server waits for the answer to a /move request
+MOVE_DEADLINE = 0.2
+# Seconds held back from the search for the response to reach the server
+RESPONSE_MARGIN = 0.03
+
+REQUEST_START_HEADER = "X-Request-Start"
+
+
+def get_queue_delay(request_start, now=None):
+    """
+    Seconds a request waited before it was handled, from X-Request-Start.
+
+    The header is the time the request reached the router or load balancer,
+    since the epoch, optionally prefixed with "t=". Routers send it in
+    seconds, milliseconds or microseconds, which are told apart by their
+    magnitude. The delay is 0 if the header is missing or malformed, and at
+    most MOVE_DEADLINE.
+    """
+    if not request_start:
+        return 0.0
+    now = time.time() if now is None else now
+    request_start = request_start.strip()
+    if request_start.startswith("t="):
+        request_start = request_start[2:]
+    try:
+        start = float(request_start)
+    except ValueError:
+        return 0.0
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    return min(max(now - start, 0.0), MOVE_DEADLINE)
+
+
+class RequestDeadline:
+    """
+    When the answer to a /move request is due.
+
+    The request arrived queue_delay seconds before it was received by the
+    handler, and is due MOVE_DEADLINE seconds after it arrived. Times are
+    time.monotonic() values.
+    """
+
+    def __init__(self, request_start=None):
+        self.received = time.monotonic()
+        self.queue_delay = get_queue_delay(request_start)
+        self.due = self.received - self.queue_delay + MOVE_DEADLINE
+
+    def remaining(self):
+        """Seconds left until the answer is due, negative once missed."""
+        return self.due - time.monotonic()
+
+    def get_time_budget(self):
+        """Seconds left for the search, keeping RESPONSE_MARGIN in reserve."""
+        return max(self.remaining() - RESPONSE_MARGIN, 0.0)
+
+    def is_missed(self):
+        """Return True if the answer is past due."""
+        return self.remaining() < 0
@@ -0,0 +1,186 @@
+from snakemodel.board import EntityId
+from snakemodel.geometry import get_geometry
+
+# Regions of at most this many cells, counting our body, are solved exactly
+EXACT_REGION_SIZE = 24
+MAX_EXACT_NODES = 5000
+HEURISTIC_DEPTH = 4
+MAX_HORIZON = 64
+
+
+class NodeBudgetExceeded(Exception):
+    """Raised when an exact solve visits more than MAX_EXACT_NODES states."""
+
+
+class EndgameSolver:
+    """
+    Longest survival of a snake that is cut off from every other snake.
+
+    The region of the snake is flood filled from its head through free cells
+    and through its own body, which frees up as it moves. The snake is
+    isolated if no other head borders the region. The bodies of the other
+    snakes are then walls, so the rest of the game is a single snake puzzle:
+    making the most moves in the region, eating the food in it to stay
+    alive, with the tail releasing cells as the snake moves. Since the walls
+    of other snakes are treated as permanent, isolation should be checked
+    again every turn.
+
+    Survival is counted in moves, up to a horizon of the region's size.
+    Regions of at most EXACT_REGION_SIZE cells are searched exactly, with
+    the results memoized on the body, health and bitmask of the remaining
+    food. Larger regions, and exact searches that run past MAX_EXACT_NODES,
+    are searched HEURISTIC_DEPTH moves deep instead, estimating the moves
+    left from the cells that can be reached in time for them to be free.
+    """
+
+    def __init__(self, board, snake_id):
+        self.geometry = get_geometry(board.width, board.height)
+        self.snake = board.snakes[snake_id]
+        self.nodes = 0
+        self.exact = False
+        self._memo = {}
+        self.region = bytearray(self.geometry.size)
+        self.region_size = 0
+        self.food_mask = 0
+        self.isolated = self._fill_region(board)
+        self.horizon = min(self.region_size, MAX_HORIZON)
+
+    def _fill_region(self, board):
+        """Flood fill the region. Returns True if the snake is isolated."""
+        if not board.cell_within_bounds(self.snake.head):
+            return False
+        geometry = self.geometry
+        neighbours = geometry.neighbours
+        grid = board.grid
+        region = self.region
+        body_indexes = set(geometry.index(cell) for cell in self.snake.body)
+        head_index = geometry.index(self.snake.head)
+        region[head_index] = 1
+        to_visit = [head_index]
+        isolated = True
+        for index in to_visit:
+            for neighbour_index in neighbours[index]:
+                if region[neighbour_index]:
+                    continue
+                entity_id = grid[neighbour_index]
+                if (entity_id is EntityId.EMPTY or entity_id is EntityId.FOOD
+                        or neighbour_index in body_indexes):
+                    region[neighbour_index] = 1
+                    to_visit.append(neighbour_index)
+                elif entity_id is EntityId.HEAD:
+                    isolated = False
+        self.region_size = len(to_visit)
+        for food_cell in board.food:
+            food_index = geometry.index(food_cell)
+            if region[food_index]:
+                self.food_mask |= 1 << food_index
+        return isolated
+
+    def solve(self):
+        """
+        Moves survived after each first move that stays in the region.
+
+        Returns a mapping of Move to the number of moves survived, counting
+        the first, up to the horizon. A move that kills the snake survives 0.
+        """
+        self.exact = self.region_size <= EXACT_REGION_SIZE
+        if self.exact:
+            try:
+                return self._solve_root(None)
+            except NodeBudgetExceeded:
+                self.exact = False
+                self._memo.clear()
+        return self._solve_root(HEURISTIC_DEPTH)
+
+    def _solve_root(self, depth):
+        """Survival of every first move, searched depth moves deep."""
+        body = tuple(self.geometry.index(cell) for cell in self.snake.body)
+        survival = {}
+        for move, index in self.geometry.moves[body[0]]:
+            if self.region[index] and index not in body[:-1]:
+                survival[move] = self._survive_move(
+                    body, self.snake.health_points, self.food_mask, index,
+                    self.horizon, depth)
+        return survival
+
+    def _survive_move(self, body, health, food_mask, index, limit, depth):
+        """Moves survived by moving the head of body to index, up to limit."""
+        bit = 1 << index
+        body = (index,) + body[:-1]
+        if food_mask & bit:
+            body += (body[-1],)
+            health = 100
+            food_mask &= ~bit
+        else:
+            health -= 1
+            if health <= 0:
+                return 0
+        return 1 + self._survival(body, health, food_mask, limit - 1,
+                                  None if depth is None else depth - 1)
+
+    def _survival(self, body, health, food_mask, limit, depth):
+        """
+        Moves that can be survived from a state, up to limit.
+
+        depth is the number of moves left to search before estimating, or
+        None to search exactly.
+        """
+        if limit <= 0:
+            return 0
+        if depth == 0:
+            return min(limit, self._estimate(body, health, food_mask))
+        key = (body, health, food_mask, depth)
+        memoized = self._memo.get(key)
+        if memoized is not None:
+            value, memoized_limit = memoized
+            # A value below its limit is exact, otherwise a lower bound
+            if value < memoized_limit or value >= limit:
+                return min(value, limit)
+        self.nodes += 1
+        if depth is None and self.nodes > MAX_EXACT_NODES:
+            raise NodeBudgetExceeded()
+        region = self.region
+        blocking = body[:-1]
+        best = 0
+        for index in self.geometry.neighbours[body[0]]:
+            if region[index] and index not in blocking:
+                best = max(best, self._survive_move(
+                    body, health, food_mask, index, limit, depth))
+                if best >= limit:
+                    break
+        self._memo[key] = (best, limit)
+        return best
+
+    def _estimate(self, body, health, food_mask):
+        """
+        Estimate of the moves left, from the cells that can be reached.
+
+        A body segment is free once the segments behind it have moved past,
+        so a cell of the body is only reached if it is free by the time the
+        head gets to it. Without food, the snake starves after health - 1
+        moves.
+        """
+        length = len(body)
+        release_times = {}
+        for position in range(length - 1, -1, -1):
+            release_times[body[position]] = length - position
+        neighbours = self.geometry.neighbours
+        region = self.region
+        distances = {body[0]: 0}
+        to_visit = [body[0]]
+        found_food = False
+        for index in to_visit:
+            distance = distances[index] + 1
+            for neighbour_index in neighbours[index]:
+                if (region[neighbour_index]
+                        and neighbour_index not in distances
+                        and release_times.get(neighbour_index, 0)
+                        <= distance):
+                    distances[neighbour_index] = distance
+                    to_visit.append(neighbour_index)
+                    if food_mask >> neighbour_index & 1:
+                        found_food = True
+        reachable_count = len(to_visit) - 1
+        if found_food:
+            return reachable_count
+        return min(reachable_count, health - 1)
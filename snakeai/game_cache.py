@@ -0,0 +1,224 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+from snakemodel.snake import Move
+from .ponder import Ponderer
+from .transposition import TranspositionTable
+from .transposition import get_position_key
+
+
+class GameState:
+    """
+    Search state of one of our snakes in one game, kept between turns.
+
+    Holds the board of the previous turn, the transposition table and the
+    root of the MCTS tree searched from that board. Between turns, a
+    Ponderer may keep searching them in the background.
+    """
+
+    def __init__(self, game_id, snake_id):
+        self.game_id = game_id
+        self.snake_id = snake_id
+        self.board = None
+        self.transposition_table = TranspositionTable()
+        self.mcts_root = None
+        self.ponderer = None
+        self._lock = Lock()
+        self.last_used = time.monotonic()
+        self.reused_subtree = False
+        self.pondered = False
+        self.pre_searched = False
+
+    def advance(self, board):
+        """
+        Move on to the board of a new turn, cancelling any pondering.
+
+        If the snakes moved from the previous board to this one, the MCTS
+        tree is replaced by the subtree of the joint move they made, so its
+        playouts are reused. Sets reused_subtree, whether that happened, and
+        pre_searched, whether pondering had already searched the new board.
+        """
+        with self._lock:
+            self.pondered = self._cancel_pondering()
+            subtree = None
+            if self.board is not None and self.mcts_root is not None:
+                subtree = self._find_subtree(board)
+            self.reused_subtree = subtree is not None
+            self.pre_searched = self.pondered and (
+                (subtree is not None and subtree.visits > 0)
+                or self.transposition_table.has_search(
+                    get_position_key(board, self.snake_id)))
+            self.mcts_root = subtree
+            self.board = board
+
+    def start_pondering(self, snake_ai, move, active_requests=None):
+        """
+        Keep searching with snake_ai, expecting our move, until the next turn.
+
+        Pondering only starts if snake_ai searched the latest board, so it
+        never runs on after the next turn has advanced, and it yields to
+        active_requests, as in Ponderer. Returns True if it started.
+        """
+        with self._lock:
+            if self.board is not snake_ai.game.board:
+                return False
+            self._cancel_pondering()
+            self.ponderer = Ponderer(snake_ai, move, active_requests)
+            self.ponderer.start()
+            return True
+
+    def stop_pondering(self):
+        """Cancel pondering. Returns True if there was pondering to cancel."""
+        with self._lock:
+            return self._cancel_pondering()
+
+    def _cancel_pondering(self):
+        """stop_pondering, with the lock held."""
+        if self.ponderer is None:
+            return False
+        self.ponderer.cancel()
+        self.ponderer = None
+        return True
+
+    def _find_subtree(self, board):
+        """The most visited child of the root matching the observed moves."""
+        observed_moves = get_observed_moves(self.board, board)
+        if observed_moves is None:
+            return None
+        matching_children = [
+            child for key, child in self.mcts_root.children.items()
+            if all(observed_moves.get(snake_id, move_name) == move_name
+                   for snake_id, move_name in key)]
+        return max(matching_children, key=lambda child: child.visits,
+                   default=None)
+
+    def record_search(self, board, mcts_root=None):
+        """Keep what was searched this turn for the next one."""
+        with self._lock:
+            self.board = board
+            self.mcts_root = mcts_root
+
+
+def get_observed_moves(previous_board, board):
+    """
+    Names of the moves that took the snakes from previous_board to board.
+
+    Snakes that died are left out, since their last move is not known.
+    Returns None if the boards are not consecutive turns.
+    """
+    observed_moves = {}
+    for snake_id, snake in board.snakes.items():
+        previous_snake = previous_board.snakes.get(snake_id)
+        if previous_snake is None:
+            return None
+        try:
+            move = Move((snake.head.x - previous_snake.head.x,
+                         snake.head.y - previous_snake.head.y))
+        except ValueError:
+            return None
+        observed_moves[snake_id] = move.name
+    return observed_moves
+
+
+class GameCache:
+    """
+    In process cache of GameStates, keyed by game id and snake id.
+
+    Bounded by max_games, evicting the least recently used game first, and
+    by ttl, evicting games that have been idle for longer than ttl seconds.
+    With max_games 0, no game is kept, and there is no GameState to get.
+    """
+
+    MAX_GAMES = 256
+    TTL = 60.0
+
+    def __init__(self, max_games=None, ttl=None):
+        self.max_games = self.MAX_GAMES if max_games is None else max_games
+        self.ttl = self.TTL if ttl is None else ttl
+        self._game_states = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.subtree_reuses = 0
+        self.pondered_turns = 0
+        self.ponder_hits = 0
+
+    def get(self, game_id, snake_id):
+        """
+        Get the GameState for game_id and snake_id, creating it if needed.
+
+        Returns None if max_games is 0.
+        """
+        key = (game_id, snake_id)
+        if not self.max_games:
+            return None
+        with self._lock:
+            self._evict_expired()
+            game_state = self._game_states.get(key)
+            if game_state is None:
+                self.misses += 1
+                game_state = self._game_states[key] = GameState(
+                    game_id, snake_id)
+                while len(self._game_states) > self.max_games:
+                    _, evicted_state = self._game_states.popitem(last=False)
+                    evicted_state.stop_pondering()
+                    self.evictions += 1
+            else:
+                self.hits += 1
+                self._game_states.move_to_end(key)
+            game_state.last_used = time.monotonic()
+            return game_state
+
+    def advance(self, game_id, snake_id, board):
+        """
+        Get the GameState for game_id and snake_id, advanced to board.
+
+        Returns None if max_games is 0.
+        """
+        game_state = self.get(game_id, snake_id)
+        if game_state is None:
+            return None
+        game_state.advance(board)
+        if game_state.reused_subtree:
+            self.subtree_reuses += 1
+        if game_state.pondered:
+            self.pondered_turns += 1
+        if game_state.pre_searched:
+            self.ponder_hits += 1
+        return game_state
+
+    def end_game(self, game_id):
+        """Evict every GameState of game_id."""
+        with self._lock:
+            for key in [key for key in self._game_states if key[0] == game_id]:
+                self._game_states.pop(key).stop_pondering()
+                self.evictions += 1
+
+    def _evict_expired(self):
+        """Evict the GameStates that have been idle for longer than ttl."""
+        expiry = time.monotonic() - self.ttl
+        while self._game_states:
+            key, game_state = next(iter(self._game_states.items()))
+            if game_state.last_used > expiry:
+                break
+            del self._game_states[key]
+            game_state.stop_pondering()
+            self.evictions += 1
+
+    def stats(self):
+        """Size, hit, miss, eviction, subtree reuse and pondering counts."""
+        return {
+            "games": len(self._game_states),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "subtree_reuses": self.subtree_reuses,
+            "pondered_turns": self.pondered_turns,
+            "ponder_hits": self.ponder_hits,
+            "ponder_hit_rate": (self.ponder_hits / self.pondered_turns
+                                if self.pondered_turns else 0.0),
+        }
+
+    def __len__(self):
+        return len(self._game_states)
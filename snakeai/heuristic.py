@@ -1,17 +1,73 @@
+import time
 import numpy as np
-from .common import safe_square_count
-from .common import get_travel_distance
+from .common import get_distance_field
 from .common import CANT_FIND
+from .voronoi import voronoi_partition
+
+
+class LazyEvaluation:
+    """
+    A heuristic evaluation whose tiers are computed on demand, in order.
+
+    Tiers are computed from the board in the state that was evaluated, so a
+    tier that has not been computed yet can only be asked for while the
+    board is in that state. Computed tiers are kept.
+    """
+
+    def __init__(self, heuristic, snake_id, tiers=None):
+        self.heuristic = heuristic
+        self.snake_id = snake_id
+        self.tiers = [] if tiers is None else list(tiers)
+        self._array = None
+
+    def is_computed(self, tier):
+        """Return True if tier has been computed."""
+        return tier < len(self.tiers)
+
+    def get_tier(self, tier, board, metrics=None):
+        """
+        Get the score of tier, computing it and the tiers before it.
+
+        The time spent computing each tier is added to metrics, if given.
+        """
+        tasks = self.heuristic.tasks
+        while len(self.tiers) <= tier:
+            task = tasks[len(self.tiers)]
+            start = time.perf_counter()
+            self.tiers.append(task(self.snake_id, board))
+            if metrics is not None:
+                metrics.add_tier_time(
+                    getattr(task, "__name__", str(len(self.tiers) - 1)),
+                    time.perf_counter() - start)
+        return self.tiers[tier]
+
+    def as_array(self, board, metrics=None):
+        """Get the scores of every tier, computing the missing ones."""
+        if self._array is None:
+            self.get_tier(len(self.heuristic.tasks) - 1, board, metrics)
+            self._array = np.array(self.tiers)
+        return self._array
 
 
 class Heuristic():
 
     DISCOUNT_FACTOR = 0.9
-    DEPTH = 1
+    DEPTH = 4
     LARGE_PENALTY = np.array([-1000000000000, 0, 0])
     FOOD_SCORE = 100
     MAX_HEALTH = 100
 
+    def __init__(self, use_voronoi=False, tasks=None, time_aware=False):
+        self.use_voronoi = use_voronoi
+        self.time_aware = time_aware
+        if tasks is None:
+            self.tasks = [self.tail_distance_score, self.space_score,
+                          self.food_score]
+        else:
+            self.tasks = list(tasks)
+            self.LARGE_PENALTY = np.array(
+                [Heuristic.LARGE_PENALTY[0]] + [0] * (len(self.tasks) - 1))
+
     def heuristic(self, snake_id, board):
         """
         A hierarchical heuristic to evaluate the board.
@@ -20,35 +76,61 @@ class Heuristic():
         2nd priority - chase tail with certain threshold to look for food, if
             can't find food, chase tail as closely as possible
         3rd priority - find tail with certain threshold to look for food
+
+        With use_voronoi, the reachable squares tier is replaced by the lead
+        in Voronoi territory over the other snakes. With time_aware, the
+        distances and reachable squares come from a timed DistanceField, in
+        which snake cells become passable as they are vacated. The priorities
+        after the first are the ordered tasks, which may be replaced by any
+        functions of snake_id and board.
         """
+        return self.lazy_heuristic(snake_id, board).as_array(board)
 
+    def lazy_heuristic(self, snake_id, board):
+        """The heuristic as a LazyEvaluation, with no tasks computed yet."""
         # LARGE_PENALTY if move will kill snake
-        if snake_id in [dead_snake_id
-                        for dead_snake_id, _ in board.dead_snakes.items()]:
-            return self.LARGE_PENALTY
+        if snake_id in board.dead_snakes:
+            return LazyEvaluation(self, snake_id, self.LARGE_PENALTY)
+        return LazyEvaluation(self, snake_id)
 
+    def tail_distance_score(self, snake_id, board):
+        """Penalty for being further from our tail than the threshold."""
         snake = board.snakes[snake_id]
-
-        reachable_squares = safe_square_count(board, snake.head)
-        squares_occupied = len(snake.body)
-
-        food_evaluation = CANT_FIND
-        for food in board.food:
-            food_evaluation = min(food_evaluation, food.distance(snake.head))
-        length_score = len(board.snakes[snake_id].body) * self.FOOD_SCORE
-
+        distance_field = get_distance_field(
+            board, snake.head, self.time_aware)
+        food_evaluation = distance_field.nearest_distance(board.food)
         max_dist_to_tail = self._get_max_dist_from_tail(
             snake, board, food_evaluation)
-        travel_distance = get_travel_distance(
-                board, snake.head, snake.body[-1])
-        dist_from_tail_penalty = -travel_distance if (
+        travel_distance = distance_field.distance_to(snake.body[-1])
+        return -travel_distance if (
             travel_distance == CANT_FIND) else (
             min(0, max_dist_to_tail - travel_distance))
 
-        return np.array(
-            [dist_from_tail_penalty,
-             reachable_squares + squares_occupied,
-             -food_evaluation + length_score])
+    def space_score(self, snake_id, board):
+        """Reachable squares and length, or the Voronoi territory lead."""
+        if self.use_voronoi:
+            return self._get_voronoi_score(snake_id, board)
+        snake = board.snakes[snake_id]
+        distance_field = get_distance_field(
+            board, snake.head, self.time_aware)
+        return distance_field.reachable_count + len(snake.body)
+
+    def food_score(self, snake_id, board):
+        """Length, less the travel distance to the nearest food."""
+        snake = board.snakes[snake_id]
+        distance_field = get_distance_field(
+            board, snake.head, self.time_aware)
+        food_evaluation = distance_field.nearest_distance(board.food)
+        return -food_evaluation + len(snake.body) * self.FOOD_SCORE
+
+    def _get_voronoi_score(self, snake_id, board):
+        """Lead in Voronoi territory over the best other snake."""
+        territory = voronoi_partition(board).territory
+        other_territories = [other_territory
+                             for other_snake_id, other_territory
+                             in territory.items()
+                             if other_snake_id != snake_id]
+        return territory[snake_id] - max(other_territories, default=0)
 
     def _get_max_dist_from_tail(self, snake, board, food_evaluation):
         """Threshold where there is no penalty for being too far from tail."""
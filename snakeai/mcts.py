@@ -0,0 +1,397 @@
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError
+from threading import Lock
+from snakemodel.board import EntityId
+from snakemodel.snake import Move
+from .common import get_legal_moves
+from .metrics import RequestMetrics
+from .metrics import SEARCH
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def get_process_pool(workers):
+    """
+    Get the process pool shared by searches with this many workers.
+
+    Searches of concurrent requests share it, so it is created under a lock.
+    """
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+
+class MCTSNode:
+    """
+    A node of a decoupled UCT tree.
+
+    Every snake keeps its own visit count and total reward per move, and
+    chooses its move independently. Children are keyed by the joint move.
+    """
+
+    def __init__(self):
+        self.visits = 0
+        self.move_stats = {}
+        self.children = {}
+
+    def get_move_stats(self, snake_id, moves):
+        """[visits, total reward] of each of the moves of snake_id."""
+        snake_move_stats = self.move_stats.get(snake_id)
+        if snake_move_stats is None:
+            snake_move_stats = self.move_stats[snake_id] = {
+                move: [0, 0.0] for move in moves}
+        return snake_move_stats
+
+    def merge(self, other):
+        """Add the visits and rewards of the tree of other to this tree."""
+        self.visits += other.visits
+        for snake_id, other_move_stats in other.move_stats.items():
+            snake_move_stats = self.move_stats.setdefault(snake_id, {})
+            for move, (visits, reward) in other_move_stats.items():
+                move_stats = snake_move_stats.setdefault(move, [0, 0.0])
+                move_stats[0] += visits
+                move_stats[1] += reward
+        for key, other_child in other.children.items():
+            child = self.children.get(key)
+            if child is None:
+                self.children[key] = other_child
+            else:
+                child.merge(other_child)
+
+    def prune(self, depth):
+        """Copy of the tree, without the nodes deeper than depth."""
+        node = MCTSNode()
+        node.visits = self.visits
+        node.move_stats = {
+            snake_id: {move: list(stats) for move, stats in move_stats.items()}
+            for snake_id, move_stats in self.move_stats.items()}
+        if depth > 0:
+            node.children = {key: child.prune(depth - 1)
+                             for key, child in self.children.items()}
+        return node
+
+    def get_child(self, snake_id_move_mapping):
+        """Get the child reached by a joint move, creating it if needed."""
+        key = tuple(sorted((snake_id, move.name) for snake_id, move
+                           in snake_id_move_mapping.items()))
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = MCTSNode()
+        return child
+
+
+class MCTS:
+    """
+    An AI to play Battle Snake with Monte Carlo tree search.
+
+    An alternative to SnakeAI. Simultaneous moves are handled with decoupled
+    UCT and board transitions use Board.apply_moves, so they follow the same
+    rules as the model. Playouts run until the time budget is spent.
+
+    With more than one worker, playouts run in a process pool:
+    ROOT - each worker grows its own tree from the root, and the top
+        MERGE_DEPTH levels of the trees are merged into ours, so the visits
+        of our moves are summed and the tree can be reused on the next turn.
+    TREE - one tree is grown in this process, and the playouts of a batch of
+        leaves are run by the workers, TASK_ROLLOUTS per leaf, since
+        sending a board to a worker costs about as much as one rollout.
+        Selected paths are visited right away, as a virtual loss, so a
+        batch spreads over different leaves.
+
+    Searches in the pool stop MERGE_RESERVE before the deadline, leaving
+    time to collect their results. The pool is shared with the searches of
+    other requests, so results are only waited for until the deadline, and
+    the search goes on from those that arrived in time. The search time and
+    playouts of best_move are recorded in metrics.
+    """
+
+    EXPLORATION = 1.4
+    TIME_BUDGET = 0.15
+    ROLLOUT_DEPTH = 15
+    MERGE_DEPTH = 2
+    MERGE_RESERVE = 0.01
+    TASK_ROLLOUTS = 4
+    ROOT = "root"
+    TREE = "tree"
+
+    def __init__(self, game, time_budget=None, workers=None,
+                 parallelism=ROOT, rollout_depth=None, seed=None, root=None,
+                 metrics=None):
+        self.game = game
+        self.time_budget = (self.TIME_BUDGET if time_budget is None
+                            else time_budget)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.parallelism = parallelism
+        self.rollout_depth = (self.ROLLOUT_DEPTH if rollout_depth is None
+                              else rollout_depth)
+        self.random = random.Random(seed)
+        self.root = MCTSNode() if root is None else root
+        self.root_move = None
+        self.playouts = 0
+        self.elapsed = 0.0
+        self.metrics = RequestMetrics() if metrics is None else metrics
+
+    @property
+    def playouts_per_second(self):
+        """Playouts per second of the last search."""
+        return self.playouts / self.elapsed if self.elapsed else 0.0
+
+    def best_move(self):
+        """
+        Get the most visited move of our snake after searching.
+
+        The visits of a reused root count along with this search's.
+        """
+        board = self.game.board
+        snake_id = self.game.you
+        moves = get_legal_moves(board, snake_id)
+        if not moves:
+            return Move.UP.get_move()
+        if len(moves) == 1:
+            return moves[0].get_move()
+
+        start = time.monotonic()
+        deadline = start + self.time_budget
+        if self.workers <= 1:
+            self.playouts = self._search(
+                board, lambda: time.monotonic() >= deadline)
+        elif self.parallelism == self.TREE:
+            self.playouts = self._search_tree_parallel(board, deadline)
+        else:
+            self.playouts = self._search_root_parallel(board, deadline)
+        self.elapsed = time.monotonic() - start
+        self.metrics.add_time(SEARCH, self.elapsed)
+        self.metrics.nodes += self.playouts
+        move_visits = self._get_move_visits(self.root, snake_id)
+        return max(moves, key=lambda move: move_visits.get(move, 0)).get_move()
+
+    def _get_move_visits(self, node, snake_id):
+        """Visits of each move of snake_id at node."""
+        return {move: visits for move, (visits, _)
+                in node.move_stats.get(snake_id, {}).items()}
+
+    def ponder(self, move, should_stop):
+        """
+        Grow the subtree of our move until should_stop().
+
+        Only the opponents' replies to our move are explored at the root, so
+        the tree is warm for the next turn.
+        """
+        if move not in get_legal_moves(self.game.board, self.game.you):
+            return
+        self.root_move = move
+        try:
+            self.playouts = self._search(self.game.board, should_stop)
+        finally:
+            self.root_move = None
+
+    def _search(self, board, should_stop):
+        """Grow the tree in this process until should_stop()."""
+        playouts = 0
+        while not should_stop():
+            path, records = self._select(board)
+            rewards = self._rollout(board, self.random, self.rollout_depth)
+            self._restore(board, records)
+            self._backpropagate(path, rewards)
+            playouts += 1
+        return playouts
+
+    def _search_tree_parallel(self, board, deadline):
+        """Grow the tree here, running batches of playouts in the pool."""
+        pool = get_process_pool(self.workers)
+        playouts = 0
+        while time.monotonic() < deadline - self.MERGE_RESERVE:
+            batch = []
+            for _ in range(self.workers):
+                path, records = self._select(board)
+                batch.append((path, pool.submit(
+                    _rollout_worker, board.copy(),
+                    self.random.getrandbits(32), self.rollout_depth,
+                    self.TASK_ROLLOUTS)))
+                self._restore(board, records)
+            for path, future in batch:
+                try:
+                    rewards = future.result(
+                        timeout=max(0, deadline - time.monotonic()))
+                except TimeoutError:
+                    future.cancel()
+                    self._revert(path)
+                    continue
+                self._backpropagate(path, rewards, self.TASK_ROLLOUTS)
+                playouts += self.TASK_ROLLOUTS
+        return playouts
+
+    def _search_root_parallel(self, board, deadline):
+        """
+        Grow one tree per worker, and merge their top levels into ours.
+
+        Workers search until the deadline less MERGE_RESERVE, measured on
+        the monotonic clock, which is shared by the processes of a machine,
+        so the time spent dispatching the search is not searched on top of
+        the budget. The trees of workers that haven't answered by the
+        deadline, such as ones still queued behind other searches, are left
+        out. Returns the number of playouts.
+        """
+        pool = get_process_pool(self.workers)
+        futures = [pool.submit(_root_worker, board, self.game.you,
+                               deadline - self.MERGE_RESERVE,
+                               self.random.getrandbits(32),
+                               self.rollout_depth, self.MERGE_DEPTH)
+                   for _ in range(self.workers)]
+        playouts = 0
+        for future in futures:
+            try:
+                worker_root, worker_playouts = future.result(
+                    timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                future.cancel()
+                continue
+            self.root.merge(worker_root)
+            playouts += worker_playouts
+        return playouts
+
+    def _select(self, board):
+        """
+        Walk down the tree from the root to a leaf, applying joint moves.
+
+        Every node and move on the path is visited as it is walked. Returns
+        the path of (node, joint move) and the UndoRecords of the moves.
+        """
+        node = self.root
+        path = []
+        records = []
+        while board.snakes and self.game.you in board.snakes:
+            node.visits += 1
+            if node.visits == 1 and node is not self.root:
+                break
+            snake_id_move_mapping = {
+                snake_id: self._select_move(node, board, snake_id)
+                for snake_id in board.snakes}
+            if node is self.root and self.root_move is not None:
+                snake_id_move_mapping[self.game.you] = self.root_move
+            for snake_id, move in snake_id_move_mapping.items():
+                node.move_stats[snake_id][move][0] += 1
+            path.append((node, snake_id_move_mapping))
+            records.append(board.apply_moves(snake_id_move_mapping))
+            node = node.get_child(snake_id_move_mapping)
+        return path, records
+
+    def _select_move(self, node, board, snake_id):
+        """Pick the move of snake_id at node with UCB1."""
+        moves = get_legal_moves(board, snake_id) or [Move.UP]
+        move_stats = node.get_move_stats(snake_id, moves)
+        unvisited = [move for move, (visits, _) in move_stats.items()
+                     if not visits]
+        if unvisited:
+            return self.random.choice(unvisited)
+        log_visits = math.log(max(node.visits, 1))
+        return max(move_stats, key=lambda move: (
+            move_stats[move][1] / move_stats[move][0]
+            + self.EXPLORATION * math.sqrt(log_visits / move_stats[move][0])))
+
+    def _restore(self, board, records):
+        """Undo the moves applied while selecting."""
+        for record in reversed(records):
+            board.undo(record)
+
+    def _backpropagate(self, path, rewards, playouts=1):
+        """
+        Add the rewards of playouts from the leaf of path to its moves.
+
+        The path was visited once when it was selected, so the other
+        playouts are visited here.
+        """
+        for node, snake_id_move_mapping in path:
+            node.visits += playouts - 1
+            for snake_id, move in snake_id_move_mapping.items():
+                move_stats = node.move_stats[snake_id][move]
+                move_stats[0] += playouts - 1
+                move_stats[1] += rewards.get(snake_id, 0.0)
+
+    def _revert(self, path):
+        """Take back the visits of a path whose playouts never arrived."""
+        for node, snake_id_move_mapping in path:
+            node.visits -= 1
+            for snake_id, move in snake_id_move_mapping.items():
+                node.move_stats[snake_id][move][0] -= 1
+
+    def _rollout(self, board, generator, rollout_depth):
+        """Play random moves from board and reward the snakes."""
+        return rollout(board, generator, rollout_depth)
+
+
+def rollout(board, generator, rollout_depth):
+    """
+    Play random, non suicidal moves from board for up to rollout_depth turns.
+
+    Returns a reward per snake: 1 for surviving, and for dying, a fraction of
+    a half for the share of the turns it survived. The board is restored.
+    """
+    snake_ids = list(board.snakes)
+    rewards = {}
+    records = []
+    for turn in range(rollout_depth):
+        if len(board.snakes) <= 1:
+            break
+        records.append(board.apply_moves(
+            {snake_id: _random_move(board, snake_id, generator)
+             for snake_id in board.snakes}))
+        for snake_id in snake_ids:
+            if snake_id not in board.snakes and snake_id not in rewards:
+                rewards[snake_id] = 0.5 * turn / rollout_depth
+    for record in reversed(records):
+        board.undo(record)
+    for snake_id in snake_ids:
+        rewards.setdefault(snake_id, 1.0)
+    return rewards
+
+
+def _random_move(board, snake_id, generator):
+    """A random move onto a free cell, or any legal move if there is none."""
+    moves = get_legal_moves(board, snake_id) or [Move.UP]
+    snake = board.snakes[snake_id]
+    free_moves = [move for move in moves
+                  if board.cell_within_bounds(move.apply_move_to_cell(
+                      snake.head))
+                  and board.get_entity_at_cell(move.apply_move_to_cell(
+                      snake.head)) in [EntityId.EMPTY, EntityId.FOOD]]
+    return generator.choice(free_moves or moves)
+
+
+def _rollout_worker(board, seed, rollout_depth, rollouts):
+    """Run rollouts playouts in a worker process, summing their rewards."""
+    generator = random.Random(seed)
+    total_rewards = {}
+    for _ in range(rollouts):
+        for snake_id, reward in rollout(board, generator,
+                                        rollout_depth).items():
+            total_rewards[snake_id] = total_rewards.get(snake_id, 0.0) + reward
+    return total_rewards
+
+
+def _root_worker(board, snake_id, deadline, seed, rollout_depth,
+                 merge_depth):
+    """
+    Grow a tree in a worker process until deadline.
+
+    Returns the top merge_depth levels of the tree and the playouts.
+    """
+    game = _WorkerGame(board, snake_id)
+    mcts = MCTS(game, workers=1, rollout_depth=rollout_depth, seed=seed)
+    playouts = mcts._search(board, lambda: time.monotonic() >= deadline)
+    return mcts.root.prune(merge_depth), playouts
+
+
+class _WorkerGame:
+    """The parts of Game that a search in a worker process needs."""
+
+    def __init__(self, board, you):
+        self.board = board
+        self.you = you
@@ -0,0 +1,268 @@
+from collections import OrderedDict
+from collections import defaultdict
+from threading import Lock
+import time
+
+# Phases of a /move request. SEARCH includes the CANDIDATES, SIMULATION and
+# HEURISTIC phases, which are spent inside it.
+PARSE = "parse"
+BOARD = "board"
+CANDIDATES = "candidates"
+SIMULATION = "simulation"
+HEURISTIC = "heuristic"
+SEARCH = "search"
+
+# Caches whose hits and misses are counted
+EVALUATION_CACHE = "evaluation"
+SEARCH_CACHE = "search"
+
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.2,
+                   0.25, 0.5, 1.0]
+NODES_BUCKETS = [10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000]
+DEPTH_BUCKETS = [0, 1, 2, 3, 4, 5, 6, 8]
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class PhaseTimer:
+    """Context manager adding the time spent in it to times[phase]."""
+
+    __slots__ = ("times", "phase", "start")
+
+    def __init__(self, times, phase):
+        self.times = times
+        self.phase = phase
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.times[self.phase] += time.perf_counter() - self.start
+
+
+class RequestMetrics:
+    """
+    Timings and counters of one /move request.
+
+    Phase and heuristic tier times are summed over the request, in seconds.
+    nodes counts the boards simulated by the search, depth is the deepest
+    completed search, and cache_counts holds [hits, misses] per cache. mode
+    is the search mode of the SnakeAI that answered, if any, and
+    deadline_missed is set if the answer was late.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.phase_times = defaultdict(float)
+        self.tier_times = defaultdict(float)
+        self.nodes = 0
+        self.depth = 0
+        self.cache_counts = defaultdict(_new_cache_counts)
+        self.mode = None
+        self.deadline_missed = False
+
+    def timer(self, phase):
+        """Context manager timing a phase."""
+        return PhaseTimer(self.phase_times, phase)
+
+    def add_time(self, phase, seconds):
+        """Add seconds to the time of phase."""
+        self.phase_times[phase] += seconds
+
+    def add_tier_time(self, tier, seconds):
+        """Add seconds to the time of a heuristic tier, and the HEURISTIC."""
+        self.tier_times[tier] += seconds
+        self.phase_times[HEURISTIC] += seconds
+
+    def count_cache(self, cache, hits, misses):
+        """Count hits and misses of cache."""
+        counts = self.cache_counts[cache]
+        counts[0] += hits
+        counts[1] += misses
+
+    def merge(self, other):
+        """Add the timings and counters of other, from another process."""
+        for phase, seconds in other.phase_times.items():
+            self.phase_times[phase] += seconds
+        for tier, seconds in other.tier_times.items():
+            self.tier_times[tier] += seconds
+        self.nodes += other.nodes
+        self.depth = max(self.depth, other.depth)
+        for cache, (hits, misses) in other.cache_counts.items():
+            self.count_cache(cache, hits, misses)
+        if other.mode is not None:
+            self.mode = other.mode
+
+    def finish(self):
+        """Stop the clock of the request. Returns the elapsed seconds."""
+        self.elapsed = time.perf_counter() - self.start
+        return self.elapsed
+
+    def as_dict(self):
+        """Timings in milliseconds and counters as a dict, for logging."""
+        return {
+            "elapsed_ms": (self.elapsed or 0.0) * 1000,
+            "phases_ms": {phase: seconds * 1000
+                          for phase, seconds in self.phase_times.items()},
+            "tiers_ms": {tier: seconds * 1000
+                         for tier, seconds in self.tier_times.items()},
+            "nodes": self.nodes,
+            "depth": self.depth,
+            "mode": self.mode,
+            "deadline_missed": self.deadline_missed,
+            "cache_hit_rates": {
+                cache: hits / (hits + misses) if hits + misses else 0.0
+                for cache, (hits, misses) in self.cache_counts.items()},
+        }
+
+
+def _new_cache_counts():
+    """[hits, misses] of a cache before any are counted."""
+    return [0, 0]
+
+
+class Histogram:
+    """A Prometheus histogram, with one series per label value."""
+
+    def __init__(self, name, documentation, buckets, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = list(buckets)
+        self.label = label
+        self._series = OrderedDict()
+
+    def observe(self, value, label_value=None):
+        """Count value in the series of label_value."""
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [
+                [0] * len(self.buckets), 0.0, 0]
+        bucket_counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                bucket_counts[index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        """Lines of the histogram in the Prometheus text format."""
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} histogram".format(self.name)]
+        for label_value, (bucket_counts, total, count) in \
+                self._series.items():
+            labels = ([] if self.label is None
+                      else ['{}="{}"'.format(self.label, label_value)])
+            for bound, bucket_count in zip(self.buckets + ["+Inf"],
+                                           bucket_counts + [count]):
+                lines.append("{}_bucket{{{}}} {}".format(
+                    self.name, ",".join(labels + ['le="{}"'.format(bound)]),
+                    bucket_count))
+            label_text = "{{{}}}".format(labels[0]) if labels else ""
+            lines.append("{}_sum{} {}".format(self.name, label_text, total))
+            lines.append("{}_count{} {}".format(self.name, label_text, count))
+        return lines
+
+
+class Counter:
+    """A Prometheus counter, with one series per label value."""
+
+    def __init__(self, name, documentation, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._series = OrderedDict()
+
+    def inc(self, amount=1, label_value=None):
+        """Add amount to the series of label_value."""
+        self._series[label_value] = self._series.get(label_value, 0) + amount
+
+    def render(self):
+        """Lines of the counter in the Prometheus text format."""
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} counter".format(self.name)]
+        for label_value, value in self._series.items():
+            label_text = ("" if self.label is None
+                          else '{{{}="{}"}}'.format(self.label, label_value))
+            lines.append("{}{} {}".format(self.name, label_text, value))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Aggregates the RequestMetrics of every /move request.
+
+    Served in the Prometheus text format by render(). Observing and
+    rendering are thread safe.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.request_seconds = Histogram(
+            "snake_move_seconds", "Time to answer a /move request.",
+            SECONDS_BUCKETS)
+        self.phase_seconds = Histogram(
+            "snake_move_phase_seconds",
+            "Time spent in each phase of a /move request.",
+            SECONDS_BUCKETS, label="phase")
+        self.tier_seconds = Histogram(
+            "snake_heuristic_tier_seconds",
+            "Time spent computing each heuristic tier in a /move request.",
+            SECONDS_BUCKETS, label="tier")
+        self.nodes = Histogram(
+            "snake_search_nodes", "Boards simulated by a /move search.",
+            NODES_BUCKETS)
+        self.depth = Histogram(
+            "snake_search_depth", "Deepest completed search of a /move.",
+            DEPTH_BUCKETS)
+        self.cache_hits = Counter(
+            "snake_cache_hits_total", "Cache lookups that hit.",
+            label="cache")
+        self.cache_misses = Counter(
+            "snake_cache_misses_total", "Cache lookups that missed.",
+            label="cache")
+        self.modes = Counter(
+            "snake_move_modes_total", "/move requests by search mode.",
+            label="mode")
+        self.deadline_misses = Counter(
+            "snake_deadline_misses_total",
+            "/move requests answered after their deadline.")
+        self.start_seconds = Histogram(
+            "snake_start_seconds",
+            "Time to prepare for a game in a /start request.",
+            SECONDS_BUCKETS)
+
+    def observe(self, request_metrics):
+        """Aggregate the metrics of a finished request."""
+        with self._lock:
+            self.request_seconds.observe(request_metrics.elapsed)
+            for phase, seconds in request_metrics.phase_times.items():
+                self.phase_seconds.observe(seconds, phase)
+            for tier, seconds in request_metrics.tier_times.items():
+                self.tier_seconds.observe(seconds, tier)
+            self.nodes.observe(request_metrics.nodes)
+            self.depth.observe(request_metrics.depth)
+            for cache, (hits, misses) in \
+                    request_metrics.cache_counts.items():
+                self.cache_hits.inc(hits, cache)
+                self.cache_misses.inc(misses, cache)
+            if request_metrics.mode is not None:
+                self.modes.inc(1, request_metrics.mode)
+            self.deadline_misses.inc(int(request_metrics.deadline_missed))
+
+    def observe_start(self, seconds):
+        """Count the time a /start request spent preparing for its game."""
+        with self._lock:
+            self.start_seconds.observe(seconds)
+
+    def render(self):
+        """Every metric in the Prometheus text format."""
+        with self._lock:
+            lines = []
+            for metric in [self.request_seconds, self.phase_seconds,
+                           self.tier_seconds, self.nodes, self.depth,
+                           self.cache_hits, self.cache_misses, self.modes,
+                           self.deadline_misses, self.start_seconds]:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,74 @@
+from threading import Event
+from threading import Lock
+from threading import Thread
+import time
+
+
+class ActiveRequests:
+    """
+    Count of the requests a process is answering, used as a context manager.
+
+    Pondering yields to them, so it never competes with a response for the
+    interpreter.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.count += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.count -= 1
+
+
+class Ponderer:
+    """
+    Runs an AI's ponder() in a background thread until it is cancelled.
+
+    The AI checks the stop flag between playouts or evaluations, so
+    cancelling waits for at most one of them before the search state is
+    safe to use again. Pondering also stops by itself after max_time
+    seconds, or as soon as any of active_requests is being answered, and
+    doesn't start while one is.
+    """
+
+    MAX_TIME = 0.5
+
+    def __init__(self, snake_ai, move, active_requests=None, max_time=None):
+        self.snake_ai = snake_ai
+        self.move = move
+        self.active_requests = active_requests
+        self.max_time = self.MAX_TIME if max_time is None else max_time
+        self._stop = Event()
+        self._lock = Lock()
+        self._deadline = None
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start pondering in the background."""
+        self._deadline = time.monotonic() + self.max_time
+        self._thread.start()
+
+    def should_stop(self):
+        """Return True once cancelled, out of time, or a request is active."""
+        return (self._stop.is_set()
+                or time.monotonic() >= self._deadline
+                or (self.active_requests is not None
+                    and self.active_requests.count > 0))
+
+    def _run(self):
+        """Ponder until it should stop."""
+        with self._lock:
+            if not self.should_stop():
+                self.snake_ai.ponder(self.move, self.should_stop)
+
+    def cancel(self):
+        """Stop pondering and wait for the search to let go of its state."""
+        self._stop.set()
+        with self._lock:
+            pass
@@ -0,0 +1,95 @@
+from collections import Counter
+from threading import Event
+from threading import Lock
+from threading import Thread
+from threading import get_ident
+import heapq
+import os
+import sys
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at an interval, from a background thread.
+
+    Stacks are counted in the collapsed format of flame graphs, from the
+    outermost frame to the innermost, as "file:function" joined by ";". The
+    sampler needs the GIL, so samples are at most as frequent as the
+    interpreter switches threads.
+    """
+
+    INTERVAL = 0.001
+
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = get_ident() if thread_id is None else thread_id
+        self.interval = self.INTERVAL if interval is None else interval
+        self.stacks = Counter()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start sampling."""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling. Returns the counts of the sampled stacks."""
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        """Sample until stopped."""
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[get_collapsed_stack(frame)] += 1
+
+
+def get_collapsed_stack(frame):
+    """The stack of frame, outermost first, in the collapsed format."""
+    names = []
+    while frame is not None:
+        names.append("{}:{}".format(
+            os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiles:
+    """
+    Sampled profiles of the slowest requests seen, at most count of them.
+
+    Every request is profiled, and its profile is kept only if it is among
+    the slowest.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self._profiles = []
+        self._lock = Lock()
+
+    def start(self):
+        """Start profiling the current thread, for a request."""
+        return SamplingProfiler().start()
+
+    def record(self, profiler, elapsed, description):
+        """Stop profiler and keep its profile if the request was slow."""
+        stacks = profiler.stop()
+        with self._lock:
+            entry = (elapsed, id(stacks), description, stacks)
+            if len(self._profiles) < self.count:
+                heapq.heappush(self._profiles, entry)
+            elif elapsed > self._profiles[0][0]:
+                heapq.heapreplace(self._profiles, entry)
+
+    def render(self):
+        """The kept profiles, slowest first, as collapsed stacks."""
+        with self._lock:
+            profiles = sorted(self._profiles, reverse=True)
+        lines = []
+        for elapsed, _, description, stacks in profiles:
+            lines.append("# {:.1f} ms {}".format(elapsed * 1000, description))
+            lines.extend("{} {}".format(stack, samples)
+                         for stack, samples in stacks.most_common())
+        return "\n".join(lines) + "\n"
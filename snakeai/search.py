@@ -0,0 +1,218 @@
+from collections import defaultdict
+from itertools import product
+from snakemodel.snake import Move
+from .common import get_legal_moves
+from .snake_ai import MoveEvaluation
+
+NEGATIVE_INFINITY = (float("-inf"),)
+POSITIVE_INFINITY = (float("inf"),)
+
+
+class SearchStats:
+    """Counters of a search, for the deepest completed iteration."""
+
+    def __init__(self, depth=0):
+        self.depth = depth
+        self.nodes = 0
+        self.leaves = 0
+        self.cutoffs = 0
+
+    @property
+    def effective_branching_factor(self):
+        """Branching factor of a uniform tree with as many nodes and depth."""
+        if not self.depth or not self.nodes:
+            return 0.0
+        return self.nodes ** (1.0 / self.depth)
+
+    def as_dict(self):
+        """Counters as a dict, for logging."""
+        return {
+            "depth": self.depth,
+            "nodes": self.nodes,
+            "leaves": self.leaves,
+            "cutoffs": self.cutoffs,
+            "effective_branching_factor": self.effective_branching_factor,
+        }
+
+
+class SearchEngine:
+    """
+    A search over the joint moves of our snake and nearby opponents.
+
+    Plugs into SnakeAI, which drives the iterative deepening and provides the
+    (cached) heuristic evaluations, the deadline and the instrumented moves.
+
+    PARANOID - every opponent moves to minimize our evaluation. Searched with
+        alpha-beta pruning, where our move is chosen first and the opponents'
+        joint move responds to it.
+    MAX_N - every snake moves to maximize its own evaluation. Within a turn
+        snakes choose in order, each seeing the choices before it. There is
+        no pruning in this mode.
+
+    Only the max_opponents opponents with heads within opponent_radius of our
+    head are searched, the rest stay where they are. Moves are ordered by the
+    previous iteration's best move and then by a history of moves that were
+    best or caused cutoffs.
+    """
+
+    PARANOID = "paranoid"
+    MAX_N = "max_n"
+    MAX_OPPONENTS = 2
+    OPPONENT_RADIUS = 6
+
+    def __init__(self, mode=PARANOID, max_opponents=None,
+                 opponent_radius=None):
+        self.mode = mode
+        self.max_opponents = (self.MAX_OPPONENTS if max_opponents is None
+                              else max_opponents)
+        self.opponent_radius = (self.OPPONENT_RADIUS
+                                if opponent_radius is None
+                                else opponent_radius)
+        self.stats = SearchStats()
+        self._history = defaultdict(int)
+
+    def search(self, snake_ai, snake_id, board, depth, first_move=None):
+        """Get the best MoveEvaluation for snake_id, searched to depth."""
+        stats = SearchStats(depth)
+        self._stats = stats
+        opponent_ids = self.get_opponent_ids(snake_id, board)
+        if self.mode == self.MAX_N:
+            move, values = self._max_n_root(
+                snake_ai, board, [snake_id] + opponent_ids, depth, first_move)
+            evaluation = values[snake_id]
+        else:
+            move, evaluation = self._paranoid_max(
+                snake_ai, board, snake_id, opponent_ids, depth,
+                NEGATIVE_INFINITY, POSITIVE_INFINITY, first_move)
+        self.stats = stats
+        return MoveEvaluation(move=move, evaluation=evaluation)
+
+    def get_opponent_ids(self, snake_id, board):
+        """Ids of the opponents near enough to our head to be searched."""
+        head = board.snakes[snake_id].head
+        nearby_snakes = sorted(
+            (snake.head.distance(head), snake.id)
+            for snake in board.get_snakes()
+            if snake.id != snake_id
+            and snake.head.distance(head) <= self.opponent_radius)
+        return [other_snake_id
+                for _, other_snake_id in nearby_snakes[:self.max_opponents]]
+
+    def get_moves(self, snake_id, board, first_move=None):
+        """
+        Moves for snake_id that stay on the board and off its own body.
+
+        Ordered with first_move first, then by history. A snake with no such
+        move still has to move, so it gets one move that kills it.
+        """
+        moves = get_legal_moves(board, snake_id)
+        if not moves:
+            return [Move.UP]
+        moves.sort(key=lambda move: (move != first_move,
+                                     -self._history[(snake_id, move)]))
+        return moves
+
+    def _evaluate(self, snake_ai, snake_id, board):
+        """Evaluation of board as a tuple, so evaluations can be compared."""
+        self._stats.leaves += 1
+        return tuple(snake_ai.evaluate(snake_id, board))
+
+    def _paranoid_max(self, snake_ai, board, snake_id, opponent_ids, depth,
+                      alpha, beta, first_move=None):
+        """Our best move and its evaluation, with opponents minimizing it."""
+        if depth <= 0 or snake_id not in board.snakes:
+            return None, self._evaluate(snake_ai, snake_id, board)
+        opponent_ids = [opponent_id for opponent_id in opponent_ids
+                        if opponent_id in board.snakes]
+        best_move, best_value = None, NEGATIVE_INFINITY
+        for move in self.get_moves(snake_id, board, first_move):
+            snake_ai.check_deadline()
+            value = self._paranoid_min(snake_ai, board, snake_id, move,
+                                       opponent_ids, depth, alpha, beta)
+            if best_move is None or value > best_value:
+                best_move, best_value = move, value
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                self._record_cutoff(snake_id, move)
+                break
+        self._history[(snake_id, best_move)] += depth
+        return best_move, best_value
+
+    def _paranoid_min(self, snake_ai, board, snake_id, move, opponent_ids,
+                      depth, alpha, beta):
+        """Worst evaluation of our move over the opponents' joint moves."""
+        worst_value = POSITIVE_INFINITY
+        for joint_move in product(*[self.get_moves(opponent_id, board)
+                                    for opponent_id in opponent_ids]):
+            snake_id_move_mapping = dict(zip(opponent_ids, joint_move))
+            snake_id_move_mapping[snake_id] = move
+            self._stats.nodes += 1
+            record = snake_ai.apply_moves(board, snake_id_move_mapping)
+            try:
+                _, value = self._paranoid_max(
+                    snake_ai, board, snake_id, opponent_ids, depth - 1,
+                    alpha, beta)
+            finally:
+                snake_ai.undo_moves(board, record)
+            worst_value = min(worst_value, value)
+            beta = min(beta, value)
+            if alpha >= beta:
+                for opponent_id, opponent_move in zip(opponent_ids,
+                                                      joint_move):
+                    self._record_cutoff(opponent_id, opponent_move)
+                break
+        return worst_value
+
+    def _record_cutoff(self, snake_id, move):
+        """Count a cutoff and favour move in the move ordering."""
+        self._stats.cutoffs += 1
+        self._history[(snake_id, move)] += 1
+
+    def _max_n_root(self, snake_ai, board, snake_ids, depth, first_move):
+        """Our best move and the evaluations of every snake after it."""
+        return self._max_n_choose(snake_ai, board, snake_ids, 0, {}, depth,
+                                  first_move)
+
+    def _max_n(self, snake_ai, board, snake_ids, depth):
+        """Evaluations of every snake, each maximizing its own evaluation."""
+        live_snake_ids = [snake_id for snake_id in snake_ids
+                          if snake_id in board.snakes]
+        if depth <= 0 or snake_ids[0] not in board.snakes:
+            return {snake_id: self._evaluate(snake_ai, snake_id, board)
+                    for snake_id in snake_ids}
+        _, values = self._max_n_choose(
+            snake_ai, board, live_snake_ids, 0, {}, depth)
+        for snake_id in snake_ids:
+            if snake_id not in values:
+                values[snake_id] = self._evaluate(snake_ai, snake_id, board)
+        return values
+
+    def _max_n_choose(self, snake_ai, board, snake_ids, index, moves, depth,
+                      first_move=None):
+        """
+        Choose the move of snake_ids[index], given the moves chosen before it.
+
+        Once every snake has chosen, the joint move is applied and searched.
+        """
+        if index == len(snake_ids):
+            self._stats.nodes += 1
+            record = snake_ai.apply_moves(board, moves)
+            try:
+                return None, self._max_n(snake_ai, board, snake_ids,
+                                         depth - 1)
+            finally:
+                snake_ai.undo_moves(board, record)
+
+        snake_id = snake_ids[index]
+        best_move, best_values = None, None
+        for move in self.get_moves(snake_id, board,
+                                   first_move if index == 0 else None):
+            snake_ai.check_deadline()
+            moves[snake_id] = move
+            _, values = self._max_n_choose(snake_ai, board, snake_ids,
+                                           index + 1, moves, depth)
+            if best_values is None or values[snake_id] > best_values[snake_id]:
+                best_move, best_values = move, values
+        del moves[snake_id]
+        self._history[(snake_id, best_move)] += depth
+        return best_move, best_values
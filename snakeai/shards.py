@@ -0,0 +1,88 @@
+import atexit
+from multiprocessing import Pipe
+from multiprocessing import Process
+from threading import Lock
+import zlib
+
+
+class GameShards:
+    """
+    Processes that each serve a fixed share of the games.
+
+    A call for a game runs in the process its id hashes to, so every call of
+    a game finds the state that the process kept for it, such as its
+    GameState, while the games of different processes run on different
+    cores. A process answers one call at a time, in the order they arrive.
+
+    Calls send a function and its arguments, which are pickled, so the
+    function must be importable in the process, as those of a module loaded
+    before the processes were forked are. An exception raised by the
+    function is raised again by call. The processes are not daemons, so
+    they can start process pools of their own. They stop when close is
+    called, which is done at exit, or when their parent dies.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self._connections = []
+        self._locks = []
+        self._processes = []
+        for _ in range(count):
+            connection, process_connection = Pipe()
+            process = Process(target=_serve, args=(
+                process_connection, self._connections + [connection]))
+            process.start()
+            process_connection.close()
+            self._connections.append(connection)
+            self._locks.append(Lock())
+            self._processes.append(process)
+        # Before multiprocessing joins the processes at exit
+        atexit.register(self.close)
+
+    def get_shard(self, game_id):
+        """Index of the process serving game_id."""
+        return zlib.crc32(str(game_id).encode("utf-8")) % self.count
+
+    def call(self, game_id, function, *args):
+        """Call function(*args) in the process of game_id, and return it."""
+        shard = self.get_shard(game_id)
+        with self._locks[shard]:
+            self._connections[shard].send((function, args))
+            succeeded, result = self._connections[shard].recv()
+        if not succeeded:
+            raise result
+        return result
+
+    def close(self):
+        """Stop the processes once they finish their calls."""
+        for connection, lock in zip(self._connections, self._locks):
+            with lock:
+                if not connection.closed:
+                    connection.close()
+        for process in self._processes:
+            process.join()
+
+
+def _serve(connection, parent_connections):
+    """
+    Answer calls until the connection is closed.
+
+    The parent's ends of the pipes, inherited by the fork, are closed first,
+    so the connection is closed once the parent closes it or exits.
+    """
+    for parent_connection in parent_connections:
+        parent_connection.close()
+    while True:
+        try:
+            function, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            result = (True, function(*args))
+        except Exception as exception:
+            result = (False, exception)
+        try:
+            connection.send(result)
+        except Exception as exception:
+            # The result or exception couldn't be pickled
+            connection.send((False, RuntimeError(repr(exception))))
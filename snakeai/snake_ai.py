@@ -1,5 +1,28 @@
 from collections import namedtuple
+import time
 import numpy as np
+from .batch import batch_heuristic
+from .batch import can_batch
+from .batch import capture_features
+from .common import get_legal_moves
+from .common import safe_square_count
+from .endgame import EndgameSolver
+from .metrics import CANDIDATES
+from .metrics import EVALUATION_CACHE
+from .metrics import HEURISTIC
+from .metrics import RequestMetrics
+from .metrics import SEARCH
+from .metrics import SEARCH_CACHE
+from .metrics import SIMULATION
+from .threat import get_threat_map
+from .transposition import TranspositionTable
+from .transposition import get_position_key
+
+MoveEvaluation = namedtuple("MoveEvaluation", "move, evaluation")
+
+
+class SearchTimeout(Exception):
+    """Raised when a search runs past its deadline."""
 
 
 class SnakeAI():
@@ -7,45 +30,434 @@ class SnakeAI():
     An AI to play Battle Snake
 
     Version 1: Heuristic search, assuming other snakes search with depth of 1
+    Version 2: Iterative deepening of the heuristic search within a time budget
+
+    Heuristic evaluations and search results are cached in a transposition
+    table keyed by board hash and health, which may be shared between
+    SnakeAIs. The search itself can be replaced by a pluggable engine, such
+    as snakeai.search.SearchEngine. With batch_evaluation, the boards a
+    node at depth 2 or more is about to evaluate, after every candidate move
+    and every reply of the other snakes to it, are evaluated together in one
+    vectorized call, if there are at least MIN_BATCH of them.
+    With endgame, once our snake is cut off from every other snake, moves
+    are chosen by an EndgameSolver for the longest survival instead. With a
+    book, an OpeningBook, positions in the book are answered from it without
+    searching.
+
+    Time spent per phase, the boards simulated, the depth reached and the
+    transposition table hits of best_move are recorded in metrics.
+
+    The search degrades with the time budget it is given, such as what is
+    left of a request's deadline:
+    FULL - the endgame solver and iterative deepening, within the budget
+    SHALLOW - the first iteration only, below SHALLOW_BUDGET
+    SAFE_MOVE - the candidate move with the most safe squares, without any
+        search, below SAFE_MOVE_BUDGET
+    Moves from the book are answered in the BOOK mode, whatever the budget.
     """
 
-    def __init__(self, game, heuristic):
+    TIME_BUDGET = 0.15
+    SHALLOW_BUDGET = 0.05
+    SAFE_MOVE_BUDGET = 0.015
+    MIN_BATCH = 16
+    FULL = "full"
+    SHALLOW = "shallow"
+    SAFE_MOVE = "safe_move"
+    BOOK = "book"
+
+    def __init__(self, game, heuristic, time_budget=None,
+                 transposition_table=None, engine=None,
+                 batch_evaluation=False, metrics=None, endgame=True,
+                 book=None):
         self.game = game
         self.heuristic = heuristic
+        self.engine = engine
+        self.endgame = endgame
+        self.book = book
+        self.batch_evaluation = batch_evaluation and can_batch(heuristic)
+        self.time_budget = (self.TIME_BUDGET if time_budget is None
+                            else time_budget)
+        self.transposition_table = (
+            TranspositionTable() if transposition_table is None
+            else transposition_table)
+        self.deadline = None
+        self.should_stop = None
+        self.depth_reached = 0
+        self.skipped_tiers = 0
+        self.metrics = RequestMetrics() if metrics is None else metrics
 
     def best_move(self):
         """
         Get the best move, according to the heuristic.
 
         Perform recursive search, assuming all other snakes make the best
-        immediate move.
+        immediate move. The search is iteratively deepened up to the
+        heuristic's DEPTH until the time budget runs out, exploring the
+        previous iteration's best move first. The move from the deepest fully
+        completed iteration is returned. The first iteration always runs to
+        completion so there is always a move to return.
+
+        If the position is in the book, the book move is returned. If our
+        snake is isolated, the endgame move is returned instead. With a
+        smaller time budget, the search is degraded, as given by get_mode.
+        """
+        snake_id = self.game.you
+        board = self.game.board
+        start = time.monotonic()
+        if self.book is not None:
+            with self.metrics.timer(SEARCH):
+                book_move = self._get_book_move(snake_id, board)
+            if book_move is not None:
+                self.metrics.mode = self.BOOK
+                return book_move.get_move()
+        mode = self.metrics.mode = self.get_mode()
+        if mode == self.SAFE_MOVE:
+            with self.metrics.timer(SEARCH):
+                return self._get_safe_move(snake_id, board).get_move()
+        if self.endgame and mode == self.FULL:
+            with self.metrics.timer(SEARCH):
+                endgame_move = self._get_endgame_move(snake_id, board)
+            if endgame_move is not None:
+                return endgame_move.get_move()
+        table = self.transposition_table
+        table_counts = (table.evaluation_hits, table.evaluation_misses,
+                        table.search_hits, table.search_misses)
+        with self.metrics.timer(SEARCH):
+            best_move_eval = self._search(snake_id, board, 1)
+            self.depth_reached = 1
+            if mode == self.FULL:
+                self.deadline = start + self.time_budget
+                try:
+                    best_move_eval = self._iterative_deepening(
+                        snake_id, board, 2, best_move_eval)
+                finally:
+                    self.deadline = None
+        self.metrics.depth = self.depth_reached
+        self.metrics.count_cache(
+            EVALUATION_CACHE, table.evaluation_hits - table_counts[0],
+            table.evaluation_misses - table_counts[1])
+        self.metrics.count_cache(
+            SEARCH_CACHE, table.search_hits - table_counts[2],
+            table.search_misses - table_counts[3])
+
+        if best_move_eval.move is None:
+            return self._get_fallback_move(snake_id, board).get_move()
+        return best_move_eval.move.get_move()
+
+    def get_mode(self):
+        """Search mode of best_move, FULL, SHALLOW or SAFE_MOVE."""
+        if self.time_budget < self.SAFE_MOVE_BUDGET:
+            return self.SAFE_MOVE
+        if self.time_budget < self.SHALLOW_BUDGET:
+            return self.SHALLOW
+        return self.FULL
+
+    def _get_book_move(self, snake_id, board):
+        """
+        The book move of the position, or None if it is not in the book.
+
+        A book move that is not a candidate move, as could happen on a hash
+        collision, is ignored.
+        """
+        book_move = self.book.get_move(board, snake_id, self.game.turn)
+        if book_move is None or book_move not in self.get_candidate_moves(
+                snake_id, board):
+            return None
+        return book_move
+
+    def _get_safe_move(self, snake_id, board):
+        """
+        The candidate move with the most safe squares, without searching.
+
+        Falls back to _get_fallback_move if there are no candidate moves.
+        """
+        candidate_moves = self.get_candidate_moves(snake_id, board)
+        if not candidate_moves:
+            return self._get_fallback_move(snake_id, board)
+        possible_moves = board.snakes[snake_id].get_possible_moves()
+        return max(candidate_moves, key=lambda move: safe_square_count(
+            board, possible_moves[move]))
+
+    def _get_endgame_move(self, snake_id, board):
+        """
+        Move that survives longest, if snake_id is cut off from other snakes.
+
+        Moves that survive equally long are compared by their heuristic
+        evaluation. Returns None if there are no other snakes, snake_id is
+        not isolated from them, or every move dies.
+        """
+        if not self._get_other_snake_ids(snake_id, board):
+            return None
+        solver = EndgameSolver(board, snake_id)
+        if not solver.isolated:
+            return None
+        survival = solver.solve()
+        self.metrics.nodes += solver.nodes
+        longest = max(survival.values(), default=0)
+        if not longest:
+            return None
+        longest_moves = [move for move, turns in survival.items()
+                         if turns == longest]
+        if len(longest_moves) == 1:
+            return longest_moves[0]
+        move_evals = []
+        for move in longest_moves:
+            record = self.apply_moves(board, {snake_id: move})
+            try:
+                move_evals.append(MoveEvaluation(
+                    move=move, evaluation=self.evaluate(snake_id, board)))
+            finally:
+                self.undo_moves(board, record)
+        return max(move_evals,
+                   key=lambda move_eval: tuple(move_eval.evaluation)).move
+
+    def _iterative_deepening(self, snake_id, board, first_depth,
+                             best_move_eval=None):
+        """
+        Search from first_depth deeper until DEPTH or a SearchTimeout.
+
+        Returns the result of the deepest completed search, or best_move_eval
+        if none completed.
+        """
+        try:
+            for depth in range(first_depth, self.heuristic.DEPTH + 1):
+                first_move = None
+                if best_move_eval is not None:
+                    if best_move_eval.move is None:
+                        break
+                    first_move = best_move_eval.move
+                best_move_eval = self._search(
+                    snake_id, board, depth, first_move)
+                self.depth_reached = depth
+        except SearchTimeout:
+            pass
+        return best_move_eval
+
+    def ponder(self, move, should_stop):
+        """
+        Search the position expected after our move until should_stop().
+
+        The other snakes are expected to make their best immediate move. The
+        results are kept in the transposition table, for the next turn.
         """
-        return self._best_move_helper(
-            self.game.you, self.game.board, self.heuristic.DEPTH)[0].get_move()
+        snake_id = self.game.you
+        board = self.game.board
+        self.should_stop = should_stop
+        try:
+            snake_id_move_mapping = {
+                other_snake_id:
+                self._best_move_helper(other_snake_id, board, 1).move
+                for other_snake_id in self._get_other_snake_ids(
+                    snake_id, board)}
+            snake_id_move_mapping[snake_id] = move
+            record = self.apply_moves(board, {
+                pondered_snake_id: pondered_move
+                for pondered_snake_id, pondered_move
+                in snake_id_move_mapping.items()
+                if pondered_move is not None})
+            try:
+                if snake_id in board.snakes:
+                    self._iterative_deepening(snake_id, board, 1)
+            finally:
+                self.undo_moves(board, record)
+        except SearchTimeout:
+            pass
+        finally:
+            self.should_stop = None
 
-    def _best_move_helper(self, snake_id, board, depth):
+    def _search(self, snake_id, board, depth, first_move=None):
+        """Search with the engine, or with _best_move_helper if there is none."""
+        if self.engine is None:
+            return self._best_move_helper(snake_id, board, depth, first_move)
+        return self.engine.search(self, snake_id, board, depth, first_move)
+
+    def apply_moves(self, board, snake_id_move_mapping):
+        """board.apply_moves, timed and counted as a simulated board."""
+        with self.metrics.timer(SIMULATION):
+            record = board.apply_moves(snake_id_move_mapping)
+        self.metrics.nodes += 1
+        return record
+
+    def undo_moves(self, board, record):
+        """board.undo, timed as simulation."""
+        with self.metrics.timer(SIMULATION):
+            board.undo(record)
+
+    def check_deadline(self):
+        """Raise SearchTimeout if the current search is past its deadline."""
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+        if self.should_stop is not None and self.should_stop():
+            raise SearchTimeout()
+
+    def _get_fallback_move(self, snake_id, board):
+        """
+        Move to make when no move is safe.
+
+        Prefers a head to head with the shortest contender over moving into
+        a body, and moving into a body over leaving the board.
+        """
+        threat_map = get_threat_map(board)
+        possible_moves = board.snakes[snake_id].get_possible_moves()
+        legal_moves = get_legal_moves(board, snake_id)
+        contested_moves = [move for move in legal_moves
+                           if not threat_map.is_body(possible_moves[move])]
+        if contested_moves:
+            return min(contested_moves, key=lambda move: (
+                threat_map.contender_length(possible_moves[move], snake_id)))
+        if legal_moves:
+            return legal_moves[0]
+        return next(iter(possible_moves))
+
+    def _best_move_helper(self, snake_id, board, depth, first_move=None):
         """
         Helper for best_move.
 
         Get the best move and its eval, for the snake with snake_id, on the
         given board, according to the heuristic, calculated to the given depth.
         Assume other snakes make the best immediate move.
+
+        Moves are applied to and undone from the board in place, so the board
+        is left unchanged, even if the search times out. If given, first_move
+        is explored first. If there are no candidate moves, the move is None.
+        """
+        key = get_position_key(board, snake_id)
+        cached_move_eval = self.transposition_table.get_search(key, depth)
+        if cached_move_eval is not None:
+            return cached_move_eval
+
+        with self.metrics.timer(CANDIDATES):
+            candidate_moves = self.get_candidate_moves(snake_id, board)
+        if first_move in candidate_moves:
+            candidate_moves.remove(first_move)
+            candidate_moves.insert(0, first_move)
+        if depth <= 1 and candidate_moves:
+            best_move_eval = self._select_lazily(
+                snake_id, board, candidate_moves)
+            self.transposition_table.store_search(key, depth, best_move_eval)
+            return best_move_eval
+        if self.batch_evaluation:
+            self._evaluate_frontier(snake_id, board, candidate_moves)
+        move_evals = []
+        for candidate_move in candidate_moves:
+            self.check_deadline()
+            record = self.apply_moves(board, {snake_id: candidate_move})
+            try:
+                move_evals.append(MoveEvaluation(
+                    move=candidate_move,
+                    evaluation=self._get_move_eval(snake_id, board, depth)))
+            finally:
+                self.undo_moves(board, record)
+        if not move_evals:
+            best_move_eval = MoveEvaluation(
+                move=None, evaluation=self.heuristic.LARGE_PENALTY)
+        else:
+            best_move_eval = max(
+                move_evals,
+                key=lambda move_eval: tuple(move_eval.evaluation))
+        self.transposition_table.store_search(key, depth, best_move_eval)
+        return best_move_eval
+
+    def _select_lazily(self, snake_id, board, candidate_moves):
+        """
+        The candidate move with the best evaluation, compared tier by tier.
+
+        Equivalent to taking the max of the full evaluations, but a tier is
+        only computed for the moves still tied on every tier before it. Each
+        tier is computed by replaying the move on the board, and the tiers
+        that were never needed are counted in skipped_tiers.
+        """
+        tier_count = len(self.heuristic.tasks)
+        lazy_evals = {}
+        tied_moves = candidate_moves
+        for tier in range(tier_count):
+            if len(tied_moves) == 1:
+                break
+            scores = [self._replay_tier(snake_id, board, move, lazy_evals,
+                                        tier)
+                      for move in tied_moves]
+            best_score = max(scores)
+            tied_moves = [move for move, score in zip(tied_moves, scores)
+                          if score == best_score]
+        best_move = tied_moves[0]
+        self._replay_tier(snake_id, board, best_move, lazy_evals,
+                          tier_count - 1)
+        self.skipped_tiers += sum(
+            tier_count - len(lazy_eval.tiers)
+            for move, lazy_eval in lazy_evals.items() if move != best_move)
+        return MoveEvaluation(
+            move=best_move,
+            evaluation=lazy_evals[best_move].as_array(board, self.metrics))
+
+    def _evaluate_frontier(self, snake_id, board, candidate_moves):
+        """
+        Evaluate the boards that searching candidate_moves evaluates first.
+
+        Those are the boards after each candidate move, and after each
+        candidate reply of every other snake to it, which don't depend on
+        any evaluation. The ones whose evaluations are not in the
+        transposition table are evaluated with one batch_heuristic call, and
+        stored in it for the search to find. Below MIN_BATCH boards, a batch
+        is slower than evaluating them one at a time, so they are left to
+        the search.
         """
-        MoveEvaluation = namedtuple("MoveEvaluation", "move, evaluation")
-        move_evals = [
-            MoveEvaluation(
-                move=candidate_move,
-                evaluation=self._get_move_eval(
-                    snake_id,
-                    self.game.simulate_moves(
-                        board,
-                        {snake_id: candidate_move}),
-                    depth)
-            )
-            for candidate_move in self.get_candidate_moves(snake_id, board)]
-        return max(
-            move_evals,
-            key=lambda move_eval: tuple(move_eval.evaluation))
+        # Every snake has at most 3 moves off its neck
+        if len(candidate_moves) * (1 + 3 * len(self._get_other_snake_ids(
+                snake_id, board))) < self.MIN_BATCH:
+            return
+        pending_lazy_evals = []
+        pending_features = []
+        last_tier = len(self.heuristic.tasks) - 1
+
+        def add_board(evaluated_snake_id):
+            lazy_eval = self.lazy_evaluate(evaluated_snake_id, board)
+            if not lazy_eval.is_computed(last_tier):
+                pending_lazy_evals.append(lazy_eval)
+                pending_features.append(
+                    capture_features(board, evaluated_snake_id))
+
+        for candidate_move in candidate_moves:
+            self.check_deadline()
+            record = self.apply_moves(board, {snake_id: candidate_move})
+            try:
+                add_board(snake_id)
+                if snake_id not in board.snakes:
+                    continue
+                for other_snake_id in self._get_other_snake_ids(
+                        snake_id, board):
+                    if self.transposition_table.has_search(
+                            get_position_key(board, other_snake_id)):
+                        continue
+                    for reply in self.get_candidate_moves(
+                            other_snake_id, board):
+                        reply_record = self.apply_moves(
+                            board, {other_snake_id: reply})
+                        try:
+                            add_board(other_snake_id)
+                        finally:
+                            self.undo_moves(board, reply_record)
+            finally:
+                self.undo_moves(board, record)
+        if len(pending_features) < self.MIN_BATCH:
+            return
+        with self.metrics.timer(HEURISTIC):
+            evaluations = batch_heuristic(self.heuristic, pending_features)
+        for lazy_eval, evaluation in zip(pending_lazy_evals, evaluations):
+            lazy_eval.tiers = list(evaluation)
+
+    def _replay_tier(self, snake_id, board, move, lazy_evals, tier):
+        """Score of tier after move, applying move only if it is needed."""
+        lazy_eval = lazy_evals.get(move)
+        if lazy_eval is not None and lazy_eval.is_computed(tier):
+            return lazy_eval.tiers[tier]
+        self.check_deadline()
+        record = self.apply_moves(board, {snake_id: move})
+        try:
+            lazy_eval = lazy_evals[move] = self.lazy_evaluate(
+                snake_id, board)
+            return lazy_eval.get_tier(tier, board, self.metrics)
+        finally:
+            self.undo_moves(board, record)
 
     def _get_move_eval(self, snake_id, board, depth):
         """
@@ -55,68 +467,66 @@ class SnakeAI():
         board, according to the heuristic, calculated to the given depth.
         Assume other snakes make the best immediate move.
         """
-        board_eval = self.heuristic.heuristic(snake_id, board)
+        board_eval = self.evaluate(snake_id, board)
         if np.array_equal(board_eval, self.heuristic.LARGE_PENALTY):
             return self.heuristic.LARGE_PENALTY
         if depth <= 1:
             return board_eval
         other_snakes_best_move_mapping = \
-            {other_snake_id: self._best_move_helper(snake_id, board, 1).move
-             for other_snake_id in self.game.get_other_snake_ids(snake_id)}
-        next_board = self.game.simulate_moves(
-            board, other_snakes_best_move_mapping)
-        return board_eval + self.heuristic.DISCOUNT_FACTOR * \
-            self._best_move_helper(
-                self.game.you, next_board, depth - 1).evaluation
+            {other_snake_id:
+             self._best_move_helper(other_snake_id, board, 1).move
+             for other_snake_id in self._get_other_snake_ids(snake_id, board)}
+        record = self.apply_moves(board, {
+            other_snake_id: move
+            for other_snake_id, move in other_snakes_best_move_mapping.items()
+            if move is not None})
+        try:
+            # The replies can still kill us, by starvation or head to head
+            if snake_id not in board.snakes:
+                return self.heuristic.LARGE_PENALTY
+            return board_eval + self.heuristic.DISCOUNT_FACTOR * \
+                self._best_move_helper(
+                    snake_id, board, depth - 1).evaluation
+        finally:
+            self.undo_moves(board, record)
+
+    def evaluate(self, snake_id, board):
+        """Heuristic evaluation of board, cached in the transposition table."""
+        return self.lazy_evaluate(snake_id, board).as_array(
+            board, self.metrics)
+
+    def lazy_evaluate(self, snake_id, board):
+        """
+        Lazy heuristic evaluation of board, cached in the transposition table.
+
+        The tiers computed so far are kept with it, for the next lookup.
+        """
+        key = get_position_key(board, snake_id)
+        lazy_eval = self.transposition_table.get_evaluation(key)
+        if lazy_eval is None:
+            lazy_eval = self.heuristic.lazy_heuristic(snake_id, board)
+            self.transposition_table.store_evaluation(key, lazy_eval)
+        return lazy_eval
+
+    def _get_other_snake_ids(self, snake_id, board):
+        """Ids of the other snakes that are still alive on the board."""
+        return [other_snake_id
+                for other_snake_id in self.game.get_other_snake_ids(snake_id)
+                if other_snake_id in board.snakes]
 
     def get_candidate_moves(self, snake_id, board):
-        """Moves that will not lead to immediate death from other snakes."""
-        _, possible_heads, _ = self._get_possible_snake_transitions(
-            self.game.you,
-            board)
-        safe_transitions = filter(
-            lambda possible_head: self._is_possible_head_safe(
-                possible_head, snake_id, board),
-            possible_heads)
-        return [safe_transition.move for safe_transition in safe_transitions]
-
-    def _is_possible_head_safe(self, possible_head, snake_id, board):
-        """
-        Check if snake is safe against all possible transitions of all snakes.
-
-        Checks if the head cell does not overlap with any other snakes' next
-        body cells and their next possible head cells. If it overlaps with a
-        possible head cell, check if the snake is longer than the other snake.
-        """
-
-        def _could_snake_die_other_snakes_transition(possible_transition):
-            """Could snake die from any transition of another snake."""
-            head_cell = possible_head.head_cell
-            (other_body_cells, other_possible_heads,
-             other_snake) = possible_transition
-            could_overlap_body = head_cell in other_body_cells
-            could_overlap_head = head_cell in [
-                other_head_cell.head_cell
-                for other_head_cell in other_possible_heads]
-            my_snake_longer = len(my_snake) > len(other_snake)
-            return not could_overlap_body and not (
-                could_overlap_head and not my_snake_longer)
-
-        my_snake = board.snakes[snake_id]
-        return all(map(_could_snake_die_other_snakes_transition,
-                       [self._get_possible_snake_transitions(
-                           other_snake_id, board)
-                        for other_snake_id in
-                        self.game.get_other_snake_ids(snake_id)]))
-
-    def _get_possible_snake_transitions(self, snake_id, board):
-        """Get possible cells that a snake can occupy on the next turn."""
-        snake = board.snakes[snake_id]
-        body_cells = snake.body[:-1]
-        PossibleHeads = namedtuple("PossibleHeads", "move, head_cell")
-        possible_heads = [PossibleHeads(move=move,
-                                        head_cell=head_cell)
-                          for move, head_cell in
-                          snake.get_possible_moves().items()
-                          if head_cell not in body_cells]
-        return body_cells, possible_heads, snake
+        """
+        Moves that will not lead to immediate death from other snakes.
+
+        Moves that risk a head to head with a snake at least as long on the
+        move after are left out, unless every safe move does.
+        """
+        threat_map = get_threat_map(board)
+        safe_moves = [
+            (move, head_cell) for move, head_cell
+            in board.snakes[snake_id].get_possible_moves().items()
+            if threat_map.is_safe(head_cell, snake_id)]
+        untrapped_moves = [
+            move for move, head_cell in safe_moves
+            if not threat_map.is_trapped(head_cell, snake_id)]
+        return untrapped_moves or [move for move, _ in safe_moves]
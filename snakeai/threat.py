@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from threading import Lock
+
+MAX_THREAT_MAPS = 1024
+
+_threat_maps = OrderedDict()
+_threat_maps_lock = Lock()
+
+
+class ThreatMap:
+    """
+    Cells that are dangerous to move into on the next turn.
+
+    Built once per board and shared by every snake on it. next_body_mask is a
+    bitboard of the cells that stay occupied by bodies next turn. For every
+    cell a head could move into, the two longest contenders are kept, so the
+    longest contender other than any given snake is an O(1) lookup. Masks of
+    the cells a head can be on after exactly k moves are grown from the head
+    bitboard on demand, one shift per move.
+    """
+
+    def __init__(self, board):
+        self.width = board.width
+        self.height = board.height
+        size = self.width * self.height
+        self._full_mask = (1 << size) - 1
+        first_column = sum(1 << (y * self.width) for y in range(self.height))
+        self._not_first_column = self._full_mask & ~first_column
+        self._not_last_column = self._full_mask & ~(
+            first_column << (self.width - 1))
+
+        self.next_body_mask = 0
+        for snake in board.get_snakes():
+            for cell in snake.body[:-1]:
+                if board.cell_within_bounds(cell):
+                    self.next_body_mask |= 1 << board.cell_index(cell)
+
+        self._lengths = {}
+        self._heads = {}
+        self._contenders = {}
+        for snake in board.get_snakes():
+            self._lengths[snake.id] = len(snake)
+            self._heads[snake.id] = (
+                1 << board.cell_index(snake.head)
+                if board.cell_within_bounds(snake.head) else 0)
+            for head_cell in snake.get_possible_moves().values():
+                if board.cell_within_bounds(head_cell) and not self.is_body(
+                        head_cell):
+                    self._add_contender(board.cell_index(head_cell), snake)
+        self._reach_masks = {}
+
+    def _add_contender(self, index, snake):
+        """Keep snake if it is one of the two longest contenders for index."""
+        contenders = self._contenders.setdefault(index, [])
+        contenders.append((len(snake), snake.id))
+        contenders.sort(key=lambda contender: -contender[0])
+        del contenders[2:]
+
+    def _bit(self, cell):
+        """Bit of cell in the bitboards, 0 if cell is out of bounds."""
+        if not (0 <= cell.x < self.width and 0 <= cell.y < self.height):
+            return 0
+        return 1 << (cell.y * self.width + cell.x)
+
+    def is_body(self, cell):
+        """Return True if cell is occupied by a body next turn."""
+        return bool(self.next_body_mask & self._bit(cell))
+
+    def contender_length(self, cell, snake_id=None):
+        """Length of the longest other snake that could move into cell, or 0."""
+        if not (0 <= cell.x < self.width and 0 <= cell.y < self.height):
+            return 0
+        for length, contender_id in self._contenders.get(
+                cell.y * self.width + cell.x, []):
+            if contender_id != snake_id:
+                return length
+        return 0
+
+    def is_safe(self, cell, snake_id):
+        """
+        Return True if the head of snake_id can't die by moving into cell.
+
+        The cell has to be on the board, free of bodies next turn, and only
+        contested by shorter snakes.
+        """
+        return (self._bit(cell) != 0
+                and not self.is_body(cell)
+                and self.contender_length(cell, snake_id)
+                < self._lengths[snake_id])
+
+    def reach_mask(self, snake_id, steps):
+        """Bitboard of the cells the head of snake_id can be on after steps."""
+        reach_masks = self._reach_masks.get(snake_id)
+        if reach_masks is None or len(reach_masks) <= steps:
+            # Grown on a copy, as maps are shared with background searches
+            reach_masks = list(reach_masks or [self._heads[snake_id]])
+            free_mask = self._full_mask & ~self.next_body_mask
+            while len(reach_masks) <= steps:
+                reach_masks.append(self._shift(reach_masks[-1]) & free_mask)
+            self._reach_masks[snake_id] = reach_masks
+        return reach_masks[steps]
+
+    def threat_mask(self, snake_id, steps):
+        """Bitboard of the cells snakes at least as long can reach in steps."""
+        length = self._lengths[snake_id]
+        threat_mask = 0
+        for other_snake_id, other_length in self._lengths.items():
+            if other_snake_id != snake_id and other_length >= length:
+                threat_mask |= self.reach_mask(other_snake_id, steps)
+        return threat_mask
+
+    def is_trapped(self, cell, snake_id):
+        """
+        Return True if every way out of cell is a head to head risk.
+
+        That is, every free neighbour of cell could be taken, two moves from
+        now, by the head of a snake at least as long as snake_id.
+        """
+        bit = self._bit(cell)
+        exits = self._shift(bit) & ~self.next_body_mask
+        return not exits & ~self.threat_mask(snake_id, 2)
+
+    def _shift(self, mask):
+        """Cells one move away from the cells of mask, within the board."""
+        return self._full_mask & (
+            (mask << 1) & self._not_first_column
+            | (mask >> 1) & self._not_last_column
+            | mask << self.width
+            | mask >> self.width)
+
+
+def get_threat_map(board):
+    """
+    Get the ThreatMap of board.
+
+    Maps are memoized on the board's zobrist_hash, so every search node
+    that reaches the same board state shares one map. The memo is locked,
+    since background searches use it too.
+    """
+    key = (board.zobrist_hash, board.width, board.height)
+    with _threat_maps_lock:
+        threat_map = _threat_maps.get(key)
+        if threat_map is not None:
+            _threat_maps.move_to_end(key)
+            return threat_map
+    threat_map = ThreatMap(board)
+    with _threat_maps_lock:
+        _threat_maps[key] = threat_map
+        if len(_threat_maps) > MAX_THREAT_MAPS:
+            _threat_maps.popitem(last=False)
+    return threat_map
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from collections import namedtuple
+from threading import Lock
+
+SearchEntry = namedtuple("SearchEntry", "depth, move_evaluation")
+
+
+def get_position_key(board, snake_id):
+    """
+    Key of the position of board for snake_id in a TranspositionTable.
+
+    The zobrist_hash only has the health of snakes in buckets, while the
+    heuristic depends on the exact health of the snake it evaluates, so
+    that health is part of the key.
+    """
+    snake = board.snakes.get(snake_id)
+    return (board.zobrist_hash, snake_id,
+            None if snake is None else snake.health_points)
+
+
+class TranspositionTable:
+    """
+    Bounded cache of heuristic evaluations and search results.
+
+    Entries are keyed by get_position_key, so evaluations are exact. Search
+    results are approximate: they also depend on the health of the other
+    snakes, which only the buckets of the zobrist_hash tell apart. Each kind
+    of entry is bounded by max_entries and the least recently used entry is
+    evicted first. A search result is only replaced by a result searched at
+    least as deep, and only answers lookups at the same or a shallower
+    depth. The table is locked, so a background search can share it.
+    """
+
+    MAX_ENTRIES = 50000
+
+    def __init__(self, max_entries=None):
+        self.max_entries = (self.MAX_ENTRIES if max_entries is None
+                            else max_entries)
+        self._evaluations = OrderedDict()
+        self._searches = OrderedDict()
+        self._lock = Lock()
+        self.evaluation_hits = 0
+        self.evaluation_misses = 0
+        self.search_hits = 0
+        self.search_misses = 0
+        self.evictions = 0
+
+    def get_evaluation(self, key):
+        """Get the heuristic evaluation stored for key, or None."""
+        with self._lock:
+            evaluation = self._evaluations.get(key)
+            if evaluation is None:
+                self.evaluation_misses += 1
+                return None
+            self.evaluation_hits += 1
+            self._evaluations.move_to_end(key)
+            return evaluation
+
+    def store_evaluation(self, key, evaluation):
+        """Store the heuristic evaluation for key."""
+        with self._lock:
+            self._evaluations[key] = evaluation
+            self._evaluations.move_to_end(key)
+            self._evict(self._evaluations)
+
+    def get_search(self, key, depth):
+        """Get the MoveEvaluation searched for key to at least depth, or None."""
+        with self._lock:
+            entry = self._searches.get(key)
+            if entry is None or entry.depth < depth:
+                self.search_misses += 1
+                return None
+            self.search_hits += 1
+            self._searches.move_to_end(key)
+            return entry.move_evaluation
+
+    def has_search(self, key):
+        """Return True if a search result is stored for key."""
+        return key in self._searches
+
+    def store_search(self, key, depth, move_evaluation):
+        """Store the MoveEvaluation searched for key to depth."""
+        with self._lock:
+            entry = self._searches.get(key)
+            if entry is None or entry.depth <= depth:
+                self._searches[key] = SearchEntry(depth, move_evaluation)
+            self._searches.move_to_end(key)
+            self._evict(self._searches)
+
+    def _evict(self, entries):
+        """Evict least recently used entries until entries is within bounds."""
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all entries, keeping the counters."""
+        with self._lock:
+            self._evaluations.clear()
+            self._searches.clear()
+
+    def stats(self):
+        """Sizes, hit and miss counts and hit rates of the table."""
+        def _hit_rate(hits, misses):
+            return hits / (hits + misses) if hits + misses else 0.0
+
+        return {
+            "evaluations": len(self._evaluations),
+            "searches": len(self._searches),
+            "max_entries": self.max_entries,
+            "evaluation_hits": self.evaluation_hits,
+            "evaluation_misses": self.evaluation_misses,
+            "evaluation_hit_rate": _hit_rate(
+                self.evaluation_hits, self.evaluation_misses),
+            "search_hits": self.search_hits,
+            "search_misses": self.search_misses,
+            "search_hit_rate": _hit_rate(
+                self.search_hits, self.search_misses),
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._evaluations) + len(self._searches)
@@ -0,0 +1,64 @@
+from collections import namedtuple
+import numpy as np
+
+VoronoiPartition = namedtuple(
+    "VoronoiPartition", "territory, contested, reachable_food")
+
+
+def mask_to_array(mask, width, height):
+    """Unpack an integer bitboard into a height x width boolean array."""
+    size = width * height
+    mask_bytes = np.frombuffer(
+        mask.to_bytes((size + 7) // 8, "big"), dtype=np.uint8)
+    return np.unpackbits(mask_bytes)[::-1][:size].reshape(
+        height, width).astype(bool)
+
+
+def _dilate(frontiers):
+    """Expand every frontier in a stack of frontiers by one cell."""
+    expanded = np.zeros_like(frontiers)
+    expanded[:, 1:, :] |= frontiers[:, :-1, :]
+    expanded[:, :-1, :] |= frontiers[:, 1:, :]
+    expanded[:, :, 1:] |= frontiers[:, :, :-1]
+    expanded[:, :, :-1] |= frontiers[:, :, 1:]
+    return expanded
+
+
+def voronoi_partition(board):
+    """
+    Partition the free cells of the board between the live snakes.
+
+    A cell belongs to the snake whose head can reach it in strictly fewer
+    moves than any other snake, without crossing snake bodies. Cells reached
+    first by several snakes at once are contested. The distances from all
+    heads are computed at once, by expanding a stack of per snake frontiers
+    with array operations on the obstacle mask.
+
+    Returns the territory and the owned food of every snake, by snake id, and
+    the number of contested cells.
+    """
+    snakes = board.get_snakes()
+    frontiers = np.zeros((len(snakes), board.height, board.width), dtype=bool)
+    for index, snake in enumerate(snakes):
+        if board.cell_within_bounds(snake.head):
+            frontiers[index, snake.head.y, snake.head.x] = True
+
+    reached = mask_to_array(board.body_mask, board.width, board.height)
+    owned = np.zeros_like(frontiers)
+    contested = np.zeros_like(reached)
+    while frontiers.any():
+        frontiers = _dilate(frontiers) & ~reached
+        reached_by = frontiers.sum(axis=0)
+        owned |= frontiers & (reached_by == 1)
+        contested |= reached_by > 1
+        reached |= reached_by > 0
+
+    food = mask_to_array(board.food_mask, board.width, board.height)
+    territory = owned.sum(axis=(1, 2))
+    owned_food = (owned & food).sum(axis=(1, 2))
+    return VoronoiPartition(
+        territory={snake.id: int(territory[index])
+                   for index, snake in enumerate(snakes)},
+        contested=int(contested.sum()),
+        reachable_food={snake.id: int(owned_food[index])
+                        for index, snake in enumerate(snakes)})
@@ -0,0 +1,119 @@
+"""
+Prepare a process for the games it is about to play.
+
+Everything the search builds per board size is built lazily, and code paths
+run for the first time are slow, so the first /move of a game on a fresh
+process is much slower than the rest. warm_up does that work when the game
+starts instead, by building the shared structures of the board size and
+searching a synthetic board of the same size and snake count.
+"""
+from collections import OrderedDict
+from collections import namedtuple
+import random
+import time
+from snakemodel.game import Game
+from snakemodel.geometry import get_geometry
+from snakemodel.zobrist import get_zobrist_keys
+from .mcts import MCTS
+from .snake_ai import SnakeAI
+from .transposition import TranspositionTable
+
+WARMUP_TIME_BUDGET = 0.05
+DEFAULT_SNAKE_COUNT = 4
+FOOD_COUNT = 4
+SNAKE_LENGTH = 3
+
+GameConfig = namedtuple("GameConfig",
+                        "game_id, width, height, snake_ids, you")
+
+
+def parse_game_config(data):
+    """
+    The GameConfig of the data of a /start request, or None.
+
+    Reads the game id, board size and snakes of both the legacy request,
+    which only has game_id, width and height, and of requests with the
+    snakes and you. Returns None if there is no board size.
+    """
+    board = data.get("board", data)
+    if "width" not in board or "height" not in board:
+        return None
+    snakes = board.get("snakes", [])
+    if isinstance(snakes, dict):
+        snakes = snakes.get("data", [])
+    you = data.get("you")
+    return GameConfig(
+        game_id=data.get("game_id", data.get("id", data.get(
+            "game", {}).get("id", 0))),
+        width=board["width"],
+        height=board["height"],
+        snake_ids=[snake["id"] for snake in snakes],
+        you=you["id"] if isinstance(you, dict) else you)
+
+
+def create_warmup_data(config, seed=0):
+    """
+    Data of a /move request on a synthetic board of the game's size.
+
+    The snakes are the game's, or DEFAULT_SNAKE_COUNT made up ones, stacked
+    at random cells as they are at the start of a game, with some food.
+    """
+    snake_ids = config.snake_ids or [
+        "warmup-{}".format(index) for index in range(DEFAULT_SNAKE_COUNT)]
+    you = config.you if config.you in snake_ids else snake_ids[0]
+    generator = random.Random(seed)
+    cells = generator.sample(
+        [(x, y) for x in range(config.width) for y in range(config.height)],
+        min(len(snake_ids) + FOOD_COUNT, config.width * config.height))
+    snakes = [{
+        "id": snake_id,
+        "name": snake_id,
+        "health": 100,
+        "body": {"data": [{"x": x, "y": y}] * SNAKE_LENGTH},
+    } for snake_id, (x, y) in zip(snake_ids, cells)]
+    return {
+        "id": config.game_id,
+        "width": config.width,
+        "height": config.height,
+        "turn": 0,
+        "food": {"data": [{"x": x, "y": y}
+                          for x, y in cells[len(snake_ids):]]},
+        "snakes": {"data": snakes},
+        "you": next(snake for snake in snakes if snake["id"] == you),
+    }
+
+
+def warm_up(config, heuristic, workers=None):
+    """
+    Build and exercise what the game of config needs before it starts.
+
+    Builds the Geometry, distances and Zobrist keys of the board size and
+    snakes, then searches a synthetic board with heuristic and, if workers
+    is more than 1, with an MCTS over that many worker processes, so the
+    process pool is started. Returns the seconds spent per step.
+    """
+    timings = OrderedDict()
+    start = time.perf_counter()
+    geometry = get_geometry(config.width, config.height)
+    # The distances are otherwise computed on first use
+    geometry.distances
+    timings["geometry"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    game = Game(create_warmup_data(config))
+    zobrist_keys = get_zobrist_keys(config.width, config.height)
+    for snake_id in game.snake_ids:
+        zobrist_keys.snake_keys(snake_id)
+    timings["board"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    SnakeAI(game, heuristic, time_budget=WARMUP_TIME_BUDGET,
+            transposition_table=TranspositionTable()).best_move()
+    timings["search"] = time.perf_counter() - start
+
+    if workers is not None and workers > 1:
+        start = time.perf_counter()
+        MCTS(game, time_budget=WARMUP_TIME_BUDGET, workers=workers,
+             seed=0).best_move()
+        timings["pool"] = time.perf_counter() - start
+    return timings
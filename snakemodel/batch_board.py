@@ -0,0 +1,202 @@
+import numpy as np
+from .snake import Move
+
+MOVES = list(Move)
+MOVE_DELTAS = np.array([move.value for move in MOVES], dtype=np.int64)
+OUT_OF_BOUNDS = -1
+
+
+class BatchBoard:
+    """
+    Many independent games of one board size, stepped at once with arrays.
+
+    A structure of arrays version of Board for rollouts and self play. Cells
+    are flat indexes y * width + x, or OUT_OF_BOUNDS. For game g and snake s:
+    body[g, s] is a ring buffer whose segment i is at (head_slot + i) % capacity
+    for i < length, so a move only writes the new head. occupancy counts the
+    snake segments per cell, like Board.occupancy, and food is a mask.
+
+    The rules are those of Board.update_board, including its quirks: all
+    live snakes lose health every step, food is eaten even by snakes that die
+    that step, head to head ties kill both snakes and no food is spawned.
+    """
+
+    def __init__(self, width, height, game_count, snake_count, capacity=None):
+        self.width = width
+        self.height = height
+        self.capacity = width * height + 2 if capacity is None else capacity
+        shape = (game_count, snake_count)
+        self.body = np.full(shape + (self.capacity,), OUT_OF_BOUNDS,
+                            dtype=np.int64)
+        self.head_slot = np.zeros(shape, dtype=np.int64)
+        self.length = np.zeros(shape, dtype=np.int64)
+        self.health = np.zeros(shape, dtype=np.int64)
+        self.alive = np.zeros(shape, dtype=bool)
+        self.occupancy = np.zeros((game_count, width * height),
+                                  dtype=np.int64)
+        self.food = np.zeros((game_count, width * height), dtype=bool)
+        self.turn = 0
+
+    @classmethod
+    def from_boards(cls, boards, snake_ids):
+        """
+        A BatchBoard of copies of boards, all of one size.
+
+        Snake s of every game is the snake with snake_ids[s], or a dead
+        snake if the board has no live snake with that id.
+        """
+        width, height = boards[0].width, boards[0].height
+        batch_board = cls(width, height, len(boards), len(snake_ids))
+        for game, board in enumerate(boards):
+            for cell in board.food:
+                batch_board.food[game, cell.y * width + cell.x] = True
+            for snake_index, snake_id in enumerate(snake_ids):
+                snake = board.snakes.get(snake_id)
+                if snake is not None:
+                    batch_board._set_snake(game, snake_index, snake)
+        return batch_board
+
+    def _set_snake(self, game, snake_index, snake):
+        """Place a live Snake as snake_index of game."""
+        cells = [cell.y * self.width + cell.x for cell in snake.body]
+        self.body[game, snake_index, :len(cells)] = cells
+        self.head_slot[game, snake_index] = 0
+        self.length[game, snake_index] = len(cells)
+        self.health[game, snake_index] = snake.health_points
+        self.alive[game, snake_index] = True
+        np.add.at(self.occupancy[game], cells, 1)
+
+    @property
+    def heads(self):
+        """Head cell of every snake, OUT_OF_BOUNDS for heads off the board."""
+        return self.body[np.arange(self.body.shape[0])[:, None],
+                         np.arange(self.body.shape[1])[None, :],
+                         self.head_slot]
+
+    def get_body(self, game, snake_index):
+        """Body of a snake as (x, y) tuples, from head to tail."""
+        slots = (self.head_slot[game, snake_index]
+                 + np.arange(self.length[game, snake_index])) % self.capacity
+        return [(int(cell) % self.width, int(cell) // self.width)
+                for cell in self.body[game, snake_index, slots]]
+
+    def _segment_cells(self, mask):
+        """Game and cell of every segment of the snakes in mask, on board."""
+        games, snake_indexes = np.nonzero(mask)
+        lengths = self.length[games, snake_indexes]
+        segments = np.arange(self.capacity)[None, :] < lengths[:, None]
+        slots = (self.head_slot[games, snake_indexes][:, None]
+                 + np.arange(self.capacity)[None, :]) % self.capacity
+        cells = self.body[games[:, None], snake_indexes[:, None], slots]
+        segments &= cells != OUT_OF_BOUNDS
+        return np.broadcast_to(games[:, None], cells.shape)[segments], \
+            cells[segments]
+
+    def _move_targets(self, moves):
+        """Cells the heads move into, OUT_OF_BOUNDS if they leave the board."""
+        heads = self.heads
+        x = heads % self.width + MOVE_DELTAS[moves, 0]
+        y = heads // self.width + MOVE_DELTAS[moves, 1]
+        within_bounds = ((heads != OUT_OF_BOUNDS) & (0 <= x) & (x < self.width)
+                         & (0 <= y) & (y < self.height))
+        return np.where(within_bounds, y * self.width + x, OUT_OF_BOUNDS)
+
+    def safe_moves(self):
+        """
+        Mask of the moves of every snake onto free cells, games x snakes x 4.
+
+        A cell is free if it is on the board and unoccupied, or if it is
+        only occupied by a tail that will move away.
+        """
+        tails = self.body[
+            np.arange(self.body.shape[0])[:, None],
+            np.arange(self.body.shape[1])[None, :],
+            (self.head_slot + self.length - 1) % self.capacity]
+        safe_moves = np.zeros(self.alive.shape + (len(MOVES),), dtype=bool)
+        games = np.arange(self.body.shape[0])[:, None]
+        for move_index in range(len(MOVES)):
+            targets = self._move_targets(
+                np.full(self.alive.shape, move_index))
+            on_board = targets != OUT_OF_BOUNDS
+            occupancy = self.occupancy[games, np.where(on_board, targets, 0)]
+            vacated_tails = (targets[:, :, None] == tails[:, None, :]) & (
+                self.alive[:, None, :])
+            safe_moves[:, :, move_index] = self.alive & on_board & (
+                occupancy - vacated_tails.sum(axis=2) == 0)
+        return safe_moves
+
+    def random_moves(self, generator):
+        """
+        A random safe move per snake, or any move if none is safe.
+
+        generator is a numpy.random.RandomState.
+        """
+        safe_moves = self.safe_moves()
+        weights = np.where(safe_moves.any(axis=2)[:, :, None],
+                           safe_moves, True) * generator.random_sample(
+                               safe_moves.shape)
+        return weights.argmax(axis=2)
+
+    def step(self, moves):
+        """
+        Move every live snake of every game at once.
+
+        moves is a games x snakes array of indexes into MOVES. The moves of
+        dead snakes are ignored.
+        """
+        games = np.arange(self.body.shape[0])[:, None]
+        snake_indexes = np.arange(self.body.shape[1])[None, :]
+        alive = self.alive
+        live_games, live_snakes = np.nonzero(alive)
+
+        # 1. Move snakes
+        tails = self.body[
+            live_games, live_snakes,
+            (self.head_slot + self.length - 1)[alive] % self.capacity]
+        targets = self._move_targets(moves)[alive]
+        self.head_slot[alive] = (self.head_slot[alive] - 1) % self.capacity
+        self.body[live_games, live_snakes, self.head_slot[alive]] = targets
+        on_board = tails != OUT_OF_BOUNDS
+        np.subtract.at(self.occupancy,
+                       (live_games[on_board], tails[on_board]), 1)
+        on_board = targets != OUT_OF_BOUNDS
+        np.add.at(self.occupancy,
+                  (live_games[on_board], targets[on_board]), 1)
+
+        # 2. Update world
+        self.health[alive] -= 1
+        heads = self.heads
+        eating = alive & (heads != OUT_OF_BOUNDS) & self.food[
+            games, np.where(heads == OUT_OF_BOUNDS, 0, heads)]
+        eating_games, eating_snakes = np.nonzero(eating)
+        new_tails = self.body[
+            eating_games, eating_snakes,
+            (self.head_slot + self.length - 1)[eating] % self.capacity]
+        self.body[eating_games, eating_snakes,
+                  (self.head_slot + self.length)[eating] % self.capacity] = \
+            new_tails
+        self.length[eating] += 1
+        self.health[eating] = 100
+        np.add.at(self.occupancy, (eating_games, new_tails), 1)
+        self.food[eating_games, heads[eating]] = False
+
+        # 3. Snakes dying
+        on_board = alive & (heads != OUT_OF_BOUNDS)
+        head_occupancy = self.occupancy[
+            games, np.where(on_board, heads, 0)]
+        same_head = (on_board[:, :, None] & on_board[:, None, :]
+                     & (heads[:, :, None] == heads[:, None, :]))
+        hit_body = head_occupancy > same_head.sum(axis=2)
+        other_heads = same_head & (
+            snake_indexes.T != snake_indexes)[None, :, :]
+        lost_head_to_head = (other_heads & (
+            self.length[:, None, :] >= self.length[:, :, None])).any(axis=2)
+        survived = (on_board & (self.health > 0) & ~hit_body
+                    & ~lost_head_to_head)
+
+        dying = alive & ~survived
+        dead_games, dead_cells = self._segment_cells(dying)
+        np.subtract.at(self.occupancy, (dead_games, dead_cells), 1)
+        self.alive = survived
+        self.turn += 1
+        return self
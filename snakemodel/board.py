@@ -1,7 +1,14 @@
+from collections import namedtuple
+from copy import copy
 from itertools import chain
 from enum import Enum
+import numpy as np
 from .snake import Snake
 from .cell import Cell
+from .geometry import get_geometry
+from .parse import array_to_mask
+from .parse import get_live_cells
+from .zobrist import get_zobrist_keys
 
 
 class EntityId(Enum):
@@ -13,26 +20,105 @@ class EntityId(Enum):
     FOOD = "FOOD"
 
 
+UndoRecord = namedtuple(
+    "UndoRecord",
+    "moved, health, consumed, spawned, snakes, dead_snakes, food_mask, "
+    "body_mask, zobrist_hash, journal")
+
+
 class Board:
     """
     The state of the game board including the food and Snakes.
 
     Has a grid representation that is a view of the entities on the board.
+    The grid is a flat, preallocated list indexed by y * width + x, alongside
+    a per cell count of snake segments and integer bitboards of the food and
+    occupied cells. All of these are updated in place as snakes move, rather
+    than rebuilt every turn. The same goes for zobrist_hash, a Zobrist hash of
+    the snakes, food and dead snakes that identifies the board state.
+
+    Food is only spawned if rng, a random.Random, is set. Undoing moves
+    removes the food they spawned, but does not rewind rng.
     """
 
     def __init__(self, data):
-        self.game_id = data.get('game_id', 0)
+        self.game_id = data.get('game_id', data.get('id', 0))
         self.width = data['width']
         self.height = data['height']
         self.food = self._create_food(data['food'])
         self.snakes = self._create_snakes(data['snakes'])
         self.dead_snakes = self._create_dead_snakes(
             data.get('dead_snakes', {'data': []}))
+        self.rng = None
+        self._journal = None
         self._build_grid()
 
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        A Board from BoardArrays, such as those of parse_payload.
+
+        The grid, occupancy, bitboards and hash are filled from flat cell
+        indexes, and the Cells of the food and live snakes are shared between
+        boards of the same size.
+        """
+        board = cls.__new__(cls)
+        board.game_id = arrays.game_id
+        board.width = arrays.width
+        board.height = arrays.height
+        board.rng = None
+        board._journal = None
+
+        size = arrays.width * arrays.height
+        cells = get_geometry(arrays.width, arrays.height).cells
+        food_indexes = (arrays.food_y * arrays.width + arrays.food_x).tolist()
+        live_cells = get_live_cells(arrays)
+        # Live snakes come first, so their segments start the body arrays
+        live_indexes = live_cells.tolist()
+        ends = np.cumsum(arrays.lengths).tolist()
+        health = arrays.health.tolist()
+        board.food = set(cells[index] for index in food_indexes)
+        board.snakes = {}
+        board.dead_snakes = {}
+        live_snakes = []
+        for snake_index, snake_id in enumerate(arrays.snake_ids):
+            end = ends[snake_index]
+            start = end - int(arrays.lengths[snake_index])
+            if arrays.alive[snake_index]:
+                indexes = live_indexes[start:end]
+                live_snakes.append((snake_id, health[snake_index], indexes))
+                board.snakes[snake_id] = Snake.from_cells(
+                    snake_id, arrays.names[snake_index], health[snake_index],
+                    [cells[index] for index in indexes])
+            else:
+                board.dead_snakes[snake_id] = Snake.from_cells(
+                    snake_id, arrays.names[snake_index], health[snake_index],
+                    [Cell(x, y) for x, y in zip(
+                        arrays.body_x[start:end].tolist(),
+                        arrays.body_y[start:end].tolist())])
+
+        occupancy = np.bincount(live_cells, minlength=size)
+        food = np.zeros(size, dtype=bool)
+        food[food_indexes] = True
+        board.occupancy = occupancy.tolist()
+        board.food_mask = array_to_mask(food)
+        board.body_mask = array_to_mask(occupancy > 0)
+        grid = board.grid = [EntityId.EMPTY] * size
+        for index in food_indexes:
+            grid[index] = EntityId.FOOD
+        for index in live_indexes:
+            grid[index] = EntityId.BODY
+        for _, _, indexes in live_snakes:
+            grid[indexes[0]] = EntityId.HEAD
+        board.zobrist_hash = board._get_zobrist_keys().indexes_hash(
+            food_indexes, live_snakes, board.dead_snakes)
+        return board
+
     def _create_food(self, food_data):
         """Parse food from food_data."""
-        return set(Cell(food.get('x'), food.get('y')) for food in food_data.get('data'))
+        geometry = get_geometry(self.width, self.height)
+        return set(geometry.cell(food.get('x'), food.get('y'))
+                   for food in food_data.get('data'))
 
     def _create_snakes(self, snakes_data):
         """Parse snakes from snakes_data."""
@@ -46,18 +132,67 @@ class Board:
 
     def _build_grid(self):
         """Build a grid of EntityId that represents the current board state."""
-        self.board = [[EntityId.EMPTY for _ in range(
-            self.width)] for _ in range(self.height)]
+        size = self.width * self.height
+        self.grid = [EntityId.EMPTY] * size
+        self.occupancy = [0] * size
+        self.food_mask = 0
+        self.body_mask = 0
 
         # Mark food
         for cell in self.food:
             self._set_entity_at_cell(cell, EntityId.FOOD)
+            self.food_mask |= 1 << self.cell_index(cell)
 
         # Mark live snakes
         for _, snake in self.snakes.items():
             for cell in snake.body:
-                self._set_entity_at_cell(cell, EntityId.BODY)
-            self._set_entity_at_cell(snake.head, EntityId.HEAD)
+                self._add_segment(cell)
+        self._mark_heads()
+
+        self.zobrist_hash = self._get_zobrist_keys().board_hash(self)
+
+    def _get_zobrist_keys(self):
+        """Get the Zobrist keys shared by boards of this size."""
+        return get_zobrist_keys(self.width, self.height)
+
+    def cell_index(self, cell):
+        """Index of Cell in the flat grid and bit of Cell in the bitboards."""
+        return cell.y * self.width + cell.x
+
+    def _add_segment(self, cell):
+        """Mark a snake segment as occupying Cell."""
+        if not self.cell_within_bounds(cell):
+            return
+        index = self.cell_index(cell)
+        self._record_cell(index)
+        if not self.occupancy[index]:
+            self.body_mask |= 1 << index
+        self.occupancy[index] += 1
+        self.grid[index] = EntityId.BODY
+
+    def _remove_segment(self, cell):
+        """Unmark a snake segment from Cell, clearing it if it is vacated."""
+        if not self.cell_within_bounds(cell):
+            return
+        index = self.cell_index(cell)
+        self._record_cell(index)
+        self.occupancy[index] -= 1
+        if not self.occupancy[index]:
+            self.body_mask &= ~(1 << index)
+            self.grid[index] = (EntityId.FOOD if self.food_mask >> index & 1
+                                else EntityId.EMPTY)
+
+    def _record_cell(self, index):
+        """Journal the grid cell at index if moves are being recorded."""
+        if self._journal is not None:
+            self._journal.append(
+                (index, self.grid[index], self.occupancy[index]))
+
+    def _mark_heads(self):
+        """Mark the heads of live snakes on the grid."""
+        for _, snake in self.snakes.items():
+            if self.cell_within_bounds(snake.head):
+                self._set_entity_at_cell(snake.head, EntityId.HEAD)
 
     def is_snake_id_at_cell(self, snake_id, cell):
         """Return True if Entity at Cell is a Snake and has snake_id."""
@@ -72,7 +207,7 @@ class Board:
 
     def get_entity_at_pos(self, x, y):
         """Get EntityId at position."""
-        return self.board[y - 1][x - 1]
+        return self.grid[y * self.width + x]
 
     def get_object_at_cell(self, cell):
         """Get object at Cell."""
@@ -94,7 +229,9 @@ class Board:
 
     def _set_entity_at_pos(self, x, y, entity_id):
         """Set EntityId at position."""
-        self.board[y - 1][x - 1] = entity_id
+        index = y * self.width + x
+        self._record_cell(index)
+        self.grid[index] = entity_id
 
     def cell_within_bounds(self, cell):
         """Return True if Cell is within bounds of the game grid."""
@@ -108,24 +245,108 @@ class Board:
         """
         State transition for board. Applies moves to all live snakes.
 
-        The Grid is invalidated until the end of this method.
+        The Grid is updated in place from the head and tail deltas of each
+        step, so it is valid at the end of this method.
         Order of events:
         1. Move snakes
-        2. Snakes dying
-        3. Update world
-        4. Update grid
+        2. Update world
+        3. Snakes dying
         """
 
         self._move_snakes(snake_id_move_mapping)
         self._update_board_after_move()
         self._resolve_deaths()
-        self._build_grid()
         return self
 
+    def apply_moves(self, snake_id_move_mapping):
+        """
+        Apply moves in place, like update_board, and return an UndoRecord.
+
+        Passing the record to undo restores the exact prior state, which lets
+        a search walk a single mutable board instead of copying it per move.
+        """
+        snakes = self.snakes
+        dead_snakes = self.dead_snakes
+        food_mask = self.food_mask
+        body_mask = self.body_mask
+        zobrist_hash = self.zobrist_hash
+        health = [(snake, snake.health_points) for snake in self.get_snakes()]
+        self._journal = []
+        try:
+            moved = self._move_snakes(snake_id_move_mapping)
+            consumed, spawned = self._update_board_after_move()
+            self._resolve_deaths()
+            journal = self._journal
+        finally:
+            self._journal = None
+        return UndoRecord(moved, health, consumed, spawned, snakes,
+                          dead_snakes, food_mask, body_mask, zobrist_hash,
+                          journal)
+
+    def undo(self, record):
+        """Restore the state from before the apply_moves that made record."""
+        for index, entity_id, occupancy in reversed(record.journal):
+            self.grid[index] = entity_id
+            self.occupancy[index] = occupancy
+        self.food_mask = record.food_mask
+        self.body_mask = record.body_mask
+        self.zobrist_hash = record.zobrist_hash
+        self.snakes = record.snakes
+        self.dead_snakes = record.dead_snakes
+        self.food.difference_update(record.spawned)
+        for snake, food_cell in record.consumed.items():
+            snake.body.pop()
+            self.food.add(food_cell)
+        for snake, tail in reversed(record.moved):
+            snake.body.pop(0)
+            snake.body.append(tail)
+            snake.head = snake.body[0]
+        for snake, health_points in record.health:
+            snake.health_points = health_points
+
+    def copy(self):
+        """Copy the board, sharing only the immutable Cells and dead Snakes."""
+        board = copy(self)
+        board.food = set(self.food)
+        board.snakes = {snake_id: snake.copy()
+                        for snake_id, snake in self.snakes.items()}
+        board.dead_snakes = dict(self.dead_snakes)
+        board.grid = list(self.grid)
+        board.occupancy = list(self.occupancy)
+        return board
+
     def _move_snakes(self, snake_id_move_mapping):
-        """Apply moves to snakes."""
+        """
+        Apply moves to snakes.
+
+        Old heads become body cells, vacated tails are released and new heads
+        are added. Heads are marked last so the grid does not depend on the
+        order in which the snakes are moved.
+
+        Returns the moved snakes with the tail cells they vacated.
+        """
+        zobrist_keys = self._get_zobrist_keys()
+        cell_key = zobrist_keys.cell_key
+        moved = []
         for snake_id, move in snake_id_move_mapping.items():
-            self.snakes[snake_id].apply_move(move)
+            snake = self.snakes[snake_id]
+            snake_keys = zobrist_keys.snake_keys(snake_id)
+            old_head = snake.head
+            if self.cell_within_bounds(old_head):
+                self._set_entity_at_cell(old_head, EntityId.BODY)
+            tail = snake.apply_move(move)
+            self._remove_segment(tail)
+            self._add_segment(snake.head)
+            moved.append((snake, tail))
+            self.zobrist_hash ^= (
+                cell_key(snake_keys.head, old_head)
+                ^ cell_key(snake_keys.head, snake.head)
+                ^ cell_key(snake_keys.tail, tail)
+                ^ cell_key(snake_keys.tail, snake.body[-1])
+                ^ cell_key(snake_keys.body, tail)
+                ^ cell_key(snake_keys.body, snake.head))
+        self._mark_heads()
+        return moved
 
     def _resolve_deaths(self):
         """
@@ -139,11 +360,28 @@ class Board:
                           self.cell_within_bounds(snake.head) and
                           self._check_snake_collision(snake))
 
-        dead_snakes = set(self.get_snakes()) - live_snakes
-
-        self.snakes = {live_snake.id: live_snake
-                       for live_snake in live_snakes}
-
+        # In board order, so dead_snakes is ordered like snakes was
+        dead_snakes = [snake for snake in self.get_snakes()
+                       if snake not in live_snakes]
+        if not dead_snakes:
+            return
+
+        self.snakes = {snake_id: snake
+                       for snake_id, snake in self.snakes.items()
+                       if snake in live_snakes}
+
+        zobrist_keys = self._get_zobrist_keys()
+        for dead_snake in dead_snakes:
+            self.zobrist_hash ^= (zobrist_keys.snake_hash(dead_snake)
+                                  ^ zobrist_keys.snake_keys(dead_snake.id).dead)
+            for cell in dead_snake.body:
+                self._remove_segment(cell)
+                if (self.cell_within_bounds(cell)
+                        and self.occupancy[self.cell_index(cell)]):
+                    self._set_entity_at_cell(cell, EntityId.BODY)
+        self._mark_heads()
+
+        self.dead_snakes = dict(self.dead_snakes)
         self.dead_snakes.update({dead_snake.id: dead_snake
                                  for dead_snake in dead_snakes})
 
@@ -155,6 +393,8 @@ class Board:
         a snake head that belongs to a snake that is the same or larger length,
         it dies.
         """
+        if self.occupancy[self.cell_index(snake.head)] == 1:
+            return True
         _other_snakes_at_snake_head = self._get_other_snakes_at_snake_head(
             snake)
         if not _other_snakes_at_snake_head:
@@ -186,18 +426,47 @@ class Board:
         Update the board after a move.
 
         Decrement health, grow snakes, remove consumed food, respawn food.
+        Returns the mapping of snakes that consumed food to the food cells,
+        and the spawned food cells.
         """
+        zobrist_keys = self._get_zobrist_keys()
         for snake in self.get_snakes():
-            snake.health_points -= 1
+            self._set_health(snake, snake.health_points - 1, zobrist_keys)
 
         snake_consumed_cell_mapping = self._get_snake_consumed_cell_mapping()
-        for snake, food_cell in snake_consumed_cell_mapping.items():
+        for snake in snake_consumed_cell_mapping:
+            snake_keys = zobrist_keys.snake_keys(snake.id)
+            self.zobrist_hash ^= (
+                zobrist_keys.length_key(snake_keys, len(snake))
+                ^ zobrist_keys.length_key(snake_keys, len(snake) + 1)
+                ^ zobrist_keys.cell_key(snake_keys.body, snake.body[-1]))
             snake.grow()
-            snake.health_points = 100
-            self.food.remove(food_cell)
+            self._add_segment(snake.body[-1])
+            self._set_health(snake, 100, zobrist_keys)
+        if snake_consumed_cell_mapping:
+            self._mark_heads()
 
-        for _ in range(len(snake_consumed_cell_mapping)):
-            self._spawn_food()
+        consumed_cells = set(snake_consumed_cell_mapping.values())
+        for food_cell in consumed_cells:
+            self.food.remove(food_cell)
+            self.food_mask &= ~(1 << self.cell_index(food_cell))
+            self.zobrist_hash ^= zobrist_keys.cell_key(
+                zobrist_keys.food, food_cell)
+
+        spawned_cells = []
+        for _ in range(len(consumed_cells)):
+            spawned_cell = self._spawn_food()
+            if spawned_cell is not None:
+                spawned_cells.append(spawned_cell)
+        return snake_consumed_cell_mapping, spawned_cells
+
+    def _set_health(self, snake, health_points, zobrist_keys):
+        """Set the health of snake, updating the hash of its health bucket."""
+        snake_keys = zobrist_keys.snake_keys(snake.id)
+        self.zobrist_hash ^= (
+            zobrist_keys.health_key(snake_keys, snake.health_points)
+            ^ zobrist_keys.health_key(snake_keys, health_points))
+        snake.health_points = health_points
 
     def _get_snake_consumed_cell_mapping(self):
         """
@@ -215,8 +484,59 @@ class Board:
         return [snake for _, snake in self.snakes.items()]
 
     def _spawn_food(self):
-        """stub"""
-        pass
+        """
+        Spawn food on a random empty cell, if the board has an rng.
+
+        Returns the cell of the food, or None if none was spawned.
+        """
+        if self.rng is None:
+            return None
+        empty_indexes = [index for index, entity_id in enumerate(self.grid)
+                         if entity_id is EntityId.EMPTY]
+        if not empty_indexes:
+            return None
+        index = self.rng.choice(empty_indexes)
+        food_cell = get_geometry(self.width, self.height).cells[index]
+        self.food.add(food_cell)
+        self.food_mask |= 1 << index
+        self._set_entity_at_cell(food_cell, EntityId.FOOD)
+        zobrist_keys = self._get_zobrist_keys()
+        self.zobrist_hash ^= zobrist_keys.cell_key(zobrist_keys.food,
+                                                   food_cell)
+        return food_cell
+
+    def to_data(self, turn=0, you=None):
+        """
+        The board as the data of a /move request, that Board can parse.
+
+        you is the id of the snake the request is for, if any.
+        """
+        data = {
+            "object": "world",
+            "id": self.game_id,
+            "width": self.width,
+            "height": self.height,
+            "turn": turn,
+            "food": {
+                "object": "list",
+                "data": [{"object": "point", "x": cell.x, "y": cell.y}
+                         for cell in sorted(
+                             self.food, key=lambda cell: (cell.x, cell.y))],
+            },
+            "snakes": {
+                "object": "list",
+                "data": [snake.to_data() for snake in self.get_snakes()],
+            },
+            "dead_snakes": {
+                "object": "list",
+                "data": [dead_snake.to_data()
+                         for dead_snake in self.dead_snakes.values()],
+            },
+        }
+        if you is not None:
+            data["you"] = (self.snakes.get(you)
+                           or self.dead_snakes[you]).to_data()
+        return data
 
     def __eq__(self, other):
         if isinstance(self, other.__class__):
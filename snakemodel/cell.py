@@ -1,6 +1,8 @@
 class Cell:
     """Cell represents a position on the game grid with coordinates x and y."""
 
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -13,7 +15,7 @@ class Cell:
         return hash((self.x, self.y))
 
     def __lt__(self, other):
-        return True
+        return (self.x, self.y) < (other.x, other.y)
 
     def distance(self, other):
         """Calculate the Manhattan distance between cells"""
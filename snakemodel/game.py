@@ -1,5 +1,5 @@
-from copy import deepcopy
 from .board import Board
+from .parse import parse_payload
 
 
 class Game:
@@ -7,14 +7,31 @@ class Game:
 
     def __init__(self, data):
         self.board = Board(data)
-        self.game_id = data.get('game_id', 0)
+        self.game_id = data.get('game_id', data.get('id', 0))
         self.turn = data['turn']
         self.you = data['you']['id']
         self.snake_ids = self._get_snake_ids(data)
 
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        A Game from the body of a /move request, through parse_payload.
+
+        Faster than decoding the JSON and passing it to Game, and also reads
+        the legacy request format.
+        """
+        arrays = parse_payload(payload)
+        game = cls.__new__(cls)
+        game.board = Board.from_arrays(arrays)
+        game.game_id = arrays.game_id
+        game.turn = arrays.turn
+        game.you = arrays.you
+        game.snake_ids = list(arrays.snake_ids[:len(game.board.snakes)])
+        return game
+
     def simulate_moves(self, board, snake_id_move_mapping):
-        """Simulate the outcome of applying moves to a board"""
-        return deepcopy(board).update_board(snake_id_move_mapping)
+        """Simulate the outcome of applying moves to a copy of a board"""
+        return board.copy().update_board(snake_id_move_mapping)
 
     def _get_snake_ids(self, data):
         """Get the ids of all the players"""
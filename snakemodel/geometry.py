@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+from .cell import Cell
+from .snake import Move
+
+MAX_GEOMETRIES = 16
+
+_geometries = OrderedDict()
+_geometries_lock = Lock()
+
+
+class Geometry:
+    """
+    Precomputed geometry of boards of one width and height.
+
+    Cells are interned: cells[index] is the one Cell of the flat index
+    y * width + x, shared by every board of the size. For every index,
+    neighbours holds the indexes of the neighbours on the board, and
+    moves holds (Move, index) for the moves that stay on the board, in the
+    order of Move. The Manhattan distances between all the cells are
+    computed on first use.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.cells = [Cell(index % width, index // width)
+                      for index in range(self.size)]
+        self.moves = [
+            [(move, (cell.y + move.value[1]) * width + cell.x + move.value[0])
+             for move in Move
+             if 0 <= cell.x + move.value[0] < width
+             and 0 <= cell.y + move.value[1] < height]
+            for cell in self.cells]
+        self.neighbours = [tuple(index for _, index in moves)
+                           for moves in self.moves]
+        self._distances = None
+
+    def within_bounds(self, x, y):
+        """Return True if position is on the board."""
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def index(self, cell):
+        """Flat index of a Cell on the board."""
+        return cell.y * self.width + cell.x
+
+    def cell(self, x, y):
+        """The interned Cell of a position, or a new Cell off the board."""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+        return Cell(x, y)
+
+    @property
+    def distances(self):
+        """size x size array of the Manhattan distances between indexes."""
+        if self._distances is None:
+            indexes = np.arange(self.size)
+            x = indexes % self.width
+            y = indexes // self.width
+            self._distances = (np.abs(x[:, None] - x[None, :])
+                               + np.abs(y[:, None] - y[None, :])).astype(
+                                   np.int32)
+        return self._distances
+
+
+def get_geometry(width, height):
+    """
+    Get the Geometry of boards of width and height.
+
+    Geometries are shared by every board of the size, and at most
+    MAX_GEOMETRIES sizes are kept, evicting the least recently used. The
+    cache is locked, since background searches use it too.
+    """
+    key = (width, height)
+    with _geometries_lock:
+        geometry = _geometries.get(key)
+        if geometry is not None:
+            _geometries.move_to_end(key)
+            return geometry
+    geometry = Geometry(width, height)
+    with _geometries_lock:
+        _geometries[key] = geometry
+        if len(_geometries) > MAX_GEOMETRIES:
+            _geometries.popitem(last=False)
+    return geometry
@@ -0,0 +1,91 @@
+from collections import namedtuple
+import json
+import numpy as np
+
+BoardArrays = namedtuple(
+    "BoardArrays",
+    "game_id, turn, you, width, height, snake_ids, names, health, lengths, "
+    "alive, body_x, body_y, food_x, food_y")
+
+
+def parse_payload(payload):
+    """
+    Decode the data of a /move request into BoardArrays.
+
+    payload is the request body, as bytes or str, or its decoded JSON. Both
+    the current format, with body.data points, and the legacy format, with
+    coords and health_points, are read. Coordinates are collected into
+    numpy arrays without creating an object per cell: the bodies of all the
+    snakes, live ones first and then dead ones, are concatenated in body_x
+    and body_y, head first, and split by lengths.
+    """
+    data = (json.loads(payload) if isinstance(payload, (bytes, str))
+            else payload)
+    legacy = isinstance(data["snakes"], list)
+    snakes = data["snakes"] if legacy else data["snakes"]["data"]
+    dead_snakes = data.get("dead_snakes", [] if legacy else {"data": []})
+    if not legacy:
+        dead_snakes = dead_snakes["data"]
+    all_snakes = snakes + dead_snakes
+    you = data["you"]
+
+    if legacy:
+        food_x = [food[0] for food in data["food"]]
+        food_y = [food[1] for food in data["food"]]
+        body_x = [coord[0] for snake in all_snakes
+                  for coord in snake["coords"]]
+        body_y = [coord[1] for snake in all_snakes
+                  for coord in snake["coords"]]
+        lengths = [len(snake["coords"]) for snake in all_snakes]
+        health = [snake["health_points"] for snake in all_snakes]
+    else:
+        food_points = data["food"]["data"]
+        food_x = [point["x"] for point in food_points]
+        food_y = [point["y"] for point in food_points]
+        body_x = [point["x"] for snake in all_snakes
+                  for point in snake["body"]["data"]]
+        body_y = [point["y"] for snake in all_snakes
+                  for point in snake["body"]["data"]]
+        lengths = [len(snake["body"]["data"]) for snake in all_snakes]
+        health = [snake["health"] for snake in all_snakes]
+
+    return BoardArrays(
+        game_id=data.get("game_id", data.get("id", 0)),
+        turn=data["turn"],
+        you=you if isinstance(you, str) else you["id"],
+        width=data["width"],
+        height=data["height"],
+        snake_ids=[snake["id"] for snake in all_snakes],
+        names=[snake["name"] for snake in all_snakes],
+        health=np.array(health, dtype=np.int64),
+        lengths=np.array(lengths, dtype=np.int64),
+        alive=np.arange(len(all_snakes)) < len(snakes),
+        body_x=np.array(body_x, dtype=np.int64),
+        body_y=np.array(body_y, dtype=np.int64),
+        food_x=np.array(food_x, dtype=np.int64),
+        food_y=np.array(food_y, dtype=np.int64))
+
+
+def get_live_cells(arrays):
+    """
+    Flat cell indexes y * width + x of the live snakes' segments.
+
+    Live snakes come first, so their segments are a prefix of the bodies.
+    Raises ValueError if a live snake is off the board.
+    """
+    segment_count = int(arrays.lengths[arrays.alive].sum())
+    body_x = arrays.body_x[:segment_count]
+    body_y = arrays.body_y[:segment_count]
+    if segment_count and (
+            min(body_x.min(), body_y.min()) < 0
+            or body_x.max() >= arrays.width or body_y.max() >= arrays.height):
+        raise ValueError("Live snake off the board")
+    return body_y * arrays.width + body_x
+
+
+def array_to_mask(array):
+    """Pack a boolean array of flat cells into an integer bitboard."""
+    cells = np.asarray(array, dtype=bool).ravel()
+    padded = np.zeros(-(-len(cells) // 8) * 8, dtype=bool)
+    padded[:len(cells)] = cells
+    return int.from_bytes(np.packbits(padded[::-1]).tobytes(), "big")
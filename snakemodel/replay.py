@@ -0,0 +1,379 @@
+"""
+Compact replays of the /move requests of our games.
+
+A replay is a file of one JSON record per line, per game and snake of ours.
+Every KEYFRAME_INTERVAL records there is a keyframe with the whole state,
+and the records in between only store what changed since the record
+before: food added and removed, and for every snake that moved its health,
+the cells prepended to its body and the count of cells trimmed from its
+tail, as [health, prepended, trimmed]. Snakes that can't be encoded that way
+are stored whole, as {"name", "health", "body"}.
+"""
+from queue import Empty
+from queue import Full
+from queue import Queue
+from threading import Thread
+from collections import OrderedDict
+import json
+import os
+import numpy as np
+from .game import Game
+from .parse import parse_payload
+
+KEYFRAME_INTERVAL = 50
+REPLAY_EXTENSION = ".replay"
+
+
+def get_state(data):
+    """
+    The replayed parts of the data of a /move request, as plain values.
+
+    The data is read with parse_payload, so both its formats are replayed,
+    and decoded in the current one.
+    """
+    arrays = parse_payload(data)
+    ends = np.cumsum(arrays.lengths).tolist()
+    body_x = arrays.body_x.tolist()
+    body_y = arrays.body_y.tolist()
+    snakes = OrderedDict()
+    dead_snakes = OrderedDict()
+    for index, snake_id in enumerate(arrays.snake_ids):
+        start = ends[index] - int(arrays.lengths[index])
+        snake = [arrays.names[index], int(arrays.health[index]),
+                 list(zip(body_x[start:ends[index]],
+                          body_y[start:ends[index]]))]
+        if arrays.alive[index]:
+            snakes[snake_id] = snake
+        else:
+            dead_snakes[snake_id] = snake
+    return {
+        "game_id": arrays.game_id,
+        "width": arrays.width,
+        "height": arrays.height,
+        "you": arrays.you,
+        "food": list(zip(arrays.food_x.tolist(), arrays.food_y.tolist())),
+        "snakes": snakes,
+        "dead_snakes": dead_snakes,
+    }
+
+
+def encode_keyframe(turn, move, state):
+    """Record of the whole state."""
+    return {
+        "turn": turn,
+        "move": move,
+        "key": [state["game_id"], state["width"], state["height"],
+                state["you"]],
+        "food": state["food"],
+        "snakes": _encode_snakes({}, state["snakes"])[0],
+        "dead": _encode_snakes({}, state["dead_snakes"])[0],
+    }
+
+
+def encode_delta(turn, move, previous_state, state):
+    """Record of what changed from previous_state to state."""
+    previous_food = set(previous_state["food"])
+    food = set(state["food"])
+    record = {"turn": turn, "move": move}
+    if food - previous_food:
+        record["food+"] = sorted(food - previous_food)
+    if previous_food - food:
+        record["food-"] = sorted(previous_food - food)
+    for key, field in [("snakes", "snakes"), ("dead", "dead_snakes")]:
+        changes, removed = _encode_snakes(previous_state[field], state[field])
+        if changes:
+            record[key] = changes
+        if removed:
+            record[key + "-"] = removed
+    return record
+
+
+def _encode_snakes(previous_snakes, snakes):
+    """Changed snakes by id, and the ids of the snakes that are gone."""
+    changes = OrderedDict()
+    for snake_id, snake in snakes.items():
+        previous_snake = previous_snakes.get(snake_id)
+        if previous_snake == snake:
+            continue
+        body_change = (None if previous_snake is None
+                       else _encode_body(previous_snake[2], snake[2]))
+        if body_change is None or previous_snake[0] != snake[0]:
+            name, health, body = snake
+            changes[snake_id] = {"name": name, "health": health,
+                                 "body": body}
+        else:
+            changes[snake_id] = [snake[1]] + body_change
+    removed = [snake_id for snake_id in previous_snakes
+               if snake_id not in snakes]
+    return changes, removed
+
+
+def _encode_body(previous_body, body):
+    """
+    [prepended cells, trimmed count] that turn previous_body into body.
+
+    Returns None if body is not previous_body with cells prepended and
+    trimmed from the tail.
+    """
+    for prepended in range(len(body) + 1):
+        kept = len(body) - prepended
+        if kept <= len(previous_body) and (
+                body[prepended:] == previous_body[:kept]):
+            return [body[:prepended], len(previous_body) - kept]
+    return None
+
+
+def decode_record(state, record):
+    """The state after record, from the state before it."""
+    if "key" in record:
+        game_id, width, height, you = record["key"]
+        return {
+            "game_id": game_id,
+            "width": width,
+            "height": height,
+            "you": you,
+            "food": [tuple(cell) for cell in record["food"]],
+            "snakes": _decode_snakes({}, record["snakes"], []),
+            "dead_snakes": _decode_snakes({}, record["dead"], []),
+        }
+    removed_food = set(tuple(cell) for cell in record.get("food-", []))
+    return {
+        "game_id": state["game_id"],
+        "width": state["width"],
+        "height": state["height"],
+        "you": state["you"],
+        "food": [cell for cell in state["food"] if cell not in removed_food]
+        + [tuple(cell) for cell in record.get("food+", [])],
+        "snakes": _decode_snakes(state["snakes"], record.get("snakes", {}),
+                                 record.get("snakes-", [])),
+        "dead_snakes": _decode_snakes(state["dead_snakes"],
+                                      record.get("dead", {}),
+                                      record.get("dead-", [])),
+    }
+
+
+def _decode_snakes(previous_snakes, changes, removed):
+    """Snakes after applying the changes of _encode_snakes."""
+    snakes = OrderedDict(
+        (snake_id, snake) for snake_id, snake in previous_snakes.items()
+        if snake_id not in removed)
+    for snake_id, change in changes.items():
+        if isinstance(change, dict):
+            snakes[snake_id] = [change["name"], change["health"],
+                                [tuple(cell) for cell in change["body"]]]
+        else:
+            health, prepended, trimmed = change
+            name, _, previous_body = snakes[snake_id]
+            body = [tuple(cell) for cell in prepended] + previous_body[
+                :len(previous_body) - trimmed]
+            snakes[snake_id] = [name, health, body]
+    return snakes
+
+
+def state_to_data(turn, state):
+    """The data of the /move request of a decoded state."""
+    snakes = [_snake_to_data(snake_id, snake)
+              for snake_id, snake in state["snakes"].items()]
+    you = state["snakes"].get(state["you"]) or state["dead_snakes"].get(
+        state["you"])
+    return {
+        "object": "world",
+        "id": state["game_id"],
+        "width": state["width"],
+        "height": state["height"],
+        "turn": turn,
+        "food": {"object": "list", "data": [
+            {"object": "point", "x": x, "y": y} for x, y in state["food"]]},
+        "snakes": {"object": "list", "data": snakes},
+        "dead_snakes": {"object": "list", "data": [
+            _snake_to_data(snake_id, snake)
+            for snake_id, snake in state["dead_snakes"].items()]},
+        "you": _snake_to_data(state["you"], you),
+    }
+
+
+def _snake_to_data(snake_id, snake):
+    """The data of a decoded snake in a /move request."""
+    name, health, body = snake
+    return {
+        "object": "snake",
+        "id": snake_id,
+        "name": name,
+        "health": health,
+        "length": len(body),
+        "body": {"object": "list", "data": [
+            {"object": "point", "x": x, "y": y} for x, y in body]},
+    }
+
+
+def get_replay_path(directory, game_id, snake_id):
+    """Path of the replay of game_id for our snake_id."""
+    file_name = "{}-{}".format(game_id, snake_id).replace(os.sep, "_")
+    return os.path.join(directory, file_name + REPLAY_EXTENSION)
+
+
+class ReplayWriter:
+    """Delta encodes the /move requests of one game into a replay file."""
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.state = None
+        self.records = 0
+
+    def write(self, data, move):
+        """Write the record of the data of a /move request and our move."""
+        self.write_state(data["turn"], get_state(data), move)
+
+    def write_state(self, turn, state, move):
+        """Write the record of the state of turn, from get_state."""
+        if (self.state is None or self.records % KEYFRAME_INTERVAL == 0
+                or any(self.state[field] != state[field]
+                       for field in ["game_id", "width", "height", "you"])):
+            record = encode_keyframe(turn, move, state)
+        else:
+            record = encode_delta(turn, move, self.state, state)
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.state = state
+        self.records += 1
+
+    def flush(self):
+        """Flush the written records to the file."""
+        self.file.flush()
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+
+class ReplayLogger:
+    """
+    Writes replays from a background thread, off the request path.
+
+    log() only puts the request data on a bounded queue, so the data must
+    not be changed afterwards. If the writer falls behind and the queue is
+    full, records are dropped and counted rather than blocking. Records
+    that can't be written, such as the data of a malformed request, are
+    skipped and counted in failed, and the writer goes on with the next. At
+    most max_games replay files are kept open, closing the least recently
+    used.
+    """
+
+    MAX_QUEUE = 1024
+    MAX_GAMES = 64
+
+    def __init__(self, directory, max_queue=None, max_games=None):
+        self.directory = directory
+        self.max_games = self.MAX_GAMES if max_games is None else max_games
+        self.dropped = 0
+        self.failed = 0
+        self._queue = Queue(self.MAX_QUEUE if max_queue is None
+                            else max_queue)
+        self._writers = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log(self, data, move):
+        """Queue the record of the data of a /move request and our move."""
+        self._put(("move", data, move))
+
+    def end_game(self, game_id):
+        """Queue closing the replays of game_id."""
+        self._put(("end", game_id, None))
+
+    def close(self):
+        """Write the queued records, close every replay and stop."""
+        self._queue.put(("close", None, None))
+        self._thread.join()
+
+    def _put(self, item):
+        """Put item on the queue, or count it as dropped if it is full."""
+        try:
+            self._queue.put_nowait(item)
+        except Full:
+            self.dropped += 1
+
+    def _run(self):
+        """Write queued records until closed, flushing when idle."""
+        while True:
+            try:
+                kind, value, move = self._queue.get(timeout=1.0)
+            except Empty:
+                for writer in self._writers.values():
+                    writer.flush()
+                continue
+            if kind == "move":
+                self._write(value, move)
+            elif kind == "end":
+                for key in [key for key in self._writers
+                            if key[0] == value]:
+                    self._writers.pop(key).close()
+            else:
+                for writer in self._writers.values():
+                    writer.close()
+                self._writers.clear()
+                return
+
+    def _write(self, data, move):
+        """Write the record of data, counting it as failed if it raises."""
+        try:
+            state = get_state(data)
+            self._get_writer(state).write_state(data["turn"], state, move)
+        except Exception:
+            self.failed += 1
+
+    def _get_writer(self, state):
+        """The ReplayWriter of the game of state, opening it if needed."""
+        key = (state["game_id"], state["you"])
+        writer = self._writers.get(key)
+        if writer is None:
+            writer = self._writers[key] = ReplayWriter(
+                get_replay_path(self.directory, *key))
+            while len(self._writers) > self.max_games:
+                _, evicted_writer = self._writers.popitem(last=False)
+                evicted_writer.close()
+        else:
+            self._writers.move_to_end(key)
+        return writer
+
+
+class ReplayReader:
+    """
+    Reconstructs the turns of a replay file.
+
+    The records are loaded up front, and a turn is decoded from the keyframe
+    before it. A replay appended to by several games with the same id is
+    read as one game, from the last time each turn was written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "r") as replay_file:
+            self.records = [json.loads(line) for line in replay_file
+                            if line.strip()]
+        self._indexes = {record["turn"]: index
+                         for index, record in enumerate(self.records)}
+
+    @property
+    def turns(self):
+        """The turns in the replay, in order."""
+        return sorted(self._indexes)
+
+    def get_move(self, turn):
+        """Name of the move we made on turn."""
+        return self.records[self._indexes[turn]]["move"]
+
+    def get_data(self, turn):
+        """The data of the /move request of turn."""
+        index = self._indexes[turn]
+        keyframe_index = index
+        while "key" not in self.records[keyframe_index]:
+            keyframe_index -= 1
+        state = None
+        for record in self.records[keyframe_index:index + 1]:
+            state = decode_record(state, record)
+        return state_to_data(turn, state)
+
+    def get_game(self, turn):
+        """The Game of the /move request of turn."""
+        return Game(self.get_data(turn))
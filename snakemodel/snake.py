@@ -1,3 +1,4 @@
+from copy import copy
 from enum import Enum
 from .cell import Cell
 
@@ -40,6 +41,17 @@ class Snake:
         self.body = [Cell(coord['x'], coord['y'])
                      for coord in coords['data']]
 
+    @classmethod
+    def from_cells(cls, snake_id, name, health_points, body):
+        """A snake with a body of Cells, from head to tail."""
+        snake = cls.__new__(cls)
+        snake.name = name
+        snake.id = snake_id
+        snake.health_points = health_points
+        snake.head = body[0]
+        snake.body = body
+        return snake
+
     def get_possible_moves(self):
         """
         Map of moves that the snake can make and the resulting head cells.
@@ -55,9 +67,12 @@ class Snake:
         When the snake moves, it's head will move forward in the direction and
         all cells will be shifted forward. If the snake grows, it will become 1
         cell longer at it's tail
+
+        The body is shifted in place and the vacated tail cell is returned.
         """
-        self.head = self.get_possible_moves()[move]
-        self.body = [self.head] + self.body[:-1]
+        self.head = move.apply_move_to_cell(self.head)
+        self.body.insert(0, self.head)
+        return self.body.pop()
 
     def grow(self):
         """
@@ -68,6 +83,27 @@ class Snake:
         """
         self.body.append(self.body[-1])
 
+    def to_data(self):
+        """The snake as the data of a snake in a /move request."""
+        return {
+            "object": "snake",
+            "id": self.id,
+            "name": self.name,
+            "health": self.health_points,
+            "length": len(self.body),
+            "body": {
+                "object": "list",
+                "data": [{"object": "point", "x": cell.x, "y": cell.y}
+                         for cell in self.body],
+            },
+        }
+
+    def copy(self):
+        """Copy the snake with its own body list."""
+        snake = copy(self)
+        snake.body = list(self.body)
+        return snake
+
     def __len__(self):
         return len(self.body)
 
@@ -0,0 +1,126 @@
+import random
+
+
+class SnakeKeys:
+    """Zobrist keys for one snake on a board of a given size."""
+
+    def __init__(self, snake_id, size, health_buckets):
+        generator = random.Random("snake:{}:{}".format(size, snake_id))
+
+        def _keys(count):
+            return [generator.getrandbits(64) for _ in range(count)]
+
+        self.body = _keys(size)
+        self.head = _keys(size)
+        self.tail = _keys(size)
+        self.length = _keys(size + 2)
+        self.health = _keys(health_buckets)
+        self.dead = generator.getrandbits(64)
+
+
+class ZobristKeys:
+    """
+    Random keys used to hash board states, shared by all boards of a size.
+
+    A board hash is the XOR of the keys of its food cells, of every segment,
+    head, tail, length and health bucket of its live snakes, and of a key for
+    every dead snake. Each snake has its own keys, derived from its id, so
+    hashes are the same across processes and evicted keys can be rebuilt.
+    """
+
+    HEALTH_BUCKET = 10
+    MAX_HEALTH = 100
+    MAX_SNAKES = 256
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        generator = random.Random("food:{}x{}".format(width, height))
+        self.food = [generator.getrandbits(64) for _ in range(self.size)]
+        self._snake_keys = {}
+
+    def snake_keys(self, snake_id):
+        """Get the keys for the snake with snake_id."""
+        snake_keys = self._snake_keys.get(snake_id)
+        if snake_keys is None:
+            snake_keys = SnakeKeys(
+                snake_id, self.size,
+                self.MAX_HEALTH // self.HEALTH_BUCKET + 1)
+            if len(self._snake_keys) >= self.MAX_SNAKES:
+                # pop, as another thread may evict the same snake
+                self._snake_keys.pop(next(iter(self._snake_keys)), None)
+            self._snake_keys[snake_id] = snake_keys
+        return snake_keys
+
+    def cell_key(self, keys, cell):
+        """Key of Cell in keys, or 0 if it is outside of the board."""
+        if 0 <= cell.x < self.width and 0 <= cell.y < self.height:
+            return keys[cell.y * self.width + cell.x]
+        return 0
+
+    def health_key(self, snake_keys, health_points):
+        """Key of the health bucket of health_points."""
+        return snake_keys.health[
+            min(max(health_points, 0), self.MAX_HEALTH) // self.HEALTH_BUCKET]
+
+    def snake_hash(self, snake):
+        """Hash of everything about a live snake."""
+        snake_keys = self.snake_keys(snake.id)
+        snake_hash = (self.cell_key(snake_keys.head, snake.head)
+                      ^ self.cell_key(snake_keys.tail, snake.body[-1])
+                      ^ self.length_key(snake_keys, len(snake))
+                      ^ self.health_key(snake_keys, snake.health_points))
+        for cell in snake.body:
+            snake_hash ^= self.cell_key(snake_keys.body, cell)
+        return snake_hash
+
+    def length_key(self, snake_keys, length):
+        """Key of a snake length."""
+        return snake_keys.length[min(length, self.size + 1)]
+
+    def board_hash(self, board):
+        """Hash of a board, computed from scratch."""
+        board_hash = 0
+        for cell in board.food:
+            board_hash ^= self.cell_key(self.food, cell)
+        for snake in board.get_snakes():
+            board_hash ^= self.snake_hash(snake)
+        for dead_snake_id in board.dead_snakes:
+            board_hash ^= self.snake_keys(dead_snake_id).dead
+        return board_hash
+
+    def indexes_hash(self, food_indexes, snakes, dead_snake_ids):
+        """
+        Hash of a board given by flat cell indexes, equal to board_hash.
+
+        snakes are (snake_id, health_points, body indexes) of the live
+        snakes, whose cells must be on the board.
+        """
+        food_keys = self.food
+        board_hash = 0
+        for index in food_indexes:
+            board_hash ^= food_keys[index]
+        for snake_id, health_points, body in snakes:
+            snake_keys = self.snake_keys(snake_id)
+            board_hash ^= (snake_keys.head[body[0]]
+                           ^ snake_keys.tail[body[-1]]
+                           ^ self.length_key(snake_keys, len(body))
+                           ^ self.health_key(snake_keys, health_points))
+            body_keys = snake_keys.body
+            for index in body:
+                board_hash ^= body_keys[index]
+        for dead_snake_id in dead_snake_ids:
+            board_hash ^= self.snake_keys(dead_snake_id).dead
+        return board_hash
+
+
+_zobrist_keys = {}
+
+
+def get_zobrist_keys(width, height):
+    """Get the shared ZobristKeys for boards of width and height."""
+    keys = _zobrist_keys.get((width, height))
+    if keys is None:
+        keys = _zobrist_keys[(width, height)] = ZobristKeys(width, height)
+    return keys
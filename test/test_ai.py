@@ -1,8 +1,50 @@
+import json
+import os
+import tempfile
+from itertools import product
+import time
 import unittest
+from snakeai import common
+from snakemodel.cell import Cell
 from snakemodel.game import Game
 from snakemodel.snake import Move
 from snakeai.snake_ai import SnakeAI
 from snakeai.heuristic import Heuristic
+from snakeai.batch import batch_heuristic
+from snakeai.batch import capture_features
+from snakeai.book import OpeningBook
+from snakeai.book import get_canonical_key
+from snakeai.book import transform_move
+from snakeai.book import write_book
+from snakeai.common import CANT_FIND
+from snakeai.common import get_legal_moves
+from snakeai.common import DistanceField
+from snakeai.common import get_distance_field
+from snakeai.common import get_travel_distance
+from snakeai.common import safe_square_count
+from snakeai.deadline import MOVE_DEADLINE
+from snakeai.deadline import get_queue_delay
+from snakeai.endgame import EndgameSolver
+from snakeai.game_cache import GameCache
+from snakeai.game_cache import get_observed_moves
+from snakeai.mcts import MCTS
+from snakeai.mcts import get_process_pool
+from snakeai.shards import GameShards
+from snakeai.search import NEGATIVE_INFINITY
+from snakeai.search import POSITIVE_INFINITY
+from snakeai.search import SearchEngine
+from snakeai.metrics import MetricsRegistry
+from snakeai.metrics import RequestMetrics
+from snakeai.metrics import SEARCH
+from snakeai.ponder import ActiveRequests
+from snakeai.ponder import Ponderer
+from snakeai.threat import ThreatMap
+from snakeai.transposition import TranspositionTable
+from snakeai.transposition import get_position_key
+from snakeai.voronoi import voronoi_partition
+from snakeai.warmup import parse_game_config
+from snakeai.warmup import warm_up
+from snakemodel.geometry import get_geometry
 from test_util import load_game
 
 
@@ -15,3 +57,596 @@ class TestSnakeAI(unittest.TestCase):
         heuristic = Heuristic()
         snake_ai = SnakeAI(curr_game, heuristic)
         self.assertEqual(snake_ai.best_move(), Move.DOWN.get_move())
+
+    def test_iterative_deepening_deadline(self):
+        """Test that a timed out iteration falls back to the previous one."""
+        curr_game = load_game('test_cases/new_api.json')
+        board = curr_game.board
+        previous_board = load_game('test_cases/new_api.json').board
+        snake_ai = SnakeAI(curr_game, Heuristic())
+        first_move_eval = snake_ai._search(curr_game.you, board, 1)
+        snake_ai.deadline = time.monotonic()
+        self.assertIs(snake_ai._iterative_deepening(
+            curr_game.you, board, 2, first_move_eval), first_move_eval)
+        self.assertEqual(snake_ai.depth_reached, 0)
+        self.assertEqual(board, previous_board)
+
+        heuristic = Heuristic()
+        heuristic.DEPTH = 50
+        snake_ai = SnakeAI(curr_game, heuristic, time_budget=0.06)
+        start = time.monotonic()
+        best_move = snake_ai.best_move()
+        self.assertLess(time.monotonic() - start, 0.06 + 0.05)
+        self.assertLess(snake_ai.depth_reached, heuristic.DEPTH)
+        self.assertIn(Move[best_move.upper()], snake_ai.get_candidate_moves(
+            curr_game.you, board))
+        self.assertEqual(board, previous_board)
+
+    def test_starving_search(self):
+        """Test every search deeper than our snake can starve to."""
+        with open(os.path.join(os.path.dirname(__file__),
+                               'test_cases/new_api.json')) as game_file:
+            data = json.load(game_file)
+        for snake_data in data['snakes']['data'] + [data['you']]:
+            snake_data['health'] = 2
+        data['food']['data'] = []
+        curr_game = Game(data)
+        previous_board = Game(data).board
+        for engine, depth in product(
+                [None, SearchEngine(SearchEngine.PARANOID),
+                 SearchEngine(SearchEngine.MAX_N)], range(2, 5)):
+            heuristic = Heuristic()
+            heuristic.DEPTH = depth
+            snake_ai = SnakeAI(curr_game, heuristic, time_budget=10,
+                               engine=engine)
+            self.assertIn(Move[snake_ai.best_move().upper()], list(Move))
+            self.assertEqual(snake_ai.depth_reached, depth)
+            self.assertEqual(curr_game.board, previous_board)
+
+    def test_evaluation_health_key(self):
+        """Test that evaluations in one health bucket are cached apart."""
+        curr_game = load_game('test_cases/new_api.json')
+        board = curr_game.board
+        snake = board.snakes[curr_game.you]
+        table = TranspositionTable()
+        snake_ai = SnakeAI(curr_game, Heuristic(), transposition_table=table)
+        evaluations = []
+        for health_points in [51, 59]:
+            board._set_health(snake, health_points,
+                              board._get_zobrist_keys())
+            evaluations.append(list(snake_ai.evaluate(curr_game.you, board)))
+        self.assertEqual(table.evaluation_hits, 0)
+        self.assertEqual(table.evaluation_misses, 2)
+        self.assertEqual(evaluations[1], list(
+            Heuristic().heuristic(curr_game.you, board)))
+        self.assertNotEqual(get_position_key(board, curr_game.you),
+                            get_position_key(board, 'missing'))
+
+    def test_voronoi_partition(self):
+        """Test that the Voronoi partition equals one flood fill per head."""
+        test_cases = os.path.join(os.path.dirname(__file__), 'test_cases')
+        for file_name in sorted(os.listdir(test_cases)):
+            with open(os.path.join(test_cases, file_name)) as game_file:
+                board = Game.from_payload(json.load(game_file)).board
+            snakes = board.get_snakes()
+            distances = [DistanceField(board, snake.head).distances
+                         for snake in snakes]
+            territory = {snake.id: 0 for snake in snakes}
+            reachable_food = {snake.id: 0 for snake in snakes}
+            contested = 0
+            for index, cell in enumerate(get_geometry(
+                    board.width, board.height).cells):
+                cell_distances = [snake_distances[index]
+                                  for snake_distances in distances]
+                nearest = min(cell_distances, default=CANT_FIND)
+                if nearest == CANT_FIND or nearest == 0:
+                    continue
+                owners = [snake for snake, distance
+                          in zip(snakes, cell_distances)
+                          if distance == nearest]
+                if len(owners) > 1:
+                    contested += 1
+                    continue
+                territory[owners[0].id] += 1
+                if cell in board.food:
+                    reachable_food[owners[0].id] += 1
+            partition = voronoi_partition(board)
+            self.assertEqual(partition.territory, territory, file_name)
+            self.assertEqual(partition.reachable_food, reachable_food,
+                             file_name)
+            self.assertEqual(partition.contested, contested, file_name)
+
+    def test_distance_field(self):
+        """Test that a DistanceField answers like the flood fill and a*."""
+        full_game = Game({
+            'width': 3, 'height': 3, 'id': 'full', 'turn': 0,
+            'food': {'data': []},
+            'snakes': {'data': [{
+                'id': 'full', 'name': 'full', 'health': 100,
+                'body': {'data': [
+                    {'x': x, 'y': y} for x, y in [
+                        (1, 1), (1, 0), (0, 0), (0, 1), (0, 2), (1, 2),
+                        (2, 2), (2, 1), (2, 0)]]}}]},
+            'you': {'id': 'full'}})
+        games = [load_game(file_name) for file_name in [
+            'test_cases/new_api.json', 'test_cases/isolated.json',
+            'test_cases/diagonal_head2.json']] + [full_game]
+        for curr_game in games:
+            board = curr_game.board
+            cells = get_geometry(board.width, board.height).cells
+            for snake in board.get_snakes():
+                for source in [snake.head] + list(
+                        snake.get_possible_moves().values()):
+                    distance_field = get_distance_field(board, source)
+                    self.assertEqual(distance_field.reachable_count,
+                                     safe_square_count(board, source))
+                    for cell in cells:
+                        self.assertEqual(
+                            distance_field.distance_to(cell),
+                            get_travel_distance(board, source, cell))
+        self.assertEqual(DistanceField(
+            full_game.board, Cell(1, 1)).reachable_count, 1)
+        self.assertEqual(get_travel_distance(
+            full_game.board, Cell(1, 1), Cell(0, 0)), CANT_FIND)
+
+        board = games[0].board
+        max_distance_fields = common.MAX_DISTANCE_FIELDS
+        common.MAX_DISTANCE_FIELDS = 2
+        try:
+            common._distance_fields.clear()
+            first_field = get_distance_field(board, Cell(0, 0))
+            get_distance_field(board, Cell(0, 1))
+            self.assertIs(get_distance_field(board, Cell(0, 0)), first_field)
+            get_distance_field(board, Cell(0, 2))
+            self.assertEqual(len(common._distance_fields), 2)
+            self.assertIs(get_distance_field(board, Cell(0, 0)), first_field)
+            self.assertIsNot(get_distance_field(board, Cell(0, 1)),
+                             get_distance_field(board, Cell(0, 2)))
+        finally:
+            common.MAX_DISTANCE_FIELDS = max_distance_fields
+            common._distance_fields.clear()
+
+    def test_alpha_beta(self):
+        """Test that alpha-beta pruning finds the plain minimax value."""
+        cutoffs = 0
+        for file_name in ['test_cases/capture.json',
+                          'test_cases/isolated.json',
+                          'test_cases/snake_dead2.json']:
+            curr_game = load_game(file_name)
+            board = curr_game.board
+            snake_ai = SnakeAI(curr_game, Heuristic())
+            engine = SearchEngine(SearchEngine.PARANOID)
+            opponent_ids = engine.get_opponent_ids(curr_game.you, board)
+            for depth in range(1, 4):
+                self.assertEqual(
+                    engine.search(snake_ai, curr_game.you, board,
+                                  depth).evaluation,
+                    self._minimax(snake_ai, engine, board, curr_game.you,
+                                  opponent_ids, depth), file_name)
+                cutoffs += engine.stats.cutoffs
+        self.assertGreater(cutoffs, 0)
+
+    def _minimax(self, snake_ai, engine, board, snake_id, opponent_ids,
+                 depth):
+        """Paranoid value of board for snake_id, without pruning."""
+        if depth <= 0 or snake_id not in board.snakes:
+            return tuple(snake_ai.evaluate(snake_id, board))
+        opponent_ids = [opponent_id for opponent_id in opponent_ids
+                        if opponent_id in board.snakes]
+        best_value = NEGATIVE_INFINITY
+        for move in engine.get_moves(snake_id, board):
+            worst_value = POSITIVE_INFINITY
+            for joint_move in product(*[engine.get_moves(opponent_id, board)
+                                        for opponent_id in opponent_ids]):
+                snake_id_move_mapping = dict(zip(opponent_ids, joint_move))
+                snake_id_move_mapping[snake_id] = move
+                record = board.apply_moves(snake_id_move_mapping)
+                worst_value = min(worst_value, self._minimax(
+                    snake_ai, engine, board, snake_id, opponent_ids,
+                    depth - 1))
+                board.undo(record)
+            best_value = max(best_value, worst_value)
+        return best_value
+
+    def test_search_engine_capture(self):
+        """Test that both engine modes capture a cornered, shorter snake."""
+        curr_game = load_game('test_cases/capture.json')
+        board = curr_game.board
+        space_heuristic = Heuristic()
+        for mode in [SearchEngine.PARANOID, SearchEngine.MAX_N]:
+            for depth in range(1, 4):
+                heuristic = Heuristic(tasks=[space_heuristic.space_score])
+                heuristic.DEPTH = depth
+                snake_ai = SnakeAI(curr_game, heuristic,
+                                   engine=SearchEngine(mode), endgame=False)
+                self.assertEqual(snake_ai.best_move(), Move.LEFT.get_move(),
+                                 (mode, depth))
+        # The default search, where the cornered snake's replies kill it
+        for depth in range(1, 5):
+            heuristic = Heuristic(tasks=[space_heuristic.space_score])
+            heuristic.DEPTH = depth
+            snake_ai = SnakeAI(curr_game, heuristic, time_budget=10,
+                               endgame=False)
+            self.assertIn(Move[snake_ai.best_move().upper()],
+                          snake_ai.get_candidate_moves(curr_game.you, board))
+            self.assertEqual(snake_ai.depth_reached, depth)
+
+        engine = SearchEngine(SearchEngine.PARANOID, max_opponents=0)
+        self.assertEqual(engine.get_opponent_ids(curr_game.you, board), [])
+        engine = SearchEngine(SearchEngine.PARANOID, opponent_radius=1)
+        self.assertEqual(engine.get_opponent_ids(curr_game.you, board), [])
+        engine = SearchEngine(SearchEngine.PARANOID)
+        self.assertEqual(engine.get_opponent_ids(curr_game.you, board),
+                         ['cornered'])
+        self.assertEqual(engine.get_moves(curr_game.you, board),
+                         [Move.DOWN, Move.LEFT])
+        engine._history[(curr_game.you, Move.LEFT)] += 1
+        self.assertEqual(engine.get_moves(curr_game.you, board),
+                         [Move.LEFT, Move.DOWN])
+        self.assertEqual(engine.get_moves(curr_game.you, board, Move.DOWN),
+                         [Move.DOWN, Move.LEFT])
+
+    def test_mcts(self):
+        """Test that MCTS plays legal moves within budget, in every mode."""
+        for workers, parallelism in [(1, MCTS.ROOT), (2, MCTS.ROOT),
+                                     (2, MCTS.TREE)]:
+            # The first search of a mode starts its process pool
+            MCTS(load_game('test_cases/new_api.json'), time_budget=0.01,
+                 workers=workers, parallelism=parallelism, seed=0).best_move()
+            for file_name in ['test_cases/new_api.json',
+                              'test_cases/snake_dead2.json']:
+                curr_game = load_game(file_name)
+                mcts = MCTS(curr_game, time_budget=0.05, workers=workers,
+                            parallelism=parallelism, seed=0)
+                start = time.monotonic()
+                best_move = mcts.best_move()
+                self.assertLess(time.monotonic() - start, 0.05 + 0.03)
+                self.assertIn(Move[best_move.upper()], get_legal_moves(
+                    curr_game.board, curr_game.you))
+                self.assertGreater(mcts.playouts, 0)
+                self.assertEqual(mcts.root.visits, mcts.playouts)
+                self.assertEqual(
+                    sum(mcts._get_move_visits(
+                        mcts.root, curr_game.you).values()),
+                    mcts.root.visits)
+                self.assertTrue(mcts.root.children)
+
+        # Another search's jobs hold every worker of the pool past the budget
+        for parallelism in [MCTS.ROOT, MCTS.TREE]:
+            curr_game = load_game('test_cases/new_api.json')
+            busy_futures = [get_process_pool(2).submit(time.sleep, 0.2)
+                            for _ in range(2)]
+            mcts = MCTS(curr_game, time_budget=0.05, workers=2,
+                        parallelism=parallelism, seed=0)
+            start = time.monotonic()
+            best_move = mcts.best_move()
+            self.assertLess(time.monotonic() - start, 0.05 + 0.03)
+            self.assertIn(Move[best_move.upper()], get_legal_moves(
+                curr_game.board, curr_game.you))
+            self.assertEqual(mcts.root.visits, mcts.playouts)
+            for future in busy_futures:
+                future.result()
+
+    def test_game_cache(self):
+        """Test LRU and idle eviction of the GameStates of games."""
+        game_cache = GameCache(max_games=2)
+        first_state = game_cache.get('first', 'you')
+        game_cache.get('second', 'you')
+        self.assertIs(game_cache.get('first', 'you'), first_state)
+        game_cache.get('third', 'you')
+        self.assertEqual(len(game_cache), 2)
+        self.assertIs(game_cache.get('first', 'you'), first_state)
+        self.assertEqual(game_cache.stats()['evictions'], 1)
+        game_cache.get('second', 'you')
+        self.assertEqual(game_cache.stats()['misses'], 4)
+        game_cache.end_game('second')
+        self.assertEqual(len(game_cache), 1)
+
+        game_cache = GameCache(ttl=0.01)
+        first_state = game_cache.get('first', 'you')
+        time.sleep(0.02)
+        game_cache.get('second', 'you')
+        self.assertEqual(len(game_cache), 1)
+        self.assertIsNot(game_cache.get('first', 'you'), first_state)
+
+        game_cache = GameCache(max_games=0)
+        self.assertIsNone(game_cache.get('first', 'you'))
+        self.assertIsNone(game_cache.advance(
+            'first', 'you', load_game('test_cases/new_api.json').board))
+        self.assertEqual(len(game_cache), 0)
+
+    def test_game_shards(self):
+        """Test that the calls of a game run in one process of the shards."""
+        game_shards = GameShards(2)
+        try:
+            pids = {game_id: game_shards.call(game_id, os.getpid)
+                    for game_id in range(8)}
+            self.assertEqual(len(set(pids.values())), 2)
+            self.assertNotIn(os.getpid(), pids.values())
+            for game_id, pid in pids.items():
+                self.assertEqual(game_shards.call(game_id, os.getpid), pid)
+            self.assertEqual(game_shards.call(0, divmod, 7, 2), (3, 1))
+            with self.assertRaises(ZeroDivisionError):
+                game_shards.call(0, divmod, 7, 0)
+            self.assertEqual(game_shards.call(0, os.getpid), pids[0])
+        finally:
+            game_shards.close()
+
+    def test_subtree_reuse(self):
+        """Test that the next turn starts from the subtree of its moves."""
+        for workers, parallelism in [(1, MCTS.ROOT), (2, MCTS.ROOT),
+                                     (2, MCTS.TREE)]:
+            curr_game = load_game('test_cases/new_api.json')
+            game_cache = GameCache()
+            game_state = game_cache.advance('reuse', curr_game.you,
+                                            curr_game.board)
+            self.assertIsNone(game_state.mcts_root)
+            mcts = MCTS(curr_game, time_budget=0.05, workers=workers,
+                        parallelism=parallelism, seed=0)
+            mcts.best_move()
+            game_state.record_search(curr_game.board, mcts.root)
+            key, child = max(mcts.root.children.items(),
+                             key=lambda item: item[1].visits)
+            next_board = curr_game.board.copy()
+            next_board.apply_moves({snake_id: Move[move_name]
+                                    for snake_id, move_name in key})
+            self.assertEqual(get_observed_moves(curr_game.board, next_board),
+                             {snake_id: move_name
+                              for snake_id, move_name in key
+                              if snake_id in next_board.snakes})
+            game_state = game_cache.advance('reuse', curr_game.you,
+                                            next_board)
+            self.assertIs(game_state.mcts_root, child)
+            self.assertTrue(game_state.reused_subtree)
+            self.assertEqual(game_cache.stats()['subtree_reuses'], 1)
+            next_game = load_game('test_cases/new_api.json')
+            next_game.board = next_board
+            mcts = MCTS(next_game, time_budget=0.05, workers=workers,
+                        parallelism=parallelism, seed=0,
+                        root=game_state.mcts_root)
+            visits = child.visits
+            mcts.best_move()
+            self.assertEqual(mcts.root.visits, visits + mcts.playouts)
+
+            game_state.record_search(next_board, mcts.root)
+            skipped_board = next_board.copy()
+            for _ in range(2):
+                skipped_board.apply_moves({
+                    snake_id: Move[move_name] for snake_id, move_name in key
+                    if snake_id in skipped_board.snakes})
+            self.assertIsNone(get_observed_moves(next_board, skipped_board))
+            game_state = game_cache.advance('reuse', curr_game.you,
+                                            skipped_board)
+            self.assertIsNone(game_state.mcts_root)
+            self.assertFalse(game_state.reused_subtree)
+
+    def test_pondering(self):
+        """Test that pondering stops when cancelled and its tree is reused."""
+        curr_game = load_game('test_cases/new_api.json')
+        game_cache = GameCache()
+        game_state = game_cache.advance('ponder', curr_game.you,
+                                        curr_game.board)
+        mcts = MCTS(curr_game, time_budget=0.03, workers=1, seed=0)
+        move = Move[mcts.best_move().upper()]
+        game_state.record_search(curr_game.board, mcts.root)
+        # The board is searched in place while pondering, so the next board
+        # is made first, from a joint move with our move that kills no one
+        for key, child in mcts.root.children.items():
+            next_board = curr_game.board.copy()
+            next_board.apply_moves({snake_id: Move[move_name]
+                                    for snake_id, move_name in key})
+            if ((curr_game.you, move.name) in key
+                    and len(next_board.snakes) == len(key)):
+                break
+        visits = child.visits
+        self.assertTrue(game_state.start_pondering(mcts, move))
+        ponderer = game_state.ponderer
+        time.sleep(0.05)
+        self.assertTrue(ponderer._thread.is_alive())
+        game_state = game_cache.advance('ponder', curr_game.you, next_board)
+        self.assertFalse(ponderer._thread.is_alive())
+        self.assertTrue(game_state.pondered)
+        self.assertIs(game_state.mcts_root, child)
+        self.assertGreater(child.visits, visits)
+        self.assertTrue(game_state.pre_searched)
+        self.assertEqual(game_cache.stats()['ponder_hits'], 1)
+        self.assertFalse(game_state.start_pondering(mcts, move))
+        self.assertIsNone(game_state.ponderer)
+
+        ponderer = Ponderer(mcts, move, max_time=0.02)
+        ponderer.start()
+        ponderer._thread.join(1.0)
+        self.assertFalse(ponderer._thread.is_alive())
+        active_requests = ActiveRequests()
+        mcts = MCTS(curr_game, workers=1, seed=0)
+        with active_requests:
+            ponderer = Ponderer(mcts, move, active_requests)
+            ponderer.start()
+            ponderer._thread.join(1.0)
+        self.assertFalse(ponderer._thread.is_alive())
+        self.assertEqual(mcts.root.visits, 0)
+
+    def test_threat_map(self):
+        """Test that moves next to a longer snake's head are unsafe."""
+        curr_game = load_game('test_cases/diagonal_head2.json')
+        board = curr_game.board
+        threat_map = ThreatMap(board)
+        possible_moves = board.snakes[curr_game.you].get_possible_moves()
+        self.assertTrue(threat_map.is_body(possible_moves[Move.UP]))
+        self.assertEqual(threat_map.contender_length(
+            possible_moves[Move.DOWN], curr_game.you), 37)
+        self.assertFalse(any(
+            threat_map.is_safe(head_cell, curr_game.you)
+            for head_cell in possible_moves.values()))
+
+    def test_lazy_heuristic(self):
+        """Test that lazy evaluation computes tiers in order, on demand."""
+        curr_game = load_game('test_cases/diagonal_head2.json')
+        board = curr_game.board
+        heuristic = Heuristic()
+        lazy_eval = heuristic.lazy_heuristic(curr_game.you, board)
+        self.assertFalse(lazy_eval.is_computed(0))
+        lazy_eval.get_tier(0, board)
+        self.assertFalse(lazy_eval.is_computed(1))
+        self.assertEqual(list(lazy_eval.as_array(board)),
+                         list(heuristic.heuristic(curr_game.you, board)))
+
+    def test_batch_heuristic(self):
+        """Test that batched evaluations equal per board evaluations."""
+        curr_game = load_game('test_cases/diagonal_head2.json')
+        board = curr_game.board
+        heuristic = Heuristic()
+        features = []
+        evaluations = []
+        for move in Move:
+            record = board.apply_moves({curr_game.you: move})
+            features.append(capture_features(board, curr_game.you))
+            evaluations.append(list(heuristic.heuristic(curr_game.you, board)))
+            board.undo(record)
+        self.assertEqual(
+            [list(evaluation)
+             for evaluation in batch_heuristic(heuristic, features)],
+            evaluations)
+
+    def test_batch_frontier(self):
+        """Test that batching a node's frontier leaves the search unchanged."""
+        curr_game = load_game('test_cases/new_api.json')
+        board = curr_game.board
+        snake_ai = SnakeAI(curr_game, Heuristic(), batch_evaluation=True)
+        snake_ai.MIN_BATCH = 1
+        table = snake_ai.transposition_table
+        candidate_moves = snake_ai.get_candidate_moves(curr_game.you, board)
+        snake_ai._evaluate_frontier(curr_game.you, board, candidate_moves)
+        for move in candidate_moves:
+            record = board.apply_moves({curr_game.you: move})
+            lazy_eval = table.get_evaluation(
+                get_position_key(board, curr_game.you))
+            self.assertTrue(lazy_eval.is_computed(2))
+            board.undo(record)
+        for file_name in ['test_cases/new_api.json',
+                          'test_cases/snake_dead2.json']:
+            curr_game = load_game(file_name)
+            for depth in range(2, 4):
+                move_evals = []
+                for batch_evaluation in [False, True]:
+                    snake_ai = SnakeAI(curr_game, Heuristic(),
+                                       batch_evaluation=batch_evaluation)
+                    snake_ai.MIN_BATCH = 1
+                    move_evals.append(snake_ai._search(
+                        curr_game.you, curr_game.board, depth))
+                self.assertEqual(move_evals[0].move, move_evals[1].move)
+                self.assertEqual(list(move_evals[0].evaluation),
+                                 list(move_evals[1].evaluation))
+
+    def test_request_metrics(self):
+        """Test that a search is recorded and rendered as histograms."""
+        curr_game = load_game('test_cases/new_api.json')
+        request_metrics = RequestMetrics()
+        snake_ai = SnakeAI(curr_game, Heuristic(), metrics=request_metrics)
+        snake_ai.best_move()
+        request_metrics.finish()
+        self.assertGreater(request_metrics.phase_times[SEARCH], 0)
+        self.assertGreater(request_metrics.nodes, 0)
+        self.assertEqual(request_metrics.depth, snake_ai.depth_reached)
+        self.assertIn('space_score', request_metrics.tier_times)
+        registry = MetricsRegistry()
+        registry.observe(request_metrics)
+        text = registry.render()
+        self.assertIn('snake_move_phase_seconds_count{phase="search"} 1',
+                      text)
+        self.assertIn('snake_move_seconds_bucket{le="+Inf"} 1', text)
+
+    def test_endgame(self):
+        """Test that an isolated snake avoids a dead end in its region."""
+        curr_game = load_game('test_cases/isolated.json')
+        solver = EndgameSolver(curr_game.board, curr_game.you)
+        self.assertTrue(solver.isolated)
+        self.assertEqual(solver.solve(), {Move.UP: 1, Move.RIGHT: 9})
+        self.assertTrue(solver.exact)
+        snake_ai = SnakeAI(curr_game, Heuristic())
+        self.assertEqual(snake_ai.best_move(), Move.RIGHT.get_move())
+        other_game = load_game('test_cases/new_api.json')
+        self.assertFalse(
+            EndgameSolver(other_game.board, other_game.you).isolated)
+
+    def test_timed_reachability(self):
+        """Test that timed flood fills pass through cells as they vacate."""
+        curr_game = load_game('test_cases/isolated.json')
+        board = curr_game.board
+        head = board.snakes[curr_game.you].head
+        self.assertEqual(safe_square_count(board, head), 7)
+        self.assertEqual(safe_square_count(board, head, timed=True), 25)
+        self.assertEqual(get_travel_distance(board, head, Cell(3, 0)),
+                         CANT_FIND)
+        self.assertEqual(
+            get_travel_distance(board, head, Cell(3, 0), timed=True), 4)
+
+    def test_deadline_degradation(self):
+        """Test that queueing delay shrinks the search down to a safe move."""
+        now = 1500000000.1
+        for request_start in ['t=1500000000050', '1500000000.05',
+                              't=1500000000050000']:
+            self.assertAlmostEqual(get_queue_delay(request_start, now),
+                                   0.05, places=3)
+        self.assertEqual(get_queue_delay('t=1400000000000', now),
+                         MOVE_DEADLINE)
+        self.assertEqual(get_queue_delay('soon', now), 0.0)
+        curr_game = load_game('test_cases/isolated.json')
+        request_metrics = RequestMetrics()
+        snake_ai = SnakeAI(curr_game, Heuristic(), time_budget=0.01,
+                           metrics=request_metrics)
+        self.assertEqual(snake_ai.best_move(), Move.RIGHT.get_move())
+        self.assertEqual(request_metrics.mode, SnakeAI.SAFE_MOVE)
+        self.assertEqual(request_metrics.nodes, 0)
+        self.assertEqual(
+            SnakeAI(curr_game, Heuristic(), time_budget=0.03).get_mode(),
+            SnakeAI.SHALLOW)
+
+    def test_warm_up(self):
+        """Test that /start data is parsed and its board size warmed up."""
+        config = parse_game_config(
+            {'game_id': 'warm', 'width': 13, 'height': 9})
+        self.assertEqual(config.snake_ids, [])
+        self.assertIsNone(config.you)
+        timings = warm_up(config, Heuristic())
+        self.assertEqual(list(timings), ['geometry', 'board', 'search'])
+        self.assertIsNotNone(get_geometry(13, 9)._distances)
+        with open(os.path.join(os.path.dirname(__file__),
+                               'test_cases/new_api.json')) as game_file:
+            config = parse_game_config(json.load(game_file))
+        self.assertEqual((config.width, config.height), (18, 17))
+        self.assertIn(config.you, config.snake_ids)
+        self.assertIsNone(parse_game_config({'game_id': 'unsized'}))
+
+    def test_opening_book(self):
+        """Test that book moves are looked up from any symmetry of a board."""
+        curr_game = load_game('test_cases/isolated.json')
+        board = curr_game.board
+        key, transform = get_canonical_key(board, curr_game.you)
+        flipped_game = load_game('test_cases/isolated.json')
+        flipped_board = flipped_game.board
+        for snake in flipped_board.snakes.values():
+            snake.body = [Cell(board.width - 1 - cell.x, cell.y)
+                          for cell in snake.body]
+            snake.head = snake.body[0]
+        flipped_board.food = set(Cell(board.width - 1 - cell.x, cell.y)
+                                 for cell in board.food)
+        self.assertEqual(get_canonical_key(flipped_board, curr_game.you)[0],
+                         key)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'opening.book')
+            write_book(path, {key: transform_move(transform, Move.UP),
+                              key + 1: Move.DOWN}, 10)
+            book = OpeningBook(path)
+            self.assertEqual(len(book), 2)
+            self.assertEqual(book.get_move(flipped_board, curr_game.you, 30),
+                             None)
+            self.assertEqual(book.get_move(flipped_board, curr_game.you, 5),
+                             Move.UP)
+            curr_game.turn = 5
+            request_metrics = RequestMetrics()
+            snake_ai = SnakeAI(curr_game, Heuristic(), book=book,
+                               metrics=request_metrics)
+            self.assertEqual(snake_ai.best_move(), Move.UP.get_move())
+            self.assertEqual(request_metrics.mode, SnakeAI.BOOK)
+            del book, snake_ai
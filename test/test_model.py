@@ -1,4 +1,20 @@
+import json
+import os
+import random
+import tempfile
 import unittest
+import numpy as np
+from snakemodel.board import Board
+from snakemodel.board import EntityId
+from snakemodel.batch_board import BatchBoard
+from snakemodel.batch_board import MOVES
+from snakemodel.cell import Cell
+from snakemodel.game import Game
+from snakemodel.geometry import get_geometry
+from snakemodel.replay import ReplayLogger
+from snakemodel.replay import ReplayReader
+from snakemodel.replay import ReplayWriter
+from snakemodel.replay import get_replay_path
 from snakemodel.snake import Move
 from test_util import load_game
 
@@ -19,3 +35,189 @@ class TestBoardTransition(unittest.TestCase):
                  curr_game.get_other_snake_ids(me)[1]: Move.DOWN}
             ),
             next_game.board)
+
+    def test_apply_moves_undo(self):
+        """Test undoing applied moves restores an equal board."""
+        curr_game = load_game('test_cases/snake_dead2.json')
+        prev_game = load_game('test_cases/snake_dead2.json')
+        me = curr_game.you
+        record = curr_game.board.apply_moves(
+            {me: Move.DOWN,
+             curr_game.get_other_snake_ids(me)[0]: Move.RIGHT,
+             curr_game.get_other_snake_ids(me)[1]: Move.DOWN})
+        self.assertNotEqual(curr_game.board, prev_game.board)
+        curr_game.board.undo(record)
+        self.assertEqual(curr_game.board, prev_game.board)
+
+    def test_incremental_zobrist_hash(self):
+        """Test random steps keep the hash equal to one from scratch."""
+        generator = random.Random(0)
+        for file_name in ['test_cases/snake_dead2.json',
+                          'test_cases/new_api.json',
+                          'test_cases/isolated.json']:
+            for seed in range(10):
+                board = load_game(file_name).board
+                board.rng = random.Random(seed)
+                zobrist_keys = board._get_zobrist_keys()
+                history = []
+                while len(board.snakes) > 1 and len(history) < 100:
+                    previous_board = board.copy()
+                    history.append((previous_board, board.apply_moves(
+                        {snake_id: self._random_move(board, snake, generator)
+                         for snake_id, snake in board.snakes.items()})))
+                    self.assertEqual(board.zobrist_hash,
+                                     zobrist_keys.board_hash(board))
+                for previous_board, record in reversed(history):
+                    board.undo(record)
+                    self.assertEqual(board, previous_board)
+                    self.assertEqual(board.zobrist_hash,
+                                     zobrist_keys.board_hash(board))
+
+    def _random_move(self, board, snake, generator):
+        """A random move onto a free cell, or any move if there is none."""
+        free_moves = [
+            move for move, cell in snake.get_possible_moves().items()
+            if board.cell_within_bounds(cell)
+            and board.get_entity_at_cell(cell) in [EntityId.EMPTY,
+                                                   EntityId.FOOD]]
+        return generator.choice(free_moves or list(Move))
+
+    def test_batch_board_conformance(self):
+        """Test BatchBoard steps games like Board.update_board."""
+        generator = np.random.RandomState(0)
+        boards = [load_game(test_case).board
+                  for test_case in ['test_cases/snake_dead2.json'] * 4]
+        snake_ids = list(boards[0].snakes)
+        batch_board = BatchBoard.from_boards(boards, snake_ids)
+        for _ in range(30):
+            moves = batch_board.random_moves(generator)
+            batch_board.step(moves)
+            for game, board in enumerate(boards):
+                board.update_board(
+                    {snake_id: MOVES[moves[game, snake_index]]
+                     for snake_index, snake_id in enumerate(snake_ids)
+                     if snake_id in board.snakes})
+                for snake_index, snake_id in enumerate(snake_ids):
+                    snake = board.snakes.get(snake_id)
+                    self.assertEqual(snake is not None,
+                                     batch_board.alive[game, snake_index])
+                    if snake is not None:
+                        self.assertEqual(
+                            [(cell.x, cell.y) for cell in snake.body],
+                            batch_board.get_body(game, snake_index))
+                        self.assertEqual(
+                            snake.health_points,
+                            batch_board.health[game, snake_index])
+                self.assertEqual(board.occupancy,
+                                 list(batch_board.occupancy[game]))
+                self.assertEqual(
+                    sorted(board.cell_index(cell) for cell in board.food),
+                    list(np.nonzero(batch_board.food[game])[0]))
+
+    def test_to_data(self):
+        """Test that a board parsed from its data equals the board."""
+        curr_game = load_game('test_cases/snake_dead2.json')
+        self.assertEqual(Board(curr_game.board.to_data()), curr_game.board)
+
+    def test_spawn_food(self):
+        """Test seeded food spawns on the same empty cell, and is hashed."""
+        boards = [load_game('test_cases/snake_dead2.json').board
+                  for _ in range(2)]
+        food_cells = []
+        for board in boards:
+            board.rng = random.Random(0)
+            food_cells.append(board._spawn_food())
+        self.assertEqual(food_cells[0], food_cells[1])
+        self.assertIn(food_cells[0], boards[0].food)
+        self.assertEqual(Board(boards[0].to_data()).zobrist_hash,
+                         boards[0].zobrist_hash)
+
+    def test_from_payload(self):
+        """Test that the fast parse reads both formats into equal boards."""
+        for file_name in ['test_cases/snake_dead2.json',
+                          'test_cases/new_api.json']:
+            curr_game = load_game(file_name)
+            with open(os.path.join(os.path.dirname(__file__),
+                                   file_name), 'rb') as game_file:
+                fast_game = Game.from_payload(game_file.read())
+            self.assertEqual(fast_game.board, curr_game.board)
+            self.assertEqual(fast_game.snake_ids, curr_game.snake_ids)
+            self.assertEqual(fast_game.you, curr_game.you)
+        legacy_file = os.path.join(os.path.dirname(__file__),
+                                   'test_cases/simple_move.json')
+        with open(legacy_file, 'r') as game_file:
+            legacy_data = json.load(game_file)
+        legacy_game = Game.from_payload(legacy_data)
+        self.assertEqual(legacy_game.you, legacy_data['you'])
+        for snake_data in legacy_data['snakes']:
+            snake = legacy_game.board.snakes[snake_data['id']]
+            self.assertEqual(snake.health_points, snake_data['health_points'])
+            self.assertEqual([(cell.x, cell.y) for cell in snake.body],
+                             [tuple(coord) for coord in snake_data['coords']])
+        self.assertEqual(Board(legacy_game.board.to_data()),
+                         legacy_game.board)
+
+    def test_geometry(self):
+        """Test the interned cells, neighbour tables and distances."""
+        geometry = get_geometry(3, 2)
+        self.assertIs(get_geometry(3, 2), geometry)
+        self.assertIs(geometry.cell(2, 1), geometry.cells[5])
+        self.assertEqual(geometry.cell(3, 1), Cell(3, 1))
+        self.assertEqual(sorted(geometry.neighbours[0]), [1, 3])
+        self.assertEqual([move for move, _ in geometry.moves[4]],
+                         [Move.UP, Move.RIGHT, Move.LEFT])
+        self.assertEqual(geometry.distances[0, 5], 3)
+        self.assertEqual(sorted([Cell(1, 0), Cell(0, 1), Cell(0, 0)]),
+                         [Cell(0, 0), Cell(0, 1), Cell(1, 0)])
+
+    def test_replay(self):
+        """Test that every turn of a delta encoded replay is reconstructed."""
+        curr_game = load_game('test_cases/snake_dead2.json')
+        board = curr_game.board
+        board.rng = random.Random(0)
+        datas = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'game.replay')
+            writer = ReplayWriter(path)
+            for turn in range(6):
+                datas.append(board.to_data(turn, you=curr_game.you))
+                writer.write(datas[-1], 'up')
+                board.update_board({snake_id: Move.LEFT
+                                    for snake_id in board.snakes})
+                board._spawn_food()
+            writer.close()
+            reader = ReplayReader(path)
+        self.assertEqual(reader.turns, list(range(6)))
+        self.assertIn('food+', reader.records[1])
+        for turn, data in enumerate(datas):
+            self.assertEqual(reader.get_game(turn).board, Board(data))
+            self.assertEqual(reader.get_move(turn), 'up')
+
+    def test_replay_logger(self):
+        """Test that a bad record is counted and the later ones written."""
+        curr_game = load_game('test_cases/snake_dead2.json')
+        board = curr_game.board
+        legacy_file = os.path.join(os.path.dirname(__file__),
+                                   'test_cases/simple_move.json')
+        with open(legacy_file, 'r') as game_file:
+            legacy_data = json.load(game_file)
+        datas = [board.to_data(turn, you=curr_game.you)
+                 for turn in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            logger = ReplayLogger(directory)
+            logger.log(datas[0], 'up')
+            logger.log({'turn': 1, 'you': {}}, 'up')
+            logger.log(legacy_data, 'down')
+            for data in datas[1:]:
+                logger.log(data, 'left')
+            logger.close()
+            reader = ReplayReader(get_replay_path(
+                directory, datas[0]['id'], curr_game.you))
+            legacy_reader = ReplayReader(get_replay_path(
+                directory, legacy_data['game_id'], legacy_data['you']))
+        self.assertEqual(logger.failed, 1)
+        self.assertEqual(reader.turns, [0, 1, 2])
+        self.assertEqual(reader.get_game(2).board, board)
+        self.assertEqual(legacy_reader.get_move(1), 'down')
+        self.assertEqual(legacy_reader.get_game(1).board,
+                         Game.from_payload(legacy_data).board)